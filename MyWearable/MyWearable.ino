@@ -22,6 +22,12 @@ int16_t ax, ay, az, gx, gy, gz, tp;         // IMU data variables
 const unsigned long sampling_period[] = {10000, 20000, 200000, 500000, 10000000};
 unsigned long current_sampling_period = 0;
 unsigned int sample_count = 0;
+bool binaryMode = false;                    // false == "%8lu,%5lu;" text frames, true == binary frames
+unsigned long lastTimestamp = 0;            // timestamp of the last sample sent (for the deltas)
+
+// Binary frame: sync | delta timestamp (uint24, us) | L1 norm (uint16) | XOR checksum
+const uint8_t FRAME_SYNC = 0xA5;
+const int FRAME_SIZE = 7;
 
 // Button Variables
 const int buttonPin = 3;                    // button interrupt pin
@@ -82,6 +88,15 @@ bool readBLE() {
     // All of our messages will terminate with ';' instead of a newline
     if (c == ';') {
       in_text[i] = '\0'; // terminate the string
+
+      // change the frame format on the whole command only ("CFB;" binary, "CFA;"
+      // text): a lone 'A' or 'B' (e.g. the "AT" of the handshake) keeps the format
+      if (i >= 3 && (strcmp(in_text + i - 3, "CFB") == 0 || strcmp(in_text + i - 3, "CFA") == 0)) {
+        binaryMode = (in_text[i - 1] == 'B');
+        hm10.flushOutput();
+        Serial.print("Binary frames: ");
+        Serial.println(binaryMode);
+      }
       i = 0;
       return true;
     }
@@ -218,13 +233,40 @@ void sendAccelL1Norm()
   l1_norm += abs(ay);
   l1_norm += abs(az);
 
-  // formatting data before sending
-  char msg[16] = {0};
-  sprintf(msg, "%8lu,%5lu;", startPeriod, l1_norm);
+  if (binaryMode) {
+    sendBinaryFrame(startPeriod - lastTimestamp, l1_norm);
+  }
+  else {
+    // formatting data before sending
+    char msg[16] = {0};
+    sprintf(msg, "%8lu,%5lu;", startPeriod, l1_norm);
+
+    // send to BLE and print to Serial to check
+    hm10.print(msg);
+    Serial.println(msg);
+  }
+  lastTimestamp = startPeriod;
+}
 
-  // send to BLE and print to Serial to check
-  hm10.print(msg);
-  Serial.println(msg);
+// --------------------------------------------------------------------------------
+// Function to send one sample as a 7-byte binary frame (little-endian fields).
+// The delta and the L1-Norm saturate at the largest value their field can hold.
+// --------------------------------------------------------------------------------
+void sendBinaryFrame(unsigned long delta, unsigned long l1_norm)
+{
+  if (delta > 0xFFFFFFUL) delta = 0xFFFFFFUL;
+  if (l1_norm > 0xFFFFUL) l1_norm = 0xFFFFUL;
+
+  uint8_t frame[FRAME_SIZE];
+  frame[0] = FRAME_SYNC;
+  frame[1] = delta & 0xFF;
+  frame[2] = (delta >> 8) & 0xFF;
+  frame[3] = (delta >> 16) & 0xFF;
+  frame[4] = l1_norm & 0xFF;
+  frame[5] = (l1_norm >> 8) & 0xFF;
+  frame[6] = frame[1] ^ frame[2] ^ frame[3] ^ frame[4] ^ frame[5];
+
+  hm10.write(frame, FRAME_SIZE);
 }
 
 
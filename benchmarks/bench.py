@@ -0,0 +1,339 @@
+# Imports
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, strftime
+import numpy as np
+import scipy
+from my_wearable.ble import BLE
+from my_wearable.frames import TextDecoder
+from my_wearable.pedometer import Pedometer
+from my_wearable.multistream import MultiStreamFilter
+from my_wearable.service import StepService
+from my_wearable.store import SessionStore
+from my_wearable.streaming import StreamingFilter
+from my_wearable.windows import WindowedAnalyzer
+from benchmarks.startup import check as check_imports
+from benchmarks.synthetic import gait, ascii_frames, corrupt, FakeSerial, FREQUENCIES
+
+# Buffer sizes of the end-to-end filtering benchmark
+SIZES = [500, 5000, 50000, 500000, 5000000, 10000000]
+
+""" ================================================================================
+Runs 'function' 'repeat' times and keeps the fastest run, which is the least
+disturbed by the rest of the machine
+:param function: the function to time (called with no arguments)
+:param repeat: (int) number of runs
+:return: (float) seconds taken by the fastest run
+================================================================================ """
+def best_of(function, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+""" ================================================================================
+Builds one result entry
+:param name: (str) name of the benchmark
+:param n: (int) number of samples (or frames) processed
+:param seconds: (float) time taken
+:param params: (dict) other parameters of the run
+:return: (dict) the entry
+================================================================================ """
+def result(name, n, seconds, **params):
+    return {"name": name, "n": int(n), "params": params, "seconds": seconds,
+            "per_second": n / seconds if seconds > 0 else None}
+
+
+""" ================================================================================
+BLE.read_line() and BLE.read_frames() reading frames out of a fake serial port, and
+BLE.read_samples() decoding them, also out of a stream damaged at 'noise'
+:param n: (int) number of frames
+:param chunk: (int) bytes made available per in_waiting call
+:param noise: (float) fraction of the bytes damaged in the noisy stream
+:return: (list) result entries
+================================================================================ """
+def bench_ble(n, chunk, noise=0.01):
+    data = ascii_frames(*gait(50, n))
+    noisy = corrupt(data, noise)
+
+    def read_lines():
+        ble = BLE(FakeSerial(data, chunk))
+        for _ in range(n):
+            ble.read_line(eol=";")
+
+    def read_frames():
+        ble = BLE(FakeSerial(data, chunk))
+        count = 0
+        while count < n:
+            count += len(ble.read_frames(';'))
+
+    def read_samples(source):
+        port = FakeSerial(source, chunk)
+        ble = BLE(port)
+        decoder = TextDecoder(name="bench")
+        while port.in_waiting:
+            ble.read_samples(decoder)
+
+    return [result("ble.read_line", n, best_of(read_lines), chunk=chunk),
+            result("ble.read_frames", n, best_of(read_frames), chunk=chunk),
+            result("ble.read_samples", n, best_of(lambda: read_samples(data)), chunk=chunk),
+            result("ble.read_samples.noisy", n, best_of(lambda: read_samples(noisy)), chunk=chunk, noise=noise)]
+
+
+""" ================================================================================
+Pedometer.append() with one text frame at a time, and append_batch() in streaming
+mode with batches of 'batch' samples
+:param n: (int) number of samples
+:param batch: (int) samples per append_batch() call
+:return: (list) result entries
+================================================================================ """
+def bench_append(n, batch):
+    times, values = gait(50, n)
+    messages = ["{},{}".format(t, v) for t, v in zip(times.tolist(), values.tolist())]
+
+    def append():
+        pedometer = Pedometer(maxlen=n, file_flag=False)
+        for msg in messages:
+            pedometer.append(msg)
+
+    def append_batch():
+        pedometer = Pedometer(maxlen=n, file_flag=False, streaming=True)
+        for i in range(0, n, batch):
+            pedometer.append_batch(times[i:i + batch], values[i:i + batch])
+
+    return [result("pedometer.append", n, best_of(append)),
+            result("pedometer.append_batch.streaming", n, best_of(append_batch), batch=batch)]
+
+
+""" ================================================================================
+Pedometer.save_file() and load_file(), parsing the text and from the binary cache
+:param n: (int) number of samples
+:param directory: (str) directory for the temporary recordings
+:return: (list) result entries
+================================================================================ """
+def bench_files(n, directory):
+    times, values = gait(50, n)
+    filename = os.path.join(directory, "bench_{}.txt".format(n))
+    pedometer = Pedometer(maxlen=n, file_flag=True)
+    pedometer.append_batch(times, values)
+
+    entries = [result("pedometer.save_file", n, best_of(lambda: pedometer.save_file(filename)))]
+    entries.append(result("pedometer.load_file", n,
+                          best_of(lambda: Pedometer(0, True).load_file(filename, cache=False))))
+    Pedometer(0, True).load_file(filename)      # write the cache
+    entries.append(result("pedometer.load_file.cached", n,
+                          best_of(lambda: Pedometer(0, True).load_file(filename))))
+    return entries
+
+
+""" ================================================================================
+End-to-end __filter_pedometer + __find_peaks latency over a full buffer
+:param n: (int) size of the buffer
+:param frequency: (int) gait to use
+:return: (list) result entries
+================================================================================ """
+def bench_filter(n, frequency):
+    times, values = gait(frequency, n)
+    pedometer = Pedometer(maxlen=n, file_flag=False)
+    pedometer.append_batch(times, values)
+    repeat = 3 if n <= 1000000 else 1
+    seconds = best_of(pedometer._Pedometer__find_peaks, repeat)
+    return [result("pedometer.filter_find_peaks", n, seconds, frequency=frequency)]
+
+
+""" ================================================================================
+Re-counting the steps of a long history after 'new' samples arrived, from scratch and
+with the windowed analyzer (which keeps the windows analyzed before them)
+:param n: (int) size of the history
+:param new: (int) number of new samples
+:return: (list) result entries
+================================================================================ """
+def bench_windows(n, new):
+    times, values = gait(50, n + new)
+    pedometer = Pedometer(maxlen=n + new, file_flag=False)
+    pedometer.append_batch(times, values)
+    windowed = Pedometer(maxlen=n + new, file_flag=False, analyzer=WindowedAnalyzer())
+    windowed.append_batch(times[:n], values[:n])
+    windowed.count_steps()
+    windowed.append_batch(times[n:], values[n:])
+    return [result("pedometer.count_steps", n + new, best_of(pedometer.count_steps)),
+            result("pedometer.count_steps.windowed", n + new, best_of(windowed.count_steps), new=new)]
+
+
+""" ================================================================================
+One tick of many wearers on the 50Hz grid: a StreamingFilter per stream against one
+MultiStreamFilter for all of them (the StreamingFilters also run their resampler,
+which has little to do on a grid that is already uniform)
+:param streams: (int) number of streams
+:param tick: (int) new samples per stream and per tick
+:param ticks: (int) number of ticks
+:return: (list) result entries
+================================================================================ """
+def bench_multistream(streams, tick, ticks=50):
+    _, values = gait(50, tick * ticks)
+    values = np.tile(values.astype(float), (streams, 1))
+    times = np.tile(np.arange(tick * ticks, dtype=np.int64) * 20000, (streams, 1))
+
+    def loop():
+        filters = [StreamingFilter(fs=50) for _ in range(streams)]
+        for k in range(0, tick * ticks, tick):
+            for i, stream in enumerate(filters):
+                stream.update(times[i, k:k + tick], values[i, k:k + tick])
+
+    def batched():
+        filters = MultiStreamFilter(streams, 50)
+        for k in range(0, tick * ticks, tick):
+            filters.update(values[:, k:k + tick], times=times[:, k:k + tick])
+
+    n = streams * tick * ticks
+    return [result("streaming.loop", n, best_of(loop), streams=streams, tick=tick),
+            result("streaming.multistream", n, best_of(batched), streams=streams, tick=tick)]
+
+
+""" ================================================================================
+Range queries on a session store holding a long recording of one device
+:param n: (int) number of samples in the store
+:param directory: (str) directory to write the store in
+:return: (list) result entries
+================================================================================ """
+def bench_store(n, directory):
+    times, values = gait(50, n)
+    steps = times[::50]
+    store = SessionStore(os.path.join(directory, "store"))
+    for k in range(0, n, 500000):
+        store.append("wearable", times[k:k + 500000], values[k:k + 500000],
+                     steps[(steps >= times[k]) & (steps <= times[min(k + 500000, n) - 1])])
+    store.close()
+
+    store = SessionStore(os.path.join(directory, "store"))
+    middle = int(times[n // 2])
+
+    def minute():
+        store.query("wearable", middle, middle + 60000000)
+
+    def day():
+        store.count_steps("wearable", middle - 43200000000, middle + 43200000000)
+
+    return [result("store.query_minute", 3000, best_of(minute, 5), samples=n),
+            result("store.count_steps_day", 86400, best_of(day, 5), samples=n)]
+
+
+""" ================================================================================
+Step queries of a StepService holding 'n' steps of one device (a week of walking is
+about a million): a day by the minute computed from the index, and served from the
+cache
+:param n: (int) number of steps
+:return: (list) result entries
+================================================================================ """
+def bench_service(n):
+    steps = np.cumsum(np.random.default_rng(0).integers(400000, 800000, n))
+    service = StepService()
+    for k in range(0, n, 1000):
+        service.record("wearable", steps[k:k + 1000])
+    middle = int(steps[n // 2])
+
+    def day():
+        service.cache.clear()
+        service.buckets("wearable", "minute", middle, middle + 86400000000)
+
+    def cached():
+        service.buckets("wearable", "minute", middle, middle + 86400000000)
+
+    return [result("service.buckets_day", 1440, best_of(day, 5), steps=n),
+            result("service.buckets_day.cached", 1440, best_of(cached, 5), steps=n)]
+
+
+""" ================================================================================
+Cold import time of the package modules (see benchmarks/startup.py)
+:return: (list) result entries
+================================================================================ """
+def bench_imports():
+    report = check_imports(repeat=3)
+    return [result("import." + row["module"], 1, row["seconds"], over_numpy=row["over_numpy"])
+            for row in report["modules"]]
+
+
+""" ================================================================================
+Information about the code and the machine the benchmarks ran on
+:return: (dict) metadata
+================================================================================ """
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "date": strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "machine": platform.machine(),
+            "processor": platform.processor()}
+
+
+""" ================================================================================
+Prints the speed of each benchmark compared to a previous run
+:param results: (list) result entries of this run
+:param baseline_file: (str) JSON output of a previous run
+:return: None
+================================================================================ """
+def compare(results, baseline_file):
+    with open(baseline_file) as file:
+        baseline = {(entry["name"], entry["n"], json.dumps(entry["params"], sort_keys=True)): entry
+                    for entry in json.load(file)["results"]}
+    for entry in results:
+        old = baseline.get((entry["name"], entry["n"], json.dumps(entry["params"], sort_keys=True)))
+        if old is not None:
+            print("{:40s} n={:<9d} {:6.2f}x".format(entry["name"], entry["n"],
+                                                    old["seconds"] / entry["seconds"]), file=sys.stderr)
+    return
+
+
+""" ================================================================================
+Runs every benchmark and writes the results as JSON
+:param max_size: (int) largest buffer of the filtering benchmark
+:param output: (str) JSON file to write (None for stdout)
+:param baseline: (str) JSON file of a previous run to compare with
+:return: (dict) the report
+================================================================================ """
+def run(max_size=SIZES[-1], output=None, baseline=None):
+    results = bench_imports()
+    results += bench_ble(20000, chunk=64)
+    results += bench_append(20000, batch=50)
+    with tempfile.TemporaryDirectory() as directory:
+        for n in [500, 50000, 1000000]:
+            results += bench_files(n, directory)
+        results += bench_store(min(max_size, 10000000), directory)
+    results += bench_service(1000000)
+    for n in SIZES:
+        if n <= max_size:
+            results += bench_filter(n, 50)
+    for frequency in FREQUENCIES:
+        results += bench_filter(50000, frequency)
+    results += bench_windows(1000000, 500)
+    results += bench_multistream(500, 10)
+
+    report = {"meta": metadata(), "results": results}
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if baseline is not None:
+        compare(results, baseline)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition and signal-processing hot paths.")
+    parser.add_argument("-o", "--output", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("--max-size", type=int, default=SIZES[-1], help="largest buffer to filter")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run")
+    args = parser.parse_args()
+    run(args.max_size, args.output, args.compare)
@@ -0,0 +1,89 @@
+# Imports
+import argparse
+import json
+import os
+import sys
+from time import sleep
+from my_wearable.profiling import PROFILER, format_summary
+from my_wearable.service import StepService
+from my_wearable.session import SessionManager
+from my_wearable.simulator import HM10Simulator, FakeHM10, PtyHM10
+from benchmarks.synthetic import DATA_DIR
+
+# Recording played back by every simulated wearable
+RECORDING = os.path.join(DATA_DIR, "walking_50hz.txt")
+
+""" ================================================================================
+Runs a session over simulated wearables with faults injected and reports what was
+sent against what the pipeline received (and served: the steps recorded in a
+StepService must match the pedometers). With 'profile' set, the stages of the pipeline
+are profiled while the session runs and the report gets the summary of the hot spots
+(the spans stay in PROFILER for a trace).
+:param devices: (int) number of simulated wearables
+:param speed: (float) playback speed of the recordings
+:param duration: (float) seconds to run for (at real speed)
+:param pty: (bool) serve the wearables through pseudo-terminals instead of in-process
+:param workers: (int) number of pedometer worker threads
+:param recording: (str) recording played back by the wearables
+:param profile: (bool) profile the pipeline while the session runs
+:param faults: arguments of HM10Simulator (corrupt, partial, disconnect, ...)
+:return: (dict) the report
+================================================================================ """
+def soak(devices=4, speed=10.0, duration=10.0, pty=False, workers=2, recording=RECORDING, profile=False,
+         **faults):
+    simulators = [HM10Simulator(recording, speed=speed, mac="{:012X}".format(i), seed=i, **faults)
+                  for i in range(devices)]
+    servers = [PtyHM10(simulator).start() for simulator in simulators] if pty else []
+    ports = [server.port for server in servers] if pty else [FakeHM10(simulator) for simulator in simulators]
+
+    service = StepService()
+    session = SessionManager([(port, simulator.mac) for port, simulator in zip(ports, simulators)],
+                             workers, service=service, time_scale=1.0 / speed)
+    if profile:
+        PROFILER.clear()
+        PROFILER.enable()
+    session.start()
+    sleep(duration)
+    session.stop()
+    if profile:
+        PROFILER.disable()
+    for server in servers:
+        server.stop()
+
+    report = session.report()
+    totals = service.totals()
+    for row, simulator in zip(report["devices"], simulators):
+        row.update(served_steps=totals.get(row["device"], {}).get("steps", 0), frames_sent=simulator.frames_sent, frames_corrupted=simulator.frames_corrupted,
+                   frames_partial=simulator.frames_partial, disconnects=simulator.disconnects,
+                   connects=simulator.connects)
+    total = report["total"]
+    total["frames_sent"] = sum(simulator.frames_sent for simulator in simulators)
+    total["disconnects"] = sum(simulator.disconnects for simulator in simulators)
+    total["speed"] = speed
+    if profile:
+        report["profile"] = PROFILER.summary()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak-test the acquisition pipeline against simulated HM-10s.")
+    parser.add_argument("-n", "--devices", type=int, default=4, help="number of simulated wearables")
+    parser.add_argument("--speed", type=float, default=10.0, help="playback speed (1 is real time)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run for")
+    parser.add_argument("--pty", action="store_true", help="serve the wearables through pseudo-terminals")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="number of pedometer worker threads")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability of a corrupted frame")
+    parser.add_argument("--partial", type=float, default=0.0, help="probability of a truncated frame")
+    parser.add_argument("--disconnect", type=float, default=0.0, help="probability of a lost link after a frame")
+    parser.add_argument("--connect-failures", type=int, default=0, help="failed connections after each lost link")
+    parser.add_argument("--recording", default=RECORDING, help="recording played back by the wearables")
+    parser.add_argument("--profile", default=None, metavar="TRACE", help="write a Chrome trace of the stages to this file")
+    args = parser.parse_args()
+
+    report = soak(args.devices, args.speed, args.duration, args.pty, args.workers, args.recording,
+                  args.profile is not None, corrupt=args.corrupt, partial=args.partial,
+                  disconnect=args.disconnect, connect_failures=args.connect_failures)
+    json.dump(report, sys.stdout, indent=2)
+    if args.profile is not None:
+        PROFILER.write_trace(args.profile)
+        print("\n" + format_summary(report["profile"]), file=sys.stderr)
@@ -0,0 +1,74 @@
+# Imports
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules whose import time is guarded: the core, and the entry points of the short
+# lived workers and CLIs
+MODULES = ["my_wearable", "my_wearable.acquisition", "my_wearable.frames", "my_wearable.recording",
+           "my_wearable.pedometer", "my_wearable.ble", "my_wearable.store", "my_wearable.service",
+           "my_wearable.profiling", "my_wearable.session", "my_wearable.batch"]
+# Modules that must only be loaded on first use, never by an import of the package
+HEAVY = ["scipy", "matplotlib", "serial"]
+# Import time allowed on top of 'import numpy', in seconds
+BUDGET = 0.05
+
+# Run in a fresh interpreter: prints the import time and the heavy modules it loaded
+PROBE = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(perf_counter() - start)
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+""" ================================================================================
+Times the import of a module in fresh interpreters (cold imports, nothing cached in
+sys.modules), keeping the fastest of 'repeat' runs
+:param module: (str) name of the module
+:param repeat: (int) number of interpreters to start
+:return: (tuple) seconds taken, heavy modules the import loaded
+================================================================================ """
+def import_time(module, repeat=5):
+    best = float('inf')
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                                capture_output=True, text=True, check=True).stdout.splitlines()
+        best = min(best, float(output[0]))
+        loaded = [name for name in output[1].split(",") if name] if len(output) > 1 else []
+    return best, loaded
+
+
+""" ================================================================================
+Checks the import time of every guarded module against the budget
+:param budget: (float) seconds allowed on top of 'import numpy'
+:param repeat: (int) interpreters started per module
+:return: (dict) baseline, budget and one row per module with its verdict
+================================================================================ """
+def check(budget=BUDGET, repeat=5):
+    baseline = import_time("numpy", repeat)[0]
+    rows = []
+    for module in MODULES:
+        seconds, loaded = import_time(module, repeat)
+        rows.append({"module": module, "seconds": seconds, "over_numpy": seconds - baseline,
+                     "heavy_loaded": loaded, "ok": seconds - baseline <= budget and not loaded})
+    return {"numpy_seconds": baseline, "budget": budget, "modules": rows,
+            "ok": all(row["ok"] for row in rows)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guard the import time of the package.")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds allowed on top of 'import numpy'")
+    parser.add_argument("--repeat", type=int, default=5, help="interpreters started per module")
+    args = parser.parse_args()
+
+    report = check(args.budget, args.repeat)
+    json.dump(report, sys.stdout, indent=2)
+    for row in report["modules"]:
+        if not row["ok"]:
+            print("\n{}: {:.1f} ms over numpy{}".format(row["module"], row["over_numpy"] * 1e3,
+                  ", loads " + ", ".join(row["heavy_loaded"]) if row["heavy_loaded"] else ""), file=sys.stderr)
+    sys.exit(0 if report["ok"] else 1)
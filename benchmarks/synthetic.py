@@ -0,0 +1,103 @@
+# Imports
+import os
+import numpy as np
+from my_wearable.recording import load_recording
+
+# Recordings the synthetic gaits are modelled on
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sampling data")
+FREQUENCIES = [2, 5, 50, 100]
+
+""" ================================================================================
+Generates a synthetic walking recording of 'n' samples, seeded from the recording
+sampling data/walking_{frequency}hz.txt: the recorded L1-norm is repeated with a bit
+of gaussian noise, and the timestamps reuse the recorded intervals (so the BLE jitter
+looks the same). The same seed always gives the same recording.
+:param frequency: (int) sampling frequency of the recording to model (2, 5, 50, 100)
+:param n: (int) number of samples
+:param seed: (int) seed of the random generator
+:return: (tuple) timestamps and values as int64 np.ndarrays
+================================================================================ """
+def gait(frequency, n, seed=0):
+    recording = load_recording(os.path.join(DATA_DIR, "walking_{}hz.txt".format(frequency)), cache=False)
+    rng = np.random.default_rng(seed)
+
+    values = np.resize(recording[:, 1], n).astype(float)
+    values += rng.normal(0, 0.02 * np.std(recording[:, 1]), n)
+    intervals = rng.choice(np.diff(recording[:, 0]), n)
+    times = recording[0, 0] + np.cumsum(intervals)
+    return times.astype(np.int64), np.clip(values, 0, None).astype(np.int64)
+
+
+""" ================================================================================
+Encodes samples as the "%8lu,%5lu;" frames sent by the wearable
+:param times: (np.ndarray) timestamps
+:param values: (np.ndarray) values
+:return: (bytes) the byte stream
+================================================================================ """
+def ascii_frames(times, values):
+    return "".join("{:8d},{:5d};".format(t, v) for t, v in zip(times.tolist(), values.tolist())).encode('utf-8')
+
+
+
+""" ================================================================================
+Damages a byte stream like a noisy radio link: at a fraction 'rate' of the positions
+a byte is replaced by a random one, lost, or preceded by a random extra byte
+:param data: (bytes) the byte stream
+:param rate: (float) fraction of the bytes damaged
+:param seed: (int) seed of the random generator
+:return: (bytes) the damaged stream
+================================================================================ """
+def corrupt(data, rate=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    data = np.frombuffer(data, dtype=np.uint8).copy()
+    positions = np.sort(rng.choice(len(data), int(rate * len(data)), replace=False))
+    kind = rng.integers(0, 3, len(positions))
+    data[positions[kind == 0]] = rng.integers(0, 256, np.count_nonzero(kind == 0))
+    inserted = positions[kind == 2]
+    data = np.insert(data, inserted, rng.integers(0, 256, len(inserted)).astype(np.uint8))
+    # the positions of the lost bytes moved with the bytes inserted before them
+    lost = positions[kind == 1]
+    data = np.delete(data, lost + np.searchsorted(inserted, lost, 'right'))
+    return data.tobytes()
+
+class FakeSerial:
+
+    """ ================================================================================
+    Constructor of an in-memory byte source with the parts of the serial.Serial
+    interface used by BLE. The bytes become available 'chunk' at a time, like data
+    trickling in from the HM-10; reading past the end returns nothing, like a timeout.
+    :param data: (bytes) the bytes to serve
+    :param chunk: (int) max number of bytes reported by in_waiting (None for all)
+    :return: None
+    ================================================================================ """
+    def __init__(self, data, chunk=None):
+        self._data = memoryview(data)
+        self._position = 0
+        self._chunk = chunk
+        self.closed = False
+        return
+
+    # The parts of the serial.Serial interface used by BLE
+
+    @property
+    def in_waiting(self):
+        remaining = len(self._data) - self._position
+        return remaining if self._chunk is None else min(self._chunk, remaining)
+
+    def read(self, size=1):
+        chunk = bytes(self._data[self._position:self._position + size])
+        self._position += len(chunk)
+        return chunk
+
+    def write(self, data):
+        return len(data)
+
+    def flushInput(self):
+        return
+
+    def flushOutput(self):
+        return
+
+    def close(self):
+        self.closed = True
+        return
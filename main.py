@@ -1,7 +1,7 @@
 import traceback
-import matplotlib.pyplot as plt
 from time import sleep
 from my_wearable.ble import BLE
+from my_wearable.acquisition import Acquisition, BLOCK
 from my_wearable.pedometer import Pedometer
 
 """ -------------------- Settings -------------------- """
@@ -9,6 +9,7 @@ run_config = True                 # whether to config PC HM-10 or not
 baudrate = 9600                   # PySerial baud rate of the PC HM-10
 serial_port = "/dev/cu.usbserial-0001"    # Serial port of the PC HM-10
 peripheral_mac = "78DB2F141044"   # Mac Address of the Arduino HM-10
+binary_frames = False             # have the wearable send binary frames ("CFB;")
 
 """ -------------------- Main Wearable Code -------------------- """
 
@@ -27,24 +28,19 @@ def get_samples(hm10, frequency, pedometer):
         traceback.print_exc()
         hm10.close()
     
-    # append data to the pedometer
-    for i in range(500):
-        print(i)
-        # read a line of data from BLE
-        try:
-            msg = hm10.read_line(eol = ";")
-            print(msg)
-        except KeyboardInterrupt:
-            print("\nExiting due to user input (<ctrl>+c).")
-            hm10.close()
-            break
-        except Exception:
-            print("\nExiting due to an error.")
-            hm10.close()
-            traceback.print_exc()
-        
-        # append data to the pedometer
-        pedometer.append(msg)
+    # read the BLE in the background and append data to the pedometer
+    acquisition = Acquisition(hm10, pedometer, policy=BLOCK, binary=binary_frames)
+    acquisition.start()
+    try:
+        acquisition.wait(500)
+    except KeyboardInterrupt:
+        print("\nExiting due to user input (<ctrl>+c).")
+    acquisition.stop()
+    print(acquisition.stats())
+
+    if acquisition.error is not None:
+        print("\nExiting due to an error.")
+        hm10.close()
     
     # write to file
     data_file = "walking_{}hz.txt".format(frequency)
@@ -86,6 +82,7 @@ hm10.close()
 
 # OBJECTIVE 2,3,4
 
-pedometer = Pedometer(maxlen=500, file_flag=True)
-pedometer.process()
+if __name__ == "__main__":
+    pedometer = Pedometer(maxlen=500, file_flag=True)
+    pedometer.process()
 
@@ -0,0 +1,264 @@
+# Imports
+import threading
+import traceback
+from collections import deque
+import numpy as np
+from my_wearable.frames import TextDecoder
+from my_wearable.metrics import REGISTRY
+
+# Backpressure policies of the HandoffQueue
+BLOCK = "block"                 # the reader waits until the consumer makes room
+DROP_OLDEST = "drop_oldest"     # the oldest queued batch is thrown away
+COALESCE = "coalesce"           # the new batch is merged into the newest queued batch
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+
+class HandoffQueue:
+
+    """ ================================================================================
+    Constructor that sets up a bounded single-producer/single-consumer queue of sample
+    batches. It relies on the atomic append/popleft of collections.deque, so the
+    producer and the consumer never take a lock on the data path; the events are only
+    used to sleep when there is nothing to do.
+    :param maxlen: (int) max number of batches in the queue
+    :param policy: (str) what to do when the queue is full (BLOCK, DROP_OLDEST, COALESCE)
+    :return: None
+    ================================================================================ """
+    def __init__(self, maxlen=64, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError("Unknown backpressure policy: {}".format(policy))
+        self._maxlen = maxlen
+        self._policy = policy
+        self._batches = deque()
+        self._not_empty = threading.Event()
+        self._not_full = threading.Event()
+        self._not_full.set()
+
+        # each counter is only written by one side of the queue
+        self.queued_samples = 0     # producer
+        self.dropped_samples = 0    # producer
+        self.consumed_samples = 0   # consumer
+        return
+
+    """ ================================================================================
+    Number of batches currently in the queue
+    :return: (int) queue depth
+    ================================================================================ """
+    def __len__(self):
+        return len(self._batches)
+
+    """ ================================================================================
+    Number of samples currently waiting in the queue
+    :return: (int) samples in the queue
+    ================================================================================ """
+    def pending_samples(self):
+        return self.queued_samples - self.dropped_samples - self.consumed_samples
+
+    """ ================================================================================
+    Adds a batch to the queue, applying the backpressure policy when it is full
+    :param times: (np.ndarray) timestamps of the batch
+    :param values: (np.ndarray) values of the batch
+    :param timeout: (float) max seconds to wait for room with the BLOCK policy
+    :return: (bool) False if the batch could not be queued
+    ================================================================================ """
+    def put(self, times, values, timeout=None):
+        if len(self._batches) >= self._maxlen:
+            if self._policy == BLOCK:
+                self._not_full.clear()
+                while len(self._batches) >= self._maxlen:
+                    if not self._not_full.wait(timeout):
+                        return False
+                    self._not_full.clear()
+
+            elif self._policy == DROP_OLDEST:
+                try:
+                    dropped = self._batches.popleft()
+                    self.dropped_samples += len(dropped[0])
+                except IndexError:
+                    pass    # the consumer emptied the queue in the meantime
+
+            elif self._policy == COALESCE:
+                try:
+                    last_times, last_values = self._batches.pop()
+                    times = np.concatenate((last_times, times))
+                    values = np.concatenate((last_values, values))
+                    self.queued_samples -= len(last_times)
+                except IndexError:
+                    pass    # the consumer emptied the queue in the meantime
+
+        self._batches.append((times, values))
+        self.queued_samples += len(times)
+        self._not_empty.set()
+        return True
+
+    """ ================================================================================
+    Takes the oldest batch out of the queue
+    :param timeout: (float) max seconds to wait for a batch
+    :return: (tuple) timestamps and values, or None if the queue stayed empty
+    ================================================================================ """
+    def get(self, timeout=None):
+        try:
+            batch = self._batches.popleft()
+        except IndexError:
+            self._not_empty.clear()
+            # the producer may have added a batch right before the clear
+            if not self._batches and not self._not_empty.wait(timeout):
+                return None
+            try:
+                batch = self._batches.popleft()
+            except IndexError:
+                return None
+
+        self.consumed_samples += len(batch[0])
+        self._not_full.set()
+        return batch
+
+
+class Acquisition:
+
+    """ ================================================================================
+    Constructor that sets up the acquisition subsystem. A reader thread owns the BLE
+    object: it decodes every complete frame (see my_wearable.frames) and hands the
+    batches over to a consumer thread that feeds the Pedometer. Slow processing no
+    longer stalls the serial reads, the queue absorbs it according to the backpressure
+    policy.
+    :param ble: (BLE) connected BLE object, only used from the reader thread
+    :param pedometer: (Pedometer) pedometer fed by the consumer thread
+    :param maxlen: (int) max number of batches in the handoff queue
+    :param policy: (str) backpressure policy of the queue (BLOCK, DROP_OLDEST, COALESCE)
+    :param eol: (str) character terminating each frame
+    :param decoder: (TextDecoder or BinaryDecoder) decoder of the frames (None for a
+                    TextDecoder of the 'eol' text frames)
+    :param binary: (bool) switch the wearable to binary frames when the reader starts
+                   (see BLE.frame_mode)
+    :return: None
+    ================================================================================ """
+    def __init__(self, ble, pedometer, maxlen=64, policy=DROP_OLDEST, eol=';', decoder=None, binary=False):
+        self._ble = ble
+        self._binary = binary
+        self._pedometer = pedometer
+        name = getattr(ble, "name", "ble")
+        self._decoder = decoder if decoder is not None else TextDecoder(eol, name)
+        self._queue = HandoffQueue(maxlen, policy)
+        self._running = threading.Event()
+        self._threads = []
+        self._samples_ready = threading.Condition()
+        self.invalid_frames = 0
+        self.error = None
+
+        self._gauges = {key: REGISTRY.gauge("acquisition_" + key, device=name)
+                        for key in ("queued_samples", "dropped_samples", "consumed_samples",
+                                    "pending_samples", "queue_depth")}
+        return
+
+    """ ================================================================================
+    Metrics collector: copies the queue counters into the gauges when a snapshot is
+    taken, so the data path does not pay for them
+    :return: None
+    ================================================================================ """
+    def _collect(self):
+        stats = self.stats()
+        for key, gauge in self._gauges.items():
+            gauge.set(stats[key])
+        return
+
+    """ ================================================================================
+    Starts the reader and consumer threads
+    :return: None
+    ================================================================================ """
+    def start(self):
+        REGISTRY.add_collector(self._collect)
+        self._running.set()
+        self._threads = [threading.Thread(target=self.__reader, name="ble-reader", daemon=True),
+                         threading.Thread(target=self.__consumer, name="pedometer-consumer", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return
+
+    """ ================================================================================
+    Stops both threads. The consumer first feeds the pedometer whatever is still queued.
+    :return: None
+    ================================================================================ """
+    def stop(self):
+        self._running.clear()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._collect()
+        REGISTRY.remove_collector(self._collect)
+        return
+
+    """ ================================================================================
+    Blocks until the consumer has fed 'n_samples' samples to the pedometer
+    :param n_samples: (int) number of samples to wait for
+    :param timeout: (float) max seconds to wait
+    :return: (bool) True if the samples arrived, False on timeout or error
+    ================================================================================ """
+    def wait(self, n_samples, timeout=None):
+        with self._samples_ready:
+            return self._samples_ready.wait_for(
+                lambda: self._queue.consumed_samples >= n_samples or not self._running.is_set(),
+                timeout) and self._queue.consumed_samples >= n_samples
+
+    """ ================================================================================
+    Counters of the acquisition
+    :return: (dict) queued, dropped, consumed and pending samples, queue depth and
+             invalid frames
+    ================================================================================ """
+    def stats(self):
+        return {"queued_samples": self._queue.queued_samples,
+                "dropped_samples": self._queue.dropped_samples,
+                "consumed_samples": self._queue.consumed_samples,
+                "pending_samples": self._queue.pending_samples(),
+                "queue_depth": len(self._queue),
+                "invalid_frames": self.invalid_frames}
+
+    """ ================================================================================
+    Reader thread: reads frames from the BLE and queues the decoded batches. When it
+    is stopped, the samples the decoder still holds back are queued too.
+    :return: None
+    ================================================================================ """
+    def __reader(self):
+        try:
+            if self._binary:
+                self._decoder, times, values = self._ble.frame_mode(self._decoder)
+                if len(times):
+                    self._queue.put(times, values, timeout=0.1)
+            reconnects = self._ble.reconnects
+            while self._running.is_set():
+                times, values = self._ble.read_samples(self._decoder, block=True)
+                if self._binary and self._ble.reconnects > reconnects:
+                    # read_samples() reconnected: a wearable that restarted sends text
+                    # frames until it is switched again
+                    reconnects = self._ble.reconnects
+                    self._decoder, more_times, more_values = self._ble.frame_mode(self._decoder)
+                    times = np.concatenate((times, more_times))
+                    values = np.concatenate((values, more_values))
+                self.invalid_frames = self._decoder.invalid_frames
+                while len(times) and not self._queue.put(times, values, timeout=0.1):
+                    if not self._running.is_set():
+                        return
+            times, values = self._decoder.flush()
+            if len(times):
+                self._queue.put(times, values, timeout=0.1)
+        except Exception as error:
+            self.error = error
+            traceback.print_exc()
+            self._running.clear()
+        return
+
+    """ ================================================================================
+    Consumer thread: feeds the queued batches into the pedometer
+    :return: None
+    ================================================================================ """
+    def __consumer(self):
+        reader = self._threads[0]
+        # the reader still queues the samples held back by the decoder once stopped
+        while self._running.is_set() or reader.is_alive() or len(self._queue):
+            batch = self._queue.get(timeout=0.1)
+            if batch is not None:
+                self._pedometer.append_batch(*batch)
+            with self._samples_ready:
+                self._samples_ready.notify_all()
+        self._pedometer.flush()
+        return
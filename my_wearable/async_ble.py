@@ -0,0 +1,334 @@
+# Imports
+import asyncio
+from my_wearable.frames import TextDecoder
+from my_wearable.lazy import LazyModule
+from my_wearable.metrics import REGISTRY
+from my_wearable.profiling import PROFILER
+
+# pyserial is imported when a real port is opened (see my_wearable.lazy)
+serial = LazyModule("serial")
+
+class AsyncBLE:
+
+    """ ================================================================================
+    Constructor of the asyncio version of the BLE class. It keeps the same connect,
+    2-step handshake, read_line and check_connection semantics, but every wait is an
+    awaitable, so one event loop can drive many HM-10s at once. Nothing is opened here,
+    call open() from inside the event loop. An error reading the port is raised from
+    the next read coroutine (the event loop callback cannot raise it to anyone).
+    :param serial_port: (str) the Serial port for the PC HM-10 (a pty works as well)
+    :param baudrate: (int) the baud rate to use to connect to the PC HM-10
+    :return: None
+    ================================================================================ """
+    def __init__(self, serial_port, baudrate=9600):
+        self._baudrate = baudrate
+        self._serial_port = serial_port
+        self._ser = None
+        self._peripheral_mac = None
+        self._rx = bytearray()          # bytes received but not handed out yet
+        self._received = None           # set whenever new bytes arrive
+        self._loop = None
+        self._error = None              # error of the last read of the port, not raised yet
+        self.name = serial_port
+        self._read_errors = REGISTRY.counter("ble_read_errors_total", device=self.name)
+        self._reconnects = REGISTRY.counter("ble_reconnects_total", device=self.name)
+        self.reconnects = 0             # reconnections after an "OK+LOST"
+        return
+
+    """ ================================================================================
+    Opens the serial port in non-blocking mode and registers it with the event loop.
+    Optionally runs the same configuration sequence as BLE(do_config=True).
+    :param do_config: (bool) whether to initialize the PC HM-10 or not
+    :return: nothing
+    ================================================================================ """
+    async def open(self, do_config=False):
+        self._loop = asyncio.get_running_loop()
+        self._received = asyncio.Event()
+        self._error = None
+        self._ser = serial.Serial(port=self._serial_port, baudrate=self._baudrate, timeout=0)
+        self._loop.add_reader(self._ser.fileno(), self.__on_readable)
+
+        if do_config :
+            self.write("AT")
+            await asyncio.sleep(0.5)
+            await self.flush()
+
+            commands = ["AT+IMME1", "AT+NOTI1", "AT+ROLE1", "AT+RESET"]
+            print("Setting up the HM-10 ({}):".format(self._serial_port))
+            for command in commands :
+                print("> " + command)
+                self.write(command)
+                await asyncio.sleep(0.5)
+            print("Config completed successfully.")
+        return
+
+    """ ================================================================================
+    Event loop callback: moves everything waiting in the serial port into the receive
+    buffer and wakes up whoever is waiting for data. If the read fails (e.g. the device
+    went away), the port is not watched anymore and the error is kept for _raise_error()
+    :return: nothing
+    ================================================================================ """
+    def __on_readable(self):
+        try:
+            with PROFILER.span("ble.read", "io"):
+                data = self._ser.read(max(self._ser.in_waiting, 1))
+        except (serial.SerialException, OSError) as error:
+            self._loop.remove_reader(self._ser.fileno())
+            self._error = error
+            self._read_errors.inc()
+            self._received.set()
+            return
+        if data:
+            self._rx += data
+            self._received.set()
+        return
+
+    """ ================================================================================
+    Raises the error of the last read of the serial port, if any. Nothing arrives after
+    it until open() is called again, so every read coroutine raises it.
+    :return: nothing
+    ================================================================================ """
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+        return
+
+    """ ================================================================================
+    Waits until new bytes arrive or 'timeout' seconds pass
+    :param timeout: (float) max seconds to wait
+    :return: (bool) True if new bytes arrived, raises the error of the serial port if
+             reading it failed
+    ================================================================================ """
+    async def _wait_data(self, timeout):
+        self._raise_error()
+        self._received.clear()
+        try:
+            await asyncio.wait_for(self._received.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._raise_error()
+        return True
+
+    """ ================================================================================
+    Function to take the first 'n' bytes out of the receive buffer and decode them
+    :param n: number of bytes to take
+    :return: String containing the decoded bytes
+    ================================================================================ """
+    def _take(self, n):
+        chunk = bytes(self._rx[:n])
+        del self._rx[:n]
+        return chunk.decode('utf-8', errors='replace')
+
+    """ ================================================================================
+    Coroutine to connect to the remote HM-10 using the 2-step BLE handshake protocol.
+    It follows the same steps as BLE.connect() but sleeps without blocking the loop.
+    :param peripheral_mac: MAC address of the remote HM-10 to connect with
+    :param max_tries: maximum number of attempts before raising an IOError
+    :return: nothing
+    ================================================================================ """
+    async def connect(self, peripheral_mac, max_tries=20):
+
+        self._peripheral_mac = peripheral_mac
+
+        if self._ser is None or self._ser.closed:
+            await self.open()
+
+        # Always assume connected. Disconnect first and remove connection lost messages.
+        print("Resetting connection ({}).".format(self._serial_port))
+        self.write("AT")
+        await asyncio.sleep(0.5)
+        await self.flush()
+
+        connected = False
+        confirmed = False
+        tries = 0
+
+        while not confirmed and tries < max_tries:
+            response = await self.read_line()
+            if "OK+CONNAOK+CONN" in response and not ("CONNF" in response or "CONNE" in response):
+                connected = True
+                print("Connected ({})".format(self._serial_port))
+
+            if "#" in response:
+                confirmed = True
+                print("Confirmed ({})".format(self._serial_port))
+
+            if not connected:
+                self.write("AT+CON" + self._peripheral_mac)
+                await asyncio.sleep(0.5)
+
+            elif not confirmed:
+                self.write("AT+NAME?")
+                await asyncio.sleep(0.5)
+
+            tries += 1
+
+        if not confirmed:
+            raise IOError("Exceed max number of attemps establishing connection")
+
+    """ ================================================================================
+    Coroutine to check if a connection was broken and to reconnect, like
+    BLE.check_connection()
+    :param msg: the received message
+    :param max_tries: maximum number of attempts before raising an IOError
+    :return: nothing, but throws an IOError in case of failed connection
+    ================================================================================ """
+    async def check_connection(self, msg, max_tries=10):
+        tries = 0
+
+        while "OK+LOST" in msg and tries < max_tries:
+            self.reconnects += 1
+            self._reconnects.inc()
+            await self.connect(self._peripheral_mac)
+            msg = await self.read_lines()
+            tries += 1
+
+        if tries >= max_tries:
+            raise IOError("Can't connect to Peripheral")
+
+    """ ================================================================================
+    Coroutine to read the receive buffer until the character 'eol'. It waits for new
+    bytes until 'timeout' is reached if the termination is not found, then checks the
+    connection and returns the message.
+    :param eol: character (single element string) containing delimiting character
+    :param timeout: seconds before it quits
+    :return: String containing data read from the BLE buffer (or empty string)
+    ================================================================================ """
+    async def read_line(self, eol='\n', timeout=1):
+        assert len(eol) == 1, "Delimiting character must be a single element string."
+        assert isinstance(eol, str), "Delimiting character must be a string."
+
+        eol_byte = eol.encode('utf-8')
+        deadline = self._loop.time() + timeout
+        end = self._rx.find(eol_byte)
+        while end < 0:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            start = len(self._rx)
+            await self._wait_data(remaining)
+            end = self._rx.find(eol_byte, start)
+
+        if end < 0:
+            msg = self._take(len(self._rx))
+        else:
+            msg = self._take(end + 1)[:-1]
+
+        await self.check_connection(msg)
+        return msg
+
+    """ ================================================================================
+    Coroutine to read the entire receive buffer and check the connection
+    :return: String containing data read from the BLE buffer (or empty string)
+    ================================================================================ """
+    async def read_lines(self):
+        self._raise_error()
+        msg = self._take(len(self._rx))
+        await self.check_connection(msg)
+        return msg
+
+    """ ================================================================================
+    Coroutine that waits for at least one complete frame and returns every complete
+    frame in the receive buffer, like BLE.read_frames()
+    :param eol: character (single element string) terminating each frame
+    :param timeout: max seconds to wait for a frame
+    :return: list of Strings, one per complete frame (without the 'eol')
+    ================================================================================ """
+    async def read_frames(self, eol=';', timeout=1):
+        eol_byte = eol.encode('utf-8')
+        deadline = self._loop.time() + timeout
+        while self._rx.rfind(eol_byte) < 0 and b"OK+LOST" not in self._rx:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0 or not await self._wait_data(remaining):
+                return []
+
+        # the frames received before an "OK+LOST" are returned, then it reconnects
+        lost = self._rx.find(b"OK+LOST")
+        end = self._rx.rfind(eol_byte, 0, len(self._rx) if lost < 0 else lost)
+        frames = self._take(end + 1).split(eol)[:-1] if end >= 0 else []
+        if lost >= 0:
+            await self.check_connection(self._take(len(self._rx)))
+        return frames
+
+    """ ================================================================================
+    Coroutine that waits for at least one sample and decodes every complete frame in
+    the receive buffer, like BLE.read_samples()
+    :param decoder: (TextDecoder or BinaryDecoder) decoder holding the state of the stream
+    :param timeout: max seconds to wait for a sample
+    :return: (tuple) timestamps and values of the decoded samples as np.ndarrays
+    ================================================================================ """
+    async def read_samples(self, decoder, timeout=1):
+        deadline = self._loop.time() + timeout
+        while True:
+            # the frames received before an "OK+LOST" are decoded, then it reconnects
+            lost = self._rx.find(b"OK+LOST")
+            with PROFILER.span("frames.decode", "parse"):
+                times, values, consumed = decoder.decode(self._rx if lost < 0 else self._rx[:lost])
+            del self._rx[:consumed]
+            if lost >= 0:
+                await self.check_connection(self._take(len(self._rx)))
+            remaining = deadline - self._loop.time()
+            if len(times) or remaining <= 0 or not await self._wait_data(remaining):
+                return times, values
+
+    """ ================================================================================
+    Function to write a message 'msg' to the PC HM-10
+    :return: nothing
+    ================================================================================ """
+    def write(self, msg):
+        self._ser.write(msg.encode('utf-8'))
+        return
+
+    """ ================================================================================
+    Coroutine to clean both input and output buffers of the PC HM-10 module
+    :return: nothing
+    ================================================================================ """
+    async def flush(self):
+        self._rx.clear()
+        self._ser.reset_input_buffer()
+        self._ser.reset_output_buffer()
+        await asyncio.sleep(0.1)
+        self._rx.clear()
+        return
+
+    """ ================================================================================
+    Coroutine to disconnect BLE, flush buffers, and close the Serial port
+    :return: nothing
+    ================================================================================ """
+    async def close(self):
+        self.write("AT")
+        await asyncio.sleep(0.5)
+        await self.flush()
+        self._loop.remove_reader(self._ser.fileno())
+        self._ser.close()
+        return
+
+
+""" ================================================================================
+Coroutine that feeds every frame received by 'ble' into 'pedometer'. Run one per
+device with asyncio.gather() to serve many wearables from a single event loop. When
+it stops (or the link fails), the samples the decoder held back are fed too, and the
+pedometer is flushed.
+:param ble: (AsyncBLE) a connected AsyncBLE
+:param pedometer: (Pedometer) the pedometer of that device
+:param n_samples: (int) stop after this many samples (None runs forever)
+:param eol: (str) character terminating each frame
+:return: (int) number of samples fed to the pedometer
+================================================================================ """
+async def stream_pedometer(ble, pedometer, n_samples=None, eol=';'):
+    decoder = TextDecoder(eol, name=pedometer.name)
+    count = 0
+    try:
+        while n_samples is None or count < n_samples:
+            times, values = await ble.read_samples(decoder)
+            if len(times):
+                pedometer.append_batch(times, values)
+                count += len(times)
+    finally:
+        # judged without the samples that would follow them
+        times, values = decoder.flush()
+        if len(times):
+            pedometer.append_batch(times, values)
+            count += len(times)
+        pedometer.flush()
+    return count
@@ -0,0 +1,95 @@
+# Imports
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from my_wearable.pedometer import Pedometer
+from my_wearable.render import render_many
+
+# Columns of the results table
+FIELDS = ["file", "samples", "duration_s", "sample_rate_hz", "steps", "error"]
+
+""" ================================================================================
+Expands a directory or a glob pattern into a sorted list of recordings
+:param source: (str) a directory (every *.txt in it) or a glob pattern
+:return: (list) paths of the recordings
+================================================================================ """
+def find_recordings(source):
+    if os.path.isdir(source):
+        source = os.path.join(source, "*.txt")
+    return sorted(glob.glob(source))
+
+
+""" ================================================================================
+Runs load -> filter -> count on a single recording. This is what the worker processes
+run, so it never plots and never raises: errors go into the 'error' column.
+:param filename: (str) path of the recording
+:return: (dict) one row of the results table
+================================================================================ """
+def process_recording(filename):
+    row = {"file": filename, "samples": 0, "duration_s": 0.0,
+           "sample_rate_hz": 0.0, "steps": 0, "error": ""}
+    try:
+        pedometer = Pedometer(maxlen=0, file_flag=True)
+        row["steps"] = pedometer.process(filename, show=False)
+        row["step_times"] = pedometer.get_step_times().copy()
+        row["samples"] = pedometer._maxlen
+        row["sample_rate_hz"] = round(pedometer.sample_rate(), 3)
+        if row["sample_rate_hz"] > 0:
+            row["duration_s"] = round(row["samples"] / row["sample_rate_hz"], 3)
+    except Exception as error:
+        row["error"] = "{}: {}".format(type(error).__name__, error)
+    return row
+
+
+""" ================================================================================
+Processes every recording of 'source' across a pool of worker processes and writes
+one aggregated results table. Files are handed out in chunks so that thousands of
+small recordings do not pay one round-trip to a worker each.
+:param source: (str) a directory or a glob pattern of recordings
+:param output: (str) path of the CSV results table (None to skip writing it)
+:param workers: (int) number of worker processes (defaults to the number of cores)
+:param chunksize: (int) recordings per task (defaults to ~4 tasks per worker)
+:param plot_dir: (str) directory to plot each recording with its steps marked in;
+                 the plots are rendered by their own pool, after the counting
+:return: (list) the rows of the results table, in file order
+================================================================================ """
+def process_recordings(source, output="results.csv", workers=None, chunksize=None, plot_dir=None):
+    files = find_recordings(source)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(files) // (workers * 4))
+
+    if workers == 1 or len(files) <= 1:
+        rows = [process_recording(filename) for filename in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(process_recording, files, chunksize=chunksize))
+
+    if output is not None:
+        with open(output, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+        jobs = [(os.path.join(plot_dir, os.path.basename(row["file"]) + ".png"), row["file"], row["step_times"])
+                for row in rows if not row["error"]]
+        render_many(jobs, workers)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the steps of many recordings in parallel.")
+    parser.add_argument("source", help="directory or glob pattern, e.g. 'sampling data/walking_*hz.txt'")
+    parser.add_argument("-o", "--output", default="results.csv", help="CSV results table")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=None, help="recordings per task")
+    parser.add_argument("--plot-dir", default=None, help="directory for the step plots")
+    args = parser.parse_args()
+
+    rows = process_recordings(args.source, args.output, args.workers, args.chunksize, args.plot_dir)
+    print("Processed {} recordings, {} steps in total. Results in {}".format(
+        len(rows), sum(row["steps"] for row in rows), args.output))
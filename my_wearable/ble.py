@@ -1,26 +1,43 @@
 # Imports
-import serial
 from time import sleep
 from time import time
+import numpy as np
+from my_wearable.frames import ASCII_MODE, BINARY_MODE, FRAME_SIZE, FRAME_SYNC, BinaryDecoder, TextDecoder
+from my_wearable.lazy import LazyModule
+from my_wearable.metrics import REGISTRY, SIZE_BUCKETS
+from my_wearable.profiling import PROFILER
+
+# pyserial is imported when a real port is opened (see my_wearable.lazy)
+serial = LazyModule("serial")
 
 class BLE:
 
     """ ================================================================================
     Constructor that sets up the BLE for the first time. It will only run
-    :param serial_port: (str) the Serial port for the PC HM-10
+    :param serial_port: (str) the Serial port for the PC HM-10, or an object with the
+                        serial.Serial interface (e.g. a fake HM-10) to use instead
     :param baudrate: (int) the baud rate to use to connect to the PC HM-10
     :param do_config: (bool) whether to initialize the PC HM-10 or not
+    :param time_scale: (float) scales the waits of the configuration, the handshake and
+                       read_line() (e.g. 0.01 with a simulated HM-10 running 100x faster)
     :return: None
     ================================================================================ """
-    def __init__(self, serial_port, baudrate=9600, do_config=False):
+    def __init__(self, serial_port, baudrate=9600, do_config=False, time_scale=1.0):
         self._baudrate = baudrate
+        self._time_scale = time_scale
         self._serial_port = serial_port
-        self._ser = serial.Serial(port=serial_port, baudrate=baudrate, timeout=1)
+        self.name = serial_port if isinstance(serial_port, str) else type(serial_port).__name__
+        self._bytes_per_read = REGISTRY.histogram("ble_bytes_per_read", SIZE_BUCKETS, device=self.name)
+        self._frames = REGISTRY.counter("ble_frames_total", device=self.name)
+        self._reconnects = REGISTRY.counter("ble_reconnects_total", device=self.name)
+        self.reconnects = 0         # reconnections after an "OK+LOST"
+        self._ser = self.__open()
         self._peripheral_mac = None
+        self._rx = bytearray()      # bytes received but not handed out yet
 
         if do_config :
             self.write("AT")
-            sleep(0.5)
+            self._sleep(0.5)
             self.flush()
 
             commands = ["AT+IMME1", "AT+NOTI1", "AT+ROLE1", "AT+RESET"]
@@ -28,10 +45,29 @@ class BLE:
             for command in commands :
                 print("> " + command)
                 self.write(command)
-                sleep(0.5)
+                self._sleep(0.5)
             print("Config completed successfully.")
         return
 
+    """ ================================================================================
+    Function to open the Serial port of the PC HM-10. If the constructor was given a
+    serial-like object instead of a port name, that object is used as is.
+    :return: the serial.Serial (or serial-like) object
+    ================================================================================ """
+    def __open(self):
+        if not isinstance(self._serial_port, str):
+            return self._serial_port
+        return serial.Serial(port=self._serial_port, baudrate=self._baudrate, timeout=1)
+
+    """ ================================================================================
+    Sleeps 'seconds' scaled by the time scale of this BLE
+    :param seconds: (float) seconds to sleep at real speed
+    :return: nothing
+    ================================================================================ """
+    def _sleep(self, seconds):
+        sleep(seconds * self._time_scale)
+        return
+
     """ ================================================================================
     Function to connect to the remote HM-10 using a 2-step BLE handshake protocol.
     While the connection is not confirmed, it will loop until 'max_tries' and:
@@ -50,12 +86,12 @@ class BLE:
         self._peripheral_mac = peripheral_mac
 
         if self._ser is None or self._ser.closed:
-            self._ser = serial.Serial(port=self._serial_port, baudrate=self._baudrate, timeout=1)
+            self._ser = self.__open()
 
         # Always assume connected. Disconnect first and remove connection lost messages.
         print("Resetting connection.")
         self.write("AT")
-        sleep(0.5)
+        self._sleep(0.5)
         self.flush()
         
         connected = False
@@ -64,7 +100,7 @@ class BLE:
         
         while not confirmed and tries < max_tries:
             response = self.read_line()
-            if "OK+CONNAOK+CONN" in response:
+            if "OK+CONNAOK+CONN" in response and not ("CONNF" in response or "CONNE" in response):
                 connected = True
                 print("Connected")
             
@@ -74,11 +110,11 @@ class BLE:
                 
             if not connected:
                 self.write("AT+CON" + self._peripheral_mac)
-                sleep(0.5)
+                self._sleep(0.5)
                 
             elif not confirmed:
                 self.write("AT+NAME?")
-                sleep(0.5)
+                self._sleep(0.5)
                 
             tries += 1
         
@@ -100,6 +136,8 @@ class BLE:
         tries = 0
         
         while "OK+LOST" in msg and tries < max_tries:
+            self._reconnects.inc()
+            self.reconnects += 1
             self.connect(self._peripheral_mac)
             msg = self.read_lines()
             tries += 1
@@ -108,23 +146,147 @@ class BLE:
             raise IOError("Can't connect to Peripheral")
             
 
+    """ ================================================================================
+    Function to move everything waiting in the serial port into the receive buffer with
+    a single read call. If 'block' is set and nothing is waiting, it waits (up to the
+    serial timeout) for at least one byte to arrive.
+    :param block: (bool) whether to wait for data when nothing is waiting
+    :return: number of bytes added to the receive buffer
+    ================================================================================ """
+    def _fill(self, block=False):
+        with PROFILER.span("ble.read", "io"):
+            waiting = self._ser.in_waiting
+            if waiting > 0:
+                data = self._ser.read(waiting)
+            elif block:
+                data = self._ser.read(1)
+            else:
+                return 0
+        if data:
+            self._rx += data
+            self._bytes_per_read.observe(len(data))
+        return len(data)
+
+    """ ================================================================================
+    Function to take the first 'n' bytes out of the receive buffer and decode them
+    :param n: number of bytes to take
+    :return: String containing the decoded bytes
+    ================================================================================ """
+    def _take(self, n):
+        chunk = bytes(self._rx[:n])
+        del self._rx[:n]
+        return chunk.decode('utf-8', errors='replace')
+
     """ ================================================================================
     Function to read a single character from the BLE buffer
     :return: String containing data read from the BLE buffer (or empty string)
     ================================================================================ """
     def read(self):
-        c = ''
-        try:
-            if self._ser.in_waiting > 0:
-                c = self._ser.read(1).decode('utf-8')
-        except ValueError:
-            print("decode() cannot convert an invalid utf-8 char")
-        return c
+        if not self._rx:
+            self._fill()
+        if not self._rx:
+            return ''
+        return self._take(1)
+
+    """ ================================================================================
+    Function to read every complete frame waiting in the HM-10 buffer. It drains the
+    serial port in one call, splits the receive buffer at each 'eol' and keeps the
+    incomplete tail for the next call. The connection is checked once per call: the
+    frames received before an "OK+LOST" are returned, and the rest of the buffer goes
+    to self.check_connection().
+    :param eol: character (single element string) terminating each frame
+    :param block: (bool) wait (up to the serial timeout) when nothing is waiting
+    :return: list of Strings, one per complete frame (without the 'eol')
+    ================================================================================ """
+    def read_frames(self, eol=';', block=False):
+        assert len(eol) == 1, "Delimiting character must be a single element string."
+        assert isinstance(eol, str), "Delimiting character must be a string."
+
+        self._fill(block)
+        lost = self._rx.find(b"OK+LOST")
+        end = self._rx.rfind(eol.encode('utf-8'), 0, len(self._rx) if lost < 0 else lost)
+        frames = []
+        if end >= 0:
+            with PROFILER.span("frames.split", "parse"):
+                frames = self._take(end + 1).split(eol)[:-1]
+            self._frames.inc(len(frames))
+        if lost >= 0:
+            self.check_connection(self._take(len(self._rx)))
+        return frames
+
+    """ ================================================================================
+    Function to read and decode every complete frame waiting in the HM-10 buffer, text
+    or binary (see my_wearable.frames). It drains the serial port in one call and
+    decodes the raw bytes of the whole receive buffer at once, keeping a partial frame
+    for the next call, so bytes that are not UTF-8 are resynchronized on instead of
+    being lost with the frames around them. The frames received before an "OK+LOST"
+    are decoded before self.check_connection() reconnects.
+    :param decoder: (TextDecoder or BinaryDecoder) decoder holding the state of the stream
+    :param block: (bool) wait (up to the serial timeout) when nothing is waiting
+    :return: (tuple) timestamps and values of the decoded samples as np.ndarrays
+    ================================================================================ """
+    def read_samples(self, decoder, block=False):
+
+        self._fill(block)
+        lost = self._rx.find(b"OK+LOST")
+        with PROFILER.span("frames.decode", "parse"):
+            times, values, consumed = decoder.decode(self._rx if lost < 0 else self._rx[:lost])
+        del self._rx[:consumed]
+        if lost >= 0:
+            # a partial frame left in front of the marker is lost with the link
+            self.check_connection(self._take(len(self._rx)))
+        self._frames.inc(len(times))
+        return times, values
+
+    """ ================================================================================
+    Function to switch the wearable to binary or text frames (BINARY_MODE or ASCII_MODE)
+    and to return the decoder of the new frames. The bytes received in the old format
+    after the command was sent are decoded by the old decoder first (the samples the
+    TextDecoder held back included), so the new one continues from the last sample:
+    a BinaryDecoder adds the deltas to the last text timestamp, and the TextDecoder the
+    stream goes back to unwraps the text frames from the last binary timestamp.
+    :param decoder: (TextDecoder or BinaryDecoder) decoder of the current frames
+    :param binary: (bool) switch to binary frames, or back to text frames
+    :return: (tuple) the decoder of the new frames, and the timestamps and values of
+             the samples decoded meanwhile as np.ndarrays
+    ================================================================================ """
+    def frame_mode(self, decoder, binary=True):
+        self.write(BINARY_MODE if binary else ASCII_MODE)
+        if binary == isinstance(decoder, BinaryDecoder):
+            times, values = self.read_samples(decoder)
+            return decoder, times, values
+
+        self._sleep(0.1)
+        self._fill()
+        lost = self._rx.find(b"OK+LOST")
+        lost = len(self._rx) if lost < 0 else lost
+        if binary:
+            # the text frames end at the first sync byte (never part of a text frame)
+            end = self._rx.find(bytes([FRAME_SYNC]), 0, lost)
+            end = lost if end < 0 else end
+        else:
+            # the binary frames end with the frame of the last sync byte
+            end = self._rx.rfind(bytes([FRAME_SYNC]), 0, lost)
+            end = 0 if end < 0 else min(lost, end + FRAME_SIZE)
+        times, values, _ = decoder.decode(self._rx[:end])
+        held_times, held_values = decoder.flush()
+        del self._rx[:end]      # with a partial frame of the old format
+        self._frames.inc(len(times) + len(held_times))
+
+        if binary:
+            new = BinaryDecoder(decoder.timestamp or 0, decoder)
+        else:
+            new = decoder.text if decoder.text is not None else TextDecoder()
+            new.resume(decoder.timestamp)
+        new_times, new_values = self.read_samples(new)
+        return (new, np.concatenate((times, held_times, new_times)),
+                np.concatenate((values, held_values, new_values)))
 
     """ ================================================================================
     Function to read the HM-10 buffer until the character 'eol' and tries to reconnect a
-    lost connection. It repeatedly calls the self.read() function to read one character
-    at a time. It will read until 'timeout' is reached if the termination is not found.
+    lost connection. It drains everything waiting in the serial port into the receive
+    buffer at once and looks for 'eol' there, leaving the bytes after it for the next
+    call. It will read until 'timeout' is reached if the termination is not found.
     Once the message is received, it calls self.check_connection() to make sure the
     message did not have an error in it and then returns the message.
     :param eol: character (single element string) containing delimiting character
@@ -135,27 +297,34 @@ class BLE:
         assert len(eol) == 1, "Delimiting character must be a single element string."
         assert isinstance(eol, str), "Delimiting character must be a string."
 
-        msg = ""
+        eol_byte = eol.encode('utf-8')
         t1 = time()
-        c = self.read()
-        while (c != eol) and (time() - t1 < timeout):
-            msg += c
-            c = self.read()
+        end = self._rx.find(eol_byte)
+        while end < 0 and (time() - t1 < timeout * self._time_scale):
+            start = len(self._rx)
+            self._fill(block=True)
+            end = self._rx.find(eol_byte, start)
+
+        if end < 0:
+            msg = self._take(len(self._rx))
+        else:
+            msg = self._take(end + 1)[:-1]
+            self._frames.inc()
 
         self.check_connection(msg)
         return msg
 
     """ ================================================================================
     Function to read the entire HM-10 buffer and tries to reconnect a lost connection.
-    It repeatedly calls the self.read() function to read one character at a time.
+    It drains the serial port into the receive buffer until nothing is waiting.
     Once the message is received, it calls self.check_connection() to make sure the
     message did not have an error in it and then returns the message.
     :return: String containing data read from the BLE buffer (or empty string)
     ================================================================================ """
     def read_lines(self):
-        msg = ''
-        while self._ser.in_waiting :
-            msg += self.read()
+        while self._fill() :
+            pass
+        msg = self._take(len(self._rx))
 
         self.check_connection(msg)
         return msg
@@ -174,9 +343,10 @@ class BLE:
     :return: nothing
     ================================================================================ """
     def flush(self):
+        self._rx.clear()
         self._ser.flushInput()
         self._ser.flushOutput()
-        sleep(0.1)
+        self._sleep(0.1)
         return
 
     """ ================================================================================
@@ -185,7 +355,19 @@ class BLE:
     ================================================================================ """
     def close(self):
         self.write("AT")
-        sleep(0.5)
+        self._sleep(0.5)
         self.flush()
         self._ser.close()
         return
+
+    """ ================================================================================
+    Function to close the Serial port right away, without disconnecting BLE first (e.g.
+    once the link or the port failed). The errors of a port already gone are ignored.
+    :return: nothing
+    ================================================================================ """
+    def close_port(self):
+        try:
+            self._ser.close()
+        except OSError:
+            pass    # serial.SerialException is an OSError too
+        return
@@ -0,0 +1,93 @@
+# Imports
+import numpy as np
+
+class RingBuffer:
+
+    """ ================================================================================
+    Constructor that sets up a fixed-size circular buffer backed by a preallocated NumPy
+    array. Every sample is written twice (at 'i' and 'i + capacity') so that the most
+    recent samples always sit in one contiguous slice and can be handed out as a view
+    without copying. Once the buffer is full the oldest samples are overwritten.
+    :param capacity: (int) max number of samples kept in the buffer
+    :param dtype: (np.dtype) type of the samples
+    :return: None
+    ================================================================================ """
+    def __init__(self, capacity, dtype):
+        self._capacity = int(capacity)
+        self._storage = np.zeros(2 * self._capacity, dtype=dtype)
+        self._head = 0      # index of the next write
+        self._size = 0      # number of valid samples
+        return
+
+    """ ================================================================================
+    Number of valid samples in the buffer
+    :return: (int) number of samples
+    ================================================================================ """
+    def __len__(self):
+        return self._size
+
+    """ ================================================================================
+    Max number of samples the buffer can hold
+    :return: (int) capacity of the buffer
+    ================================================================================ """
+    def capacity(self):
+        return self._capacity
+
+    """ ================================================================================
+    Empties the buffer. The storage is kept, so no memory is allocated.
+    :return: None
+    ================================================================================ """
+    def clear(self):
+        self._head = 0
+        self._size = 0
+        return
+
+    """ ================================================================================
+    Appends a single sample to the buffer, overwriting the oldest one when full
+    :param value: the new sample
+    :return: None
+    ================================================================================ """
+    def append(self, value):
+        if self._capacity == 0:
+            return
+        self._storage[self._head] = value
+        self._storage[self._head + self._capacity] = value
+        self._head = (self._head + 1) % self._capacity
+        self._size = min(self._size + 1, self._capacity)
+        return
+
+    """ ================================================================================
+    Appends an array of samples to the buffer, overwriting the oldest ones when full.
+    Only the last 'capacity' samples of 'values' can be kept.
+    :param values: (array-like) the new samples
+    :return: None
+    ================================================================================ """
+    def extend(self, values):
+        values = np.asarray(values)
+        if self._capacity == 0 or len(values) == 0:
+            return
+        values = values[-self._capacity:]
+        count = len(values)
+
+        # write up to the end of the first copy, then wrap around to its beginning
+        first = min(count, self._capacity - self._head)
+        for offset in (0, self._capacity):
+            start = self._head + offset
+            self._storage[start:start + first] = values[:first]
+            self._storage[offset:offset + count - first] = values[first:]
+
+        self._head = (self._head + count) % self._capacity
+        self._size = min(self._size + count, self._capacity)
+        return
+
+    """ ================================================================================
+    Returns a read-only view (no copy) of the last 'n' samples, oldest first
+    :param n: (int) number of samples, defaults to every sample in the buffer
+    :return: (np.ndarray) view of the samples
+    ================================================================================ """
+    def view(self, n=None):
+        n = self._size if n is None else min(int(n), self._size)
+        end = self._head + self._capacity
+        window = self._storage[end - n:end]
+        window.flags.writeable = False
+        return window
@@ -0,0 +1,95 @@
+# Imports
+import threading
+from time import time
+import numpy as np
+
+# Drift (microseconds) between the wearable and the gateway clocks tolerated before the
+# offset between them is measured again: more than the delay of a batch through the
+# serial port, less than the reboot of a wearable
+CLOCK_TOLERANCE = 2000000
+# Offsets kept, so that the batches still queued when a new one starts are converted
+# with the offset of their own time
+MAX_OFFSETS = 64
+
+class GatewayClock:
+
+    """ ================================================================================
+    Constructor of the map from the timestamps of a wearable (its micros(), unwrapped
+    and re-based after each restart by TextDecoder, so they only increase) to the
+    wall-clock time of the gateway, in microseconds since the epoch. The reader calls
+    arrived() with every batch as it is received, the last sample of the batch being
+    taken as sent just then. The offset between the two clocks is kept while they agree
+    within 'tolerance'; a new one starts at the batch where they stop agreeing (the
+    wearable restarted, or its clock drifted). A new offset never maps a sample before
+    the ones already mapped, so the gateway times increase with the device times and
+    can key the archive and the step counts of the device.
+    :param tolerance: (int) drift in microseconds of the gateway clock tolerated before
+                      a new offset
+    :param clock: function returning the wall-clock time in seconds (default: time)
+    :param time_scale: (float) the gateway time runs 1 / 'time_scale' times as fast as
+                       'clock' from now on (e.g. 0.01 with a simulated wearable running
+                       100x faster, see BLE)
+    :return: None
+    ================================================================================ """
+    def __init__(self, tolerance=CLOCK_TOLERANCE, clock=time, time_scale=1.0):
+        self._tolerance = tolerance
+        self._clock = clock
+        self._time_scale = time_scale
+        self._origin = clock()
+        self._starts = np.zeros(0, dtype=np.int64)     # device time each offset starts at
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._last = None                               # last device time received
+        self._lock = threading.Lock()
+        self.rebases = 0        # offsets started after the first one
+        return
+
+    """ ================================================================================
+    Measures the offset of the clocks on a batch that was just received
+    :param times: (array-like) device timestamps of the batch, in time order
+    :return: None
+    ================================================================================ """
+    def arrived(self, times):
+        if len(times) == 0:
+            return
+        now = self._origin + (self._clock() - self._origin) / self._time_scale
+        offset = int(now * 1e6) - int(times[-1])
+        with self._lock:
+            if len(self._offsets):
+                current = int(self._offsets[-1])
+                # the drift is measured on the gateway clock, whatever the 'time_scale'
+                drift = abs(offset - current) * self._time_scale
+                if drift <= self._tolerance or int(times[0]) <= self._last:
+                    self._last = max(self._last, int(times[-1]))
+                    return
+                # the first sample of the batch stays after the last one mapped
+                offset = max(offset, current + self._last - int(times[0]) + 1)
+                self.rebases += 1
+            # new arrays rather than in place: convert() maps with the pair it read
+            self._starts = np.append(self._starts, int(times[0]))[-MAX_OFFSETS:]
+            self._offsets = np.append(self._offsets, offset)[-MAX_OFFSETS:]
+            self._last = int(times[-1])
+        return
+
+    """ ================================================================================
+    Gateway times of device timestamps, with the offset in force at each of them. The
+    times between two batches that start a new offset lower than the last one are kept
+    before the first time mapped with it, so the gateway times never go back
+    :param times: (array-like) device timestamps (of samples or steps)
+    :return: (np.ndarray) gateway times in microseconds since the epoch (int64)
+    ================================================================================ """
+    def convert(self, times):
+        times = np.asarray(times, dtype=np.int64)
+        if len(self._offsets) == 0:
+            self.arrived(times)
+        with self._lock:
+            starts, offsets = self._starts, self._offsets
+        if len(times) == 0 or len(offsets) == 0:
+            return times.copy()
+        if times[0] >= starts[-1]:
+            return times + offsets[-1]
+        index = np.maximum(np.searchsorted(starts, times, 'right') - 1, 0)
+        converted = times + offsets[index]
+        following = index + 1 < len(starts)
+        index = index[following] + 1
+        converted[following] = np.minimum(converted[following], starts[index] + offsets[index] - 1)
+        return converted
@@ -0,0 +1,151 @@
+# Imports
+from functools import lru_cache
+import numpy as np
+from my_wearable.lazy import LazyModule
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+# Central difference used for the derivative stage: y[n] = (x[n] - x[n-2]) / 2 is
+# np.gradient delayed by one sample
+DERIVATIVE = np.array([0.5, 0.0, -0.5])
+
+# Rate the pedometer filters and the step detector bounds were tuned at, in Hz
+REFERENCE_RATE = 50
+
+""" ================================================================================
+Designs a Butterworth filter as second-order sections. Results are cached, so every
+Pedometer asking for the same design gets the same array (which must not be modified).
+:param btype: (str) 'low' or 'high'
+:param order: (int) order of the filter
+:param cutoff: (float) cutoff frequency, normalized to Nyquist unless 'fs' is given
+:param fs: (float) sample rate in Hz, or None if 'cutoff' is normalized
+:return: (np.ndarray) second-order sections, shape (n_sections, 6)
+================================================================================ """
+@lru_cache(maxsize=128)
+def _butter(btype, order, cutoff, fs):
+    return sig.butter(order, cutoff, btype=btype, analog=False, output='sos', fs=fs)
+
+
+""" ================================================================================
+Designs the moving average filter of order N (the filter length = N+1)
+:param N: (int) order of the smoothing filter
+:return: (np.ndarray) FIR taps
+================================================================================ """
+@lru_cache(maxsize=32)
+def _boxcar(N):
+    return sig.windows.boxcar(N+1) / (N+1)
+
+
+""" ================================================================================
+Fuses the smoothing, derivative and low-pass stages of the pedometer into a single
+cascade of second-order sections. The two FIR stages are convolved into one FIR,
+which is split into sections and followed by the Butterworth sections.
+:param N: (int) order of the smoothing filter
+:param order: (int) order of the low-pass filter
+:param cutoff: (float) low-pass cutoff, normalized to Nyquist unless 'fs' is given
+:param fs: (float) sample rate in Hz, or None if 'cutoff' is normalized
+:param gain: (float) gain of the derivative stage
+:return: (np.ndarray) second-order sections, shape (n_sections, 6)
+================================================================================ """
+@lru_cache(maxsize=32)
+def _pedometer_cascade(N, order, cutoff, fs, gain=1.0):
+    fir = np.convolve(_boxcar(N), gain * DERIVATIVE)
+    return np.vstack((sig.tf2sos(fir, [1.0]), _butter('low', order, cutoff, fs)))
+
+
+""" ================================================================================
+Designs the anti-aliasing FIR used before keeping one sample in 'factor'
+:param factor: (int) decimation factor
+:return: (np.ndarray) FIR taps
+================================================================================ """
+@lru_cache(maxsize=16)
+def _decimator(factor):
+    # same design as sig.resample_poly: a Kaiser-windowed low-pass at the new Nyquist
+    half_len = 10 * factor
+    return sig.firwin(2 * half_len + 1, 1.0 / factor, window=('kaiser', 5.0))
+
+
+class FilterBank:
+
+    # Front-end for the cached filter designs. Designs are keyed by (type, order,
+    # cutoff, sample rate) and computed once per process, so creating Pedometers or
+    # calling the filters again never redesigns a filter.
+
+    """ ================================================================================
+    Butterworth low-pass filter as second-order sections
+    :param order: (int) order of the filter
+    :param cutoff: (float) cutoff frequency, normalized to Nyquist unless 'fs' is given
+    :param fs: (float) sample rate in Hz
+    :return: (np.ndarray) second-order sections
+    ================================================================================ """
+    def lowpass(self, order, cutoff, fs=None):
+        return _butter('low', int(order), float(cutoff), None if fs is None else float(fs))
+
+    """ ================================================================================
+    Butterworth high-pass filter as second-order sections
+    :param order: (int) order of the filter
+    :param cutoff: (float) cutoff frequency, normalized to Nyquist unless 'fs' is given
+    :param fs: (float) sample rate in Hz
+    :return: (np.ndarray) second-order sections
+    ================================================================================ """
+    def highpass(self, order, cutoff, fs=None):
+        return _butter('high', int(order), float(cutoff), None if fs is None else float(fs))
+
+    """ ================================================================================
+    Moving average filter taps
+    :param N: (int) order of the smoothing filter (the filter length = N+1)
+    :return: (np.ndarray) FIR taps
+    ================================================================================ """
+    def boxcar(self, N):
+        return _boxcar(int(N))
+
+    """ ================================================================================
+    Smoothing, derivative and low-pass stages fused into one cascade. Its output is
+    delayed by one sample compared to running the stages with np.gradient.
+    :param N: (int) order of the smoothing filter
+    :param order: (int) order of the low-pass filter
+    :param cutoff: (float) low-pass cutoff, normalized to Nyquist unless 'fs' is given
+    :param fs: (float) sample rate in Hz
+    :return: (np.ndarray) second-order sections
+    ================================================================================ """
+    def pedometer_cascade(self, N, order, cutoff, fs=None):
+        return _pedometer_cascade(int(N), int(order), float(cutoff), None if fs is None else float(fs))
+
+    """ ================================================================================
+    The pedometer cascade designed for a sample rate: the smoothing window and the
+    low-pass cutoff are given in seconds and Hz, and the gradient is scaled to the
+    change per 1/REFERENCE_RATE seconds, so the filtered signal (and the step detector
+    bounds) mean the same thing at every rate. At 50Hz this is
+    pedometer_cascade(4, 3, 5 / (0.5 * 50)).
+    :param fs: (float) sample rate in Hz
+    :param window: (float) length of the smoothing window in seconds
+    :param cutoff: (float) low-pass cutoff in Hz
+    :param order: (int) order of the low-pass filter
+    :return: (np.ndarray) second-order sections
+    ================================================================================ """
+    def pedometer(self, fs, window=0.1, cutoff=5.0, order=3):
+        N = max(1, int(round(window * fs))) - 1
+        return _pedometer_cascade(N, int(order), float(cutoff), float(fs), float(fs) / REFERENCE_RATE)
+
+    """ ================================================================================
+    Anti-aliasing FIR of a decimation by 'factor'
+    :param factor: (int) decimation factor
+    :return: (np.ndarray) FIR taps
+    ================================================================================ """
+    def decimator(self, factor):
+        return _decimator(int(factor))
+
+    """ ================================================================================
+    Hit/miss statistics of the design caches
+    :return: (dict) cache info per design function
+    ================================================================================ """
+    def cache_info(self):
+        return {"butter": _butter.cache_info(),
+                "boxcar": _boxcar.cache_info(),
+                "pedometer_cascade": _pedometer_cascade.cache_info(),
+                "decimator": _decimator.cache_info()}
+
+
+# Filter bank shared by every Pedometer
+FILTER_BANK = FilterBank()
@@ -0,0 +1,531 @@
+# Imports
+import re
+import numpy as np
+from my_wearable.metrics import REGISTRY
+
+# Binary frame sent by MyWearable.ino in binary mode (7 bytes, little-endian fields):
+#   sync (0xA5) | delta timestamp (uint24, us) | L1 norm (uint16) | XOR of bytes 1-5
+FRAME_SYNC = 0xA5
+FRAME_SIZE = 7
+
+# Text frame sent by MyWearable.ino in text mode: "%8lu,%5lu;" (timestamp, L1 norm).
+# Both fields are unsigned longs, and the timestamp is micros(), which wraps around
+# after 2^32 microseconds (about 71.6 minutes).
+FIELD_LIMIT = 1 << 32
+MAX_DIGITS = 10
+# Longest text frame accepted; anything longer is two frames run together or noise
+MAX_TEXT_FRAME = 32
+# Samples after a timestamp that tell whether it is a restart (they continue from it)
+RESTART_FOLLOW = 2
+# Samples held back by TextDecoder until the samples after them arrive: the two after
+# a sample tell whether it is an outlier, once they were checked for a restart
+HOLD_BACK = 2 + RESTART_FOLLOW
+# A timestamp this far (us) behind the two before it, followed by two samples that
+# continue from it, is a restart of the wearable rather than a corrupted frame
+RESTART_JUMP = 1000000
+# Bytes of the text frames, and the place values of the digits of a field
+ZERO = ord("0")
+COMMA = ord(",")
+SPACE = ord(" ")
+PLACES = 10.0 ** np.arange(MAX_DIGITS - 1, -1, -1)
+# A text frame, and the bytes after the last one that cannot be part of a frame
+TEXT_FRAME = re.compile(rb" *(\d{1,%d}), *(\d{1,%d})" % (MAX_DIGITS, MAX_DIGITS))
+FRAME_TAIL = re.compile(rb"[0-9, ]*\Z")
+# Batches of up to this many frames are split into fields one frame at a time: a
+# handful of regex matches cost less than the fixed cost of the NumPy calls
+SMALL_BATCH = 32
+
+# Frame format commands, sent over the same "CF" channel as the sampling period
+BINARY_MODE = "CFB;"
+ASCII_MODE = "CFA;"
+
+class BinaryDecoder:
+
+    """ ================================================================================
+    Constructor that sets up a decoder for the binary frames. The firmware only sends
+    the time elapsed since the previous sample, so the decoder keeps the timestamp of
+    the last decoded sample to rebuild absolute timestamps.
+    :param timestamp: (int) timestamp of the last sample received before binary mode
+                      (for instance the last "%8lu,%5lu;" frame), 0 if unknown
+    :param text: (TextDecoder) decoder of the text frames sent before binary mode, which
+                 the stream goes back to after ASCII_MODE (see BLE.frame_mode)
+    :return: None
+    ================================================================================ """
+    def __init__(self, timestamp=0, text=None):
+        self.timestamp = int(timestamp)
+        self.text = text
+        self.invalid_frames = 0
+        return
+
+    """ ================================================================================
+    Decodes every complete frame in 'buffer' at once. Candidate frames start at each
+    sync byte and are kept if their checksum matches, which also resynchronizes the
+    stream after lost or corrupted bytes.
+    :param buffer: (bytes or bytearray) received bytes
+    :return: (tuple) timestamps, values and the number of bytes consumed from 'buffer'
+    ================================================================================ """
+    def decode(self, buffer):
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        if len(data) < FRAME_SIZE:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0
+
+        starts = np.flatnonzero(data[:len(data) - FRAME_SIZE + 1] == FRAME_SYNC)
+        frames = data[starts[:, None] + np.arange(FRAME_SIZE)]
+        valid = np.bitwise_xor.reduce(frames[:, 1:6], axis=1) == frames[:, 6]
+        starts = starts[valid]
+        frames = frames[valid]
+
+        # a sync byte inside a valid frame can pass the checksum by chance
+        if len(starts) > 1 and np.any(np.diff(starts) < FRAME_SIZE):
+            keep = np.zeros(len(starts), dtype=bool)
+            end = 0
+            for i, start in enumerate(starts):
+                if start >= end:
+                    keep[i] = True
+                    end = start + FRAME_SIZE
+            starts = starts[keep]
+            frames = frames[keep]
+
+        # only a partial frame (less than FRAME_SIZE bytes) can be left for later
+        consumed = len(data) - FRAME_SIZE + 1
+        if len(starts):
+            consumed = max(consumed, starts[-1] + FRAME_SIZE)
+        self.invalid_frames += int(np.count_nonzero(~valid))
+
+        frames = frames.astype(np.int64)
+        deltas = frames[:, 1] | (frames[:, 2] << 8) | (frames[:, 3] << 16)
+        values = frames[:, 4] | (frames[:, 5] << 8)
+        times = self.timestamp + np.cumsum(deltas)
+        if len(times):
+            self.timestamp = int(times[-1])
+        return times, values, int(consumed)
+
+    """ ================================================================================
+    Returns the samples held back: every frame is returned as soon as it is decoded,
+    so there are none (same interface as TextDecoder)
+    :return: (tuple) empty timestamps and values
+    ================================================================================ """
+    def flush(self):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+
+class TextDecoder:
+
+    """ ================================================================================
+    Constructor that sets up a decoder for the "%8lu,%5lu;" text frames, working on the
+    raw received bytes. Every step runs on whole batches with NumPy (a batch of a few
+    frames, as a live link delivers them, is split into fields one frame at a time,
+    which is cheaper than the NumPy calls; the timestamps are then checked by the same
+    vectorized code whatever the size of the batch, so the result does not depend on
+    how the stream was chunked, unless a few samples simply continue in order, which
+    the checks would all keep):
+        1) frame boundaries are the 'eol' bytes, and a frame starts over after any
+           byte that cannot be part of one (noise, "OK+..." answers, non UTF-8
+           bytes), so the stream resynchronizes right after garbage; a run of bytes
+           too long to hold a frame is dropped
+        2) a frame is invalid unless it is exactly "digits,digits" (spaces in front of
+           the digits); the fields are right-aligned into matrices and parsed with
+           the place values of their digits
+        3) the micros() timestamps are unwrapped at 2^32
+        4) a timestamp more than RESTART_JUMP behind the two before it, followed by two
+           samples that continue from it, is a restart of the wearable (micros()
+           starts over from 0): the timestamps from there on are shifted to continue
+           one sample interval after the last one, so they keep increasing
+        5) a timestamp is an outlier unless it lies between its neighbours (or between
+           the neighbours of its neighbours, when one of them is the outlier), which
+           rejects the corrupted and merged frames but keeps a gap after a reconnect
+    The last HOLD_BACK samples of each batch are only returned with the next batch,
+    once the samples after them tell whether they are outliers. Errors are counted,
+    never printed. A reconnection needs no reset(): a restart is detected in the
+    timestamps themselves, and the wraps counted so far stay valid otherwise.
+    :param eol: (str) character terminating each frame
+    :param name: (str) name of the device in the metrics
+    :return: None
+    ================================================================================ """
+    def __init__(self, eol=';', name="ble"):
+        self._eol = ord(eol)
+        self._eol_bytes = eol.encode()
+        # bytes that can be part of a frame
+        self._allowed = np.zeros(256, dtype=bool)
+        self._allowed[[*range(ZERO, ZERO + 10), COMMA, SPACE, self._eol]] = True
+        self.invalid_frames = 0     # frames that are not "timestamp,value"
+        self.rejected_samples = 0   # timestamp outliers
+        self.dropped_bytes = 0      # noise skipped to resynchronize
+        self.restarts = 0           # restarts of the wearable clock re-based
+        self._invalid_counter = REGISTRY.counter("parse_errors_total", device=name)
+        self._rejected_counter = REGISTRY.counter("rejected_samples_total", device=name)
+        self._dropped_counter = REGISTRY.counter("dropped_bytes_total", device=name)
+        self._restart_counter = REGISTRY.counter("clock_restarts_total", device=name)
+        self.reset()
+        return
+
+    """ ================================================================================
+    Forgets the timestamps seen so far and the samples held back
+    :return: None
+    ================================================================================ """
+    def reset(self):
+        self._raw = None                            # last timestamp received, as sent
+        self._epoch = 0                             # wraps of micros() up to it
+        self._offset = 0                            # shift of the clock since restarts
+        self._emitted = np.full(2, -FIELD_LIMIT)    # last two timestamps returned
+        self._received = [-FIELD_LIMIT] * 2         # last two received before the held ones
+        self._held_times = np.zeros(0, dtype=np.int64)
+        self._held_values = np.zeros(0, dtype=np.int64)
+        self._overlong = False                      # the frame in progress is too long
+        return
+
+    """ ================================================================================
+    Parses a few complete frames one at a time, with the same rules as __parse (the
+    timestamps are validated by __validate in both cases)
+    :param data: (bytes) bytes up to and including the last 'eol'
+    :return: (tuple) timestamps and values of the valid frames as lists, number of
+             invalid frames and of bytes skipped as noise
+    ================================================================================ """
+    def __parse_small(self, data):
+        times, values = [], []
+        invalid = noise = 0
+        for frame in data.split(self._eol_bytes)[:-1]:
+            start = FRAME_TAIL.search(frame).start()
+            noise += start
+            match = TEXT_FRAME.fullmatch(frame, start) if len(frame) - start <= MAX_TEXT_FRAME else None
+            if match is None or int(match[1]) >= FIELD_LIMIT or int(match[2]) >= FIELD_LIMIT:
+                invalid += 1
+                continue
+            times.append(int(match[1]))
+            values.append(int(match[2]))
+        return times, values, invalid, noise
+
+    """ ================================================================================
+    Parses the complete frames of a buffer
+    :param data: (np.ndarray) bytes up to and including the last 'eol'
+    :param ends: (np.ndarray) positions of the 'eol' bytes
+    :return: (tuple) timestamps and values of the valid frames, number of invalid
+             frames and of bytes skipped as noise
+    ================================================================================ """
+    def __parse(self, data, ends):
+        n = len(ends)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        boundaries = starts.copy()
+
+        # a frame starts over after the last byte that cannot be part of one (noise in
+        # front of it); whatever the rest holds is still checked below
+        garbage = np.flatnonzero(~self._allowed[data])
+        if len(garbage):
+            frame = np.searchsorted(ends, garbage)
+            last = np.append(frame[1:] != frame[:-1], True)
+            starts[frame[last]] = garbage[last] + 1
+        noise = int((starts - boundaries).sum())
+
+        # a valid frame holds exactly one comma
+        commas = np.flatnonzero(data == COMMA)
+        first = np.searchsorted(commas, starts)
+        valid = (np.searchsorted(commas, ends) - first == 1) & (ends - starts <= MAX_TEXT_FRAME)
+        frames = np.flatnonzero(valid)
+        comma = commas[first[frames]]
+
+        times = self.__field(data, starts[frames], comma)
+        values = self.__field(data, comma + 1, ends[frames])
+        good = (times >= 0) & (values >= 0)
+        return times[good].astype(np.int64), values[good].astype(np.int64), int(n - good.sum()), noise
+
+    """ ================================================================================
+    Parses one field of many frames. The fields are right-aligned into a matrix (one
+    row per frame, spaces in front), so every field costs the same few NumPy calls.
+    :param data: (np.ndarray) received bytes
+    :param lo: (np.ndarray) position of the first byte of each field
+    :param hi: (np.ndarray) position after the last byte of each field
+    :return: (np.ndarray) the numbers as floats, -1 where the field is not spaces
+             followed by 1 to MAX_DIGITS digits, or does not fit in 32 bits
+    ================================================================================ """
+    @staticmethod
+    def __field(data, lo, hi):
+        width = max(MAX_DIGITS, int(np.max(hi - lo, initial=0)))
+        columns = hi[:, None] - width + np.arange(width)
+        chars = np.take(data, columns, mode='clip')
+        chars[columns < lo[:, None]] = SPACE
+        digits = chars - np.uint8(ZERO)     # bytes other than digits wrap above 9
+        is_digit = digits <= 9
+        count = is_digit.sum(axis=1)
+        # no digit may be followed by anything else than a digit
+        ok = (count >= 1) & (count <= MAX_DIGITS) & (is_digit[:, 1:] >= is_digit[:, :-1]).all(axis=1)
+        digits[~is_digit] = 0
+        numbers = digits[:, -MAX_DIGITS:].astype(float) @ PLACES
+        return np.where(ok & (numbers < FIELD_LIMIT), numbers, -1.0)
+
+    """ ================================================================================
+    Unwraps the micros() timestamps: a jump of more than half the 32-bit range is a
+    wrap (forwards or backwards, so that an outlier and the sample after it cancel out)
+    :param raw: (np.ndarray) timestamps as sent
+    :return: (np.ndarray) timestamps without the wraps
+    ================================================================================ """
+    def __unwrap(self, raw):
+        jumps = raw - np.concatenate(([raw[0] if self._raw is None else self._raw], raw[:-1]))
+        wraps = np.round(jumps / FIELD_LIMIT).astype(np.int64)
+        self._raw = int(raw[-1])
+        if not wraps.any():
+            return raw + (self._epoch * FIELD_LIMIT + self._offset)
+        epochs = self._epoch - np.cumsum(wraps)
+        self._epoch = int(epochs[-1])
+        return raw + epochs * FIELD_LIMIT + self._offset
+
+    """ ================================================================================
+    Re-bases the timestamps after each restart of the wearable, so that they continue
+    one sample interval after the two samples received before the restart. The samples
+    are checked once each, in the order they arrived (rejected ones included), so the
+    restarts found do not depend on how the stream was split into batches.
+    :param times: (np.ndarray) unwrapped timestamps, held back ones first
+    :param start: (int) first sample not checked yet
+    :return: (np.ndarray) the timestamps, shifted from each restart on
+    ================================================================================ """
+    def __rebase(self, times, start):
+        # a sample is checked once the two after it arrived
+        n = len(times) - RESTART_FOLLOW
+        if n <= start:
+            return times
+        # sample i of 'times' is padded[i + 2], after the two samples received before it
+        padded = np.concatenate((self._received, times))
+        t = padded[start + 2:n + 2]
+        back = (t < padded[start + 1:n + 1] - RESTART_JUMP) & (t < padded[start:n] - RESTART_JUMP)
+        if not back.any():
+            return times
+        follow = (t < padded[start + 3:n + 3]) & (padded[start + 3:n + 3] < padded[start + 4:n + 4]) \
+            & (padded[start + 4:n + 4] < t + RESTART_JUMP)
+        # a shift leaves the samples after it unchanged relative to each other, and two
+        # restarts are at least three samples apart, so the ones found above all hold
+        for i in start + np.flatnonzero(back & follow):
+            self.__shift(padded, i + 2, max(padded[i], padded[i + 1]))
+        return padded[2:]
+
+    """ ================================================================================
+    Shifts the timestamps from a restart on, and the ones to come
+    :param padded: (np.ndarray) timestamps, shifted in place
+    :param i: (int) position of the first sample after the restart in 'padded'
+    :param last: (int) timestamp the restarted clock continues from
+    :return: None
+    ================================================================================ """
+    def __shift(self, padded, i, last):
+        # the first sample follows 'last' by the interval to the sample after it
+        delta = int(last + padded[i + 1] - 2 * padded[i])
+        padded[i:] += delta
+        self._offset += delta
+        self.restarts += 1
+        self._restart_counter.inc()
+        return
+
+    """ ================================================================================
+    Rejects the timestamps that are out of order with their neighbours. A sample in
+    order with its neighbours but more than RESTART_JUMP behind the last one returned,
+    which the two after it follow, is a restart __rebase missed (e.g. a corrupted frame
+    right after it): the timestamps are shifted from there on.
+    :param times: (np.ndarray) unwrapped timestamps, held back ones first
+    :return: (tuple) the timestamps, and the mask of the samples kept (the held back
+             ones are decided later)
+    ================================================================================ """
+    def __in_order(self, times):
+        n = len(times) - HOLD_BACK
+        if n <= 0:
+            return times, np.zeros(0, dtype=bool)
+        # sample i of 'times' is padded[i + 2], with the two timestamps received before
+        # it (rejected ones included, as within a batch) and the two after it
+        padded = np.concatenate((self._received, times))
+        keep = np.zeros(n, dtype=bool)
+        floor = self._emitted[1]
+        lo = 0
+        while lo < n:
+            t = padded[lo + 2:n + 2]
+            after = (t < padded[lo + 3:n + 3]) | (t < padded[lo + 4:n + 4])
+            before = (padded[lo + 1:n + 1] < t) | (padded[lo:n] < t)
+            ok = before & after
+
+            # whatever is left must increase strictly from the last timestamp returned
+            kept = np.flatnonzero(ok)
+            floors = np.maximum.accumulate(np.concatenate(([floor], t[kept])))[:-1]
+            late = kept[t[kept] <= floors - RESTART_JUMP] + lo
+            late = late[(padded[late + 2] < padded[late + 3]) & (padded[late + 3] < padded[late + 4])
+                        & (padded[late + 4] < padded[late + 2] + RESTART_JUMP)]
+            if len(late) == 0:
+                ok[kept[t[kept] <= floors]] = False
+                keep[lo:] = ok
+                break
+
+            # the decisions up to the restart stand, the samples after it are decided
+            # again once shifted
+            restart = int(late[0])
+            before_restart = np.searchsorted(kept, restart - lo)
+            ok[kept[:before_restart][t[kept[:before_restart]] <= floors[:before_restart]]] = False
+            keep[lo:restart] = ok[:restart - lo]
+            self.__shift(padded, restart + 2, floors[before_restart])
+            keep[restart] = True
+            floor = padded[restart + 2]
+            lo = restart + 1
+        return padded[2:], keep
+
+    """ ================================================================================
+    Drops the bytes of a buffer without 'eol' that cannot be part of the next frame:
+    the noise in front of it, or the whole frame in progress once it is too long to be
+    valid (it is counted as invalid when its 'eol' arrives). The frames are then the
+    same whatever the chunks the stream arrives in.
+    :param data: (np.ndarray) received bytes, without 'eol'
+    :return: (int) number of bytes dropped from the front of 'data'
+    ================================================================================ """
+    def __resync(self, data):
+        garbage = np.flatnonzero(~self._allowed[data])
+        start = 0
+        if len(garbage):
+            # a frame starts over after noise
+            start = int(garbage[-1]) + 1
+            self._overlong = False
+        if self._overlong or len(data) - start > MAX_TEXT_FRAME:
+            self._overlong = True
+            self.dropped_bytes += start
+            self._dropped_counter.inc(start)
+            return len(data)
+        self.dropped_bytes += start
+        self._dropped_counter.inc(start)
+        return start
+
+    """ ================================================================================
+    Decodes every complete frame in 'buffer' at once
+    :param buffer: (bytes or bytearray) received bytes
+    :return: (tuple) timestamps, values and the number of bytes consumed from 'buffer'
+    ================================================================================ """
+    def decode(self, buffer):
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        ends = np.flatnonzero(data == self._eol)
+        skip = 0
+        if self._overlong and len(ends):
+            # the frame dropped for being too long ends here, unless noise started a
+            # new one before its end
+            if self._allowed[data[:ends[0]]].all():
+                skip = int(ends[0]) + 1
+                ends = ends[1:]
+                self.invalid_frames += 1
+                self._invalid_counter.inc()
+            self._overlong = False
+        if len(ends) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), skip + self.__resync(data[skip:])
+        consumed = int(ends[-1]) + 1
+        small = len(ends) <= SMALL_BATCH and consumed - skip <= SMALL_BATCH * MAX_TEXT_FRAME
+        if small:
+            raw, values, invalid, dropped = self.__parse_small(bytes(buffer[skip:consumed]))
+        else:
+            raw, values, invalid, dropped = self.__parse(data[skip:consumed], ends - skip)
+        if invalid or dropped:
+            self.invalid_frames += invalid
+            self.dropped_bytes += dropped
+            self._invalid_counter.inc(invalid)
+            self._dropped_counter.inc(dropped)
+        if len(raw) == 0:
+            # the samples held back still wait for the ones after them
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), consumed
+        if small:
+            times = self.__in_sequence(raw)
+            if times is not None:
+                return self.__accept(times, values) + (consumed,)
+        return self.__validate(np.asarray(raw, dtype=np.int64), np.asarray(values, dtype=np.int64)) + (consumed,)
+
+    """ ================================================================================
+    Whether a few new samples continue the stream in order, as they nearly always do on
+    a live link: each timestamp follows the one before it by less than half the 32-bit
+    range (so nothing wraps), and the ones received before them (held back ones
+    included) increase too, from above the last timestamp returned. __validate would
+    then find no restart and reject nothing, so its NumPy calls, which cost more than
+    the check on a few samples, are skipped.
+    :param raw: (list) timestamps as sent
+    :return: (list) timestamps held back and new ones, unwrapped, or None if the
+             samples have to be validated
+    ================================================================================ """
+    def __in_sequence(self, raw):
+        previous = raw[0] - 1 if self._raw is None else self._raw
+        for timestamp in raw:
+            if not previous < timestamp <= previous + FIELD_LIMIT // 2:
+                return None
+            previous = timestamp
+        shift = self._epoch * FIELD_LIMIT + self._offset
+        times = self._held_times.tolist() + [timestamp + shift for timestamp in raw]
+        if times[0] <= self._emitted[1] or times[0] <= self._received[1] or self._received[1] <= self._received[0]:
+            return None
+        for before, after in zip(times, times[1:]):
+            if after <= before:
+                return None
+        return times
+
+    """ ================================================================================
+    Returns the samples found in order by __in_sequence, except the last HOLD_BACK
+    :param times: (list) timestamps held back and new ones, unwrapped
+    :param values: (list) new values
+    :return: (tuple) timestamps and values of the samples that can be returned
+    ================================================================================ """
+    def __accept(self, times, values):
+        self._raw = (times[-1] - self._offset) % FIELD_LIMIT
+        values = self._held_values.tolist() + values
+        decided = max(0, len(times) - HOLD_BACK)
+        self._received = (self._received + times[max(0, decided - 2):decided])[-2:]
+        self._held_times = np.array(times[decided:], dtype=np.int64)
+        self._held_values = np.array(values[decided:], dtype=np.int64)
+        if decided:
+            self._emitted = np.array((self._emitted[1], times[decided - 1]) if decided == 1 else times[decided - 2:decided])
+        return np.array(times[:decided], dtype=np.int64), np.array(values[:decided], dtype=np.int64)
+
+    """ ================================================================================
+    Unwraps and validates new samples together with the ones held back
+    :param raw: (np.ndarray) timestamps as sent
+    :param values: (np.ndarray) values
+    :return: (tuple) timestamps and values of the samples that can be returned
+    ================================================================================ """
+    def __validate(self, raw, values):
+        held = len(self._held_times)
+        times = np.concatenate((self._held_times, self.__unwrap(raw)))
+        times = self.__rebase(times, max(0, held - RESTART_FOLLOW))
+        values = np.concatenate((self._held_values, values))
+        times, keep = self.__in_order(times)
+        decided = len(keep)
+        self._received = (self._received + times[max(0, decided - 2):decided].tolist())[-2:]
+
+        rejected = int(decided - keep.sum())
+        self.rejected_samples += rejected
+        self._rejected_counter.inc(rejected)
+        self._held_times, self._held_values = times[decided:], values[decided:]
+        times, values = times[:decided][keep], values[:decided][keep]
+        if len(times):
+            self._emitted = np.concatenate((self._emitted, times))[-2:]
+        return times, values
+
+    """ ================================================================================
+    Timestamp of the last sample returned
+    :return: (int) the timestamp, None before the first sample
+    ================================================================================ """
+    @property
+    def timestamp(self):
+        return int(self._emitted[1]) if self._emitted[1] > -FIELD_LIMIT else None
+
+    """ ================================================================================
+    Continues the stream after binary frames: the next text frames are unwrapped from
+    the last binary sample, whatever the number of wraps of micros() meanwhile. The
+    samples held back must have been flushed first.
+    :param timestamp: (int) timestamp of the last binary sample (BinaryDecoder.timestamp)
+    :return: None
+    ================================================================================ """
+    def resume(self, timestamp):
+        raw = int(timestamp) - self._offset
+        self._raw = raw % FIELD_LIMIT
+        self._epoch = raw // FIELD_LIMIT
+        self._emitted = np.array([self._emitted[1], timestamp], dtype=np.int64)
+        self._received = [self._received[1], int(timestamp)]
+        return
+
+    """ ================================================================================
+    Returns the samples held back, judged without the samples that would follow them
+    (e.g. when the stream stops)
+    :return: (tuple) timestamps and values
+    ================================================================================ """
+    def flush(self):
+        times, values = self._held_times, self._held_values
+        keep = times > np.maximum.accumulate(np.concatenate((self._emitted[1:], times)))[:-1]
+        self.rejected_samples += int(len(keep) - keep.sum())
+        self._rejected_counter.inc(int(len(keep) - keep.sum()))
+        self._held_times = self._held_times[:0]
+        self._held_values = self._held_values[:0]
+        if keep.any():
+            self._emitted = np.concatenate((self._emitted, times[keep]))[-2:]
+        return times[keep], values[keep]
@@ -0,0 +1,46 @@
+# Imports
+import importlib
+
+class LazyModule:
+
+    """ ================================================================================
+    Constructor of a stand-in for a module that is imported the first time one of its
+    attributes is used. scipy.signal alone takes most of a second to import (it pulls
+    in scipy.stats), and pyserial is only needed to open a real port, so the modules
+    using them keep them behind a LazyModule: importing the package, parsing frames
+    or loading a recording never pays for them.
+    :param name: (str) full name of the module, e.g. "scipy.signal"
+    :return: None
+    ================================================================================ """
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        return
+
+    """ ================================================================================
+    Imports the module if it is not yet, and returns one of its attributes
+    :param attribute: (str) name of the attribute
+    :return: the attribute of the module
+    ================================================================================ """
+    def __getattr__(self, attribute):
+        if attribute.startswith("_LazyModule__"):
+            raise AttributeError(attribute)     # not initialized (e.g. while unpickling)
+        return getattr(self.__module or self.load(), attribute)
+
+    """ ================================================================================
+    Imports the module now, e.g. before starting threads that should not pay for it
+    on their first batch
+    :return: the module
+    ================================================================================ """
+    def load(self):
+        if self.__module is None:
+            # import_module takes the import lock, so two threads get the same module
+            self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    """ ================================================================================
+    Name of the module, and whether it was imported yet
+    :return: (str) the representation
+    ================================================================================ """
+    def __repr__(self):
+        return "<lazy module '{}'{}>".format(self.__name, "" if self.__module is None else " (imported)")
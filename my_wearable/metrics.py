@@ -0,0 +1,393 @@
+# Imports
+import json
+import threading
+from bisect import bisect_left
+from time import time
+
+# Default bucket upper bounds of the histograms, from 10us to 10s (and anything above)
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2,
+                   2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets for sizes (bytes per read, samples per batch, ...)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+class Counter:
+
+    """ ================================================================================
+    Constructor of a monotonic counter. Its name should end in "_total", as the
+    Prometheus exposition format expects. The same counter can be updated from several
+    threads (e.g. the parse errors of a device, from its BLE reader and its pedometer
+    worker), so the addition runs under a lock; it is uncontended nearly always and
+    costs well under a microsecond.
+    :return: None
+    ================================================================================ """
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+        return
+
+    """ ================================================================================
+    Increments the counter
+    :param n: (int) amount to add
+    :return: None
+    ================================================================================ """
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+        return
+
+
+class Gauge:
+
+    """ ================================================================================
+    Constructor of a gauge, a value that can go up and down (e.g. queue depth)
+    :return: None
+    ================================================================================ """
+    def __init__(self):
+        self.value = 0
+        return
+
+    """ ================================================================================
+    Sets the gauge
+    :param value: (float) the new value
+    :return: None
+    ================================================================================ """
+    def set(self, value):
+        self.value = value
+        return
+
+
+class Histogram:
+
+    """ ================================================================================
+    Constructor of a histogram with fixed buckets. Observing a value is a binary search
+    and an increment, no allocation. Like a Counter it can be shared by threads: the
+    bucket, the sum and the count are updated (and read by state()) under a lock, so
+    no observation is lost and a snapshot always has the count of its buckets.
+    :param buckets: (tuple) sorted upper bounds of the buckets
+    :return: None
+    ================================================================================ """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+        return
+
+    """ ================================================================================
+    Records one value
+    :param value: (float) the value
+    :return: None
+    ================================================================================ """
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+        return
+
+    """ ================================================================================
+    Consistent copy of the bucket counts, sum and count
+    :return: (tuple) counts (list), sum and count
+    ================================================================================ """
+    def state(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Registry:
+
+    """ ================================================================================
+    Constructor of a metrics registry. Metrics are identified by a name and a set of
+    labels; ask for them once (e.g. in a constructor) and keep the returned object, so
+    the hot path never looks anything up.
+    :return: None
+    ================================================================================ """
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        return
+
+    """ ================================================================================
+    Returns the metric called 'name' with 'labels', creating it on first use
+    :param kind: (class) Counter, Gauge or Histogram
+    :param name: (str) name of the metric
+    :param labels: (dict) labels of the metric
+    :param args: arguments of the metric constructor
+    :return: the metric
+    ================================================================================ """
+    def _get(self, kind, name, labels, *args):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = kind(*args)
+                self._metrics[key] = metric
+        if not isinstance(metric, kind):
+            raise ValueError("Metric {} already registered as a {}".format(name, type(metric).__name__))
+        return metric
+
+    """ ================================================================================
+    Returns the counter called 'name' with 'labels'
+    :return: (Counter) the counter
+    ================================================================================ """
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    """ ================================================================================
+    Returns the gauge called 'name' with 'labels'
+    :return: (Gauge) the gauge
+    ================================================================================ """
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    """ ================================================================================
+    Returns the histogram called 'name' with 'labels'
+    :param buckets: (tuple) bucket upper bounds, only used when it is created
+    :return: (Histogram) the histogram
+    ================================================================================ """
+    def histogram(self, name, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, buckets)
+
+    """ ================================================================================
+    Registers a function called before every snapshot. Use it to set gauges from
+    values that are cheaper to read than to track (queue depth, buffer occupancy).
+    :param collector: function called with no arguments
+    :return: None
+    ================================================================================ """
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+        return
+
+    """ ================================================================================
+    Unregisters a function added with add_collector()
+    :param collector: the function
+    :return: None
+    ================================================================================ """
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+        return
+
+    """ ================================================================================
+    Takes a snapshot of every metric
+    :return: (dict) timestamp and one entry per metric
+    ================================================================================ """
+    def snapshot(self):
+        for collector in self._collectors:
+            collector()
+        with self._lock:
+            items = list(self._metrics.items())
+
+        metrics = []
+        for (name, labels), metric in items:
+            entry = {"name": name, "labels": dict(labels), "type": type(metric).__name__.lower()}
+            if isinstance(metric, Histogram):
+                counts, total, count = metric.state()
+                entry.update(buckets=list(metric.buckets), counts=counts, sum=total, count=count)
+            else:
+                entry["value"] = metric.value
+            metrics.append(entry)
+        return {"timestamp": time(), "metrics": metrics}
+
+    """ ================================================================================
+    Removes every metric and collector
+    :return: None
+    ================================================================================ """
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+        self._collectors = []
+        return
+
+
+class MemorySink:
+
+    """ ================================================================================
+    Constructor of a sink keeping the last snapshots in memory
+    :param history: (int) number of snapshots to keep
+    :return: None
+    ================================================================================ """
+    def __init__(self, history=2):
+        self._history = history
+        self.snapshots = []
+        return
+
+    """ ================================================================================
+    Stores a snapshot
+    :param snapshot: (dict) output of Registry.snapshot()
+    :return: None
+    ================================================================================ """
+    def write(self, snapshot):
+        self.snapshots = (self.snapshots + [snapshot])[-self._history:]
+        return
+
+    """ ================================================================================
+    Per-second rate of every counter between the last two snapshots (e.g. frames/sec)
+    :return: (dict) rate per (name, labels) of each counter
+    ================================================================================ """
+    def rates(self):
+        if len(self.snapshots) < 2:
+            return {}
+        before, after = self.snapshots[-2], self.snapshots[-1]
+        elapsed = after["timestamp"] - before["timestamp"]
+        old = {(m["name"], tuple(sorted(m["labels"].items()))): m["value"]
+               for m in before["metrics"] if m["type"] == "counter"}
+        rates = {}
+        for m in after["metrics"]:
+            key = (m["name"], tuple(sorted(m["labels"].items())))
+            if m["type"] == "counter" and elapsed > 0:
+                rates[key] = (m["value"] - old.get(key, 0)) / elapsed
+        return rates
+
+
+class JsonLinesSink:
+
+    """ ================================================================================
+    Constructor of a sink appending every snapshot as one JSON line to a file
+    :param filename: (str) the file
+    :return: None
+    ================================================================================ """
+    def __init__(self, filename):
+        self._filename = filename
+        return
+
+    """ ================================================================================
+    Appends a snapshot to the file
+    :param snapshot: (dict) output of Registry.snapshot()
+    :return: None
+    ================================================================================ """
+    def write(self, snapshot):
+        with open(self._filename, 'a') as file:
+            file.write(json.dumps(snapshot) + "\n")
+        return
+
+
+""" ================================================================================
+Formats a snapshot in the Prometheus text exposition format
+:param snapshot: (dict) output of Registry.snapshot()
+:return: (str) the text
+================================================================================ """
+def prometheus_text(snapshot):
+    lines = []
+    typed = set()
+    for m in snapshot["metrics"]:
+        name = "heuristic_pedometer_" + m["name"]
+        if name not in typed:
+            lines.append("# TYPE {} {}".format(name, m["type"]))
+            typed.add(name)
+        labels = ",".join('{}="{}"'.format(k, v) for k, v in sorted(m["labels"].items()))
+        if m["type"] != "histogram":
+            lines.append("{}{{{}}} {}".format(name, labels, m["value"]))
+            continue
+        cumulative = 0
+        for bound, count in zip(m["buckets"] + ["+Inf"], m["counts"]):
+            cumulative += count
+            le = 'le="{}"'.format(bound)
+            lines.append("{}_bucket{{{}}} {}".format(name, ",".join(filter(None, [labels, le])), cumulative))
+        lines.append("{}_sum{{{}}} {}".format(name, labels, m["sum"]))
+        lines.append("{}_count{{{}}} {}".format(name, labels, m["count"]))
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusSink:
+
+    """ ================================================================================
+    Constructor of a sink serving the latest metrics as Prometheus text over HTTP. The
+    snapshot is taken when the endpoint is scraped, so nothing runs in between.
+    :param registry: (Registry) the registry to expose
+    :param port: (int) TCP port of the endpoint (0 picks a free one)
+    :param host: (str) address to listen on
+    :return: None
+    ================================================================================ """
+    def __init__(self, registry, port=9100, host="127.0.0.1"):
+        # http.server is only needed by this sink, most runs never load it
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.text().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                return
+
+        self._registry = registry
+        self._server = HTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        return
+
+    """ ================================================================================
+    Current metrics in the Prometheus text format
+    :return: (str) the text
+    ================================================================================ """
+    def text(self):
+        return prometheus_text(self._registry.snapshot())
+
+    """ ================================================================================
+    Prometheus scrapes the endpoint itself, so writing a snapshot does nothing
+    :return: None
+    ================================================================================ """
+    def write(self, snapshot):
+        return
+
+    """ ================================================================================
+    Stops the HTTP endpoint
+    :return: None
+    ================================================================================ """
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        return
+
+
+class Reporter:
+
+    """ ================================================================================
+    Constructor of a background thread writing a snapshot of 'registry' to 'sink'
+    every 'interval' seconds
+    :param registry: (Registry) the registry
+    :param sink: the sink (MemorySink, JsonLinesSink, ...)
+    :param interval: (float) seconds between two snapshots
+    :return: None
+    ================================================================================ """
+    def __init__(self, registry, sink, interval=10.0):
+        self._registry = registry
+        self._sink = sink
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name="metrics-reporter", daemon=True)
+        self._thread.start()
+        return
+
+    """ ================================================================================
+    Reporter thread
+    :return: None
+    ================================================================================ """
+    def __run(self):
+        while not self._stop.wait(self._interval):
+            self._sink.write(self._registry.snapshot())
+        return
+
+    """ ================================================================================
+    Stops the reporter after writing a last snapshot
+    :return: None
+    ================================================================================ """
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sink.write(self._registry.snapshot())
+        return
+
+
+# Registry used by the BLE, Pedometer and Acquisition classes
+REGISTRY = Registry()
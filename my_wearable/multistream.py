@@ -0,0 +1,254 @@
+# Imports
+import numpy as np
+from my_wearable.filters import FILTER_BANK
+from my_wearable.lazy import LazyModule
+from my_wearable.resample import step_cutoff
+from my_wearable.steps import StepDetector
+from my_wearable.streaming import MAX_PLATEAU
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+""" ================================================================================
+Packs a ragged set of streams into one 2-D array, each stream left-aligned in its row
+and the rows padded with 'fill' up to the longest one
+:param streams: (list) 1-D arrays
+:param fill: (float) value of the padding
+:return: (tuple) packed array of shape (n_streams, max length) and the lengths
+================================================================================ """
+def pack_streams(streams, fill=0.0):
+    lengths = np.array([len(stream) for stream in streams], dtype=np.intp)
+    packed = np.full((len(streams), lengths.max(initial=0)), fill, dtype=float)
+    if len(streams):
+        # boolean assignment fills the rows in order, like the concatenation
+        packed[np.arange(packed.shape[1]) < lengths[:, None]] = np.concatenate(streams)
+    return packed, lengths
+
+
+""" ================================================================================
+Splits a packed array back into one 1-D array per stream
+:param packed: (np.ndarray) packed array, shape (n_streams, n_samples)
+:param lengths: (np.ndarray) number of valid samples of each row
+:return: (list) views on the valid part of each row
+================================================================================ """
+def unpack_streams(packed, lengths):
+    return [row[:length] for row, length in zip(packed, np.asarray(lengths).tolist())]
+
+
+""" ================================================================================
+Runs the pedometer filters over many streams at once:
+    de-mean -> boxcar smoothing -> gradient -> low-pass
+along the last axis of a 2-D array. The streams must already be on a uniform grid at
+the same rate (see my_wearable.resample); each row then gets exactly what the batch
+Pedometer computes for it, but in one sosfilt call for all of them.
+:param values: (np.ndarray) streams, shape (n_streams, n_samples)
+:param fs: (float) rate of the grid in Hz
+:param lengths: (np.ndarray) number of valid samples of each row (None if all are)
+:param cutoff: (float) low-pass cutoff in Hz (None for step_cutoff(fs); a stream
+               interpolated up from a slower rate wants the cutoff of its own rate)
+:return: (np.ndarray) filtered streams, with zeros after the end of the shorter rows
+================================================================================ """
+def filter_streams(values, fs, lengths=None, cutoff=None):
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    n_streams, n_samples = values.shape
+    if lengths is None:
+        lengths = np.full(n_streams, n_samples, dtype=np.intp)
+    lengths = np.asarray(lengths, dtype=np.intp)
+    valid = np.arange(n_samples) < lengths[:, None]
+    if n_samples == 0:
+        return np.zeros_like(values)
+
+    # running mean of each row, the padding does not count
+    values = np.where(valid, values, 0.0)
+    demeaned = values - np.cumsum(values, axis=-1) / np.arange(1, n_samples + 1)
+
+    sos = FILTER_BANK.pedometer(fs, cutoff=step_cutoff(fs) if cutoff is None else cutoff)
+    filtered = sig.sosfilt(sos, demeaned, axis=-1)
+
+    # the cascade lags by one sample; each row repeats its own last value
+    shifted = np.empty_like(filtered)
+    shifted[:, :-1] = filtered[:, 1:]
+    rows = np.flatnonzero(lengths > 0)
+    shifted[rows, lengths[rows] - 1] = filtered[rows, lengths[rows] - 1]
+    shifted[~valid] = 0.0
+    return shifted
+
+
+""" ================================================================================
+Finds the steps of many filtered streams in one pass
+:param filtered: (np.ndarray) output of filter_streams()
+:param fs: (float) rate of the grid in Hz
+:param lengths: (np.ndarray) number of valid samples of each row (None if all are)
+:param detector: (StepDetector) rules deciding which peaks are steps
+:return: (tuple) row and column of every step as np.ndarrays, ordered by row
+================================================================================ """
+def find_steps(filtered, fs, lengths=None, detector=None):
+    detector = detector if detector is not None else StepDetector()
+    return detector.detect_many(filtered, lengths, fs)
+
+
+class MultiStreamFilter:
+
+    """ ================================================================================
+    Constructor of the streaming pedometer filters for many streams at once. It does
+    what one StreamingFilter per stream does after the resampling (running de-mean,
+    the fused cascade, incremental peaks and the step rules), but keeps the state of
+    every stream in arrays (the sosfilt 'zi' has one slice per stream), so a tick of
+    new samples for all the streams costs a few NumPy calls instead of a Python loop
+    over the streams. The streams must be on a uniform grid at the same rate.
+    :param n_streams: (int) number of streams
+    :param fs: (float) rate of the grid in Hz
+    :param cutoff: (float) low-pass cutoff in Hz (None for step_cutoff(fs))
+    :param detector: (StepDetector) rules deciding which peaks are steps
+    :return: None
+    ================================================================================ """
+    def __init__(self, n_streams, fs, cutoff=None, detector=None):
+        self.n_streams = n_streams
+        self.fs = fs
+        self.detector = detector if detector is not None else StepDetector()
+        self._sos = FILTER_BANK.pedometer(fs, cutoff=step_cutoff(fs) if cutoff is None else cutoff)
+        self.reset()
+        return
+
+    """ ================================================================================
+    Resets every stream to its initial (empty) state
+    :return: None
+    ================================================================================ """
+    def reset(self):
+        n = self.n_streams
+        self._sum = np.zeros(n)
+        self._count = np.zeros(n, dtype=np.int64)
+        self._zi = np.zeros((len(self._sos), n, 2))
+        # timestamp of the last sample of each stream, its filtered value comes next
+        self._pending = np.zeros(n, dtype=np.int64)
+        self._started = np.zeros(n, dtype=bool)
+        # filtered samples that can still turn out to be (or sit next to) a peak,
+        # right-aligned with NaN in front of the shorter tails
+        self._tail = np.full((n, 0), np.nan)
+        self._tail_times = np.zeros((n, 0), dtype=np.int64)
+        self._last_step = np.full(n, -np.inf)
+        self.steps = np.zeros(n, dtype=np.int64)
+        return
+
+    """ ================================================================================
+    Filters one chunk of every stream with the state the previous chunk left. Rows of
+    the same length go through one sosfilt call, so a ragged tick costs one call per
+    distinct length.
+    :param values: (np.ndarray) de-meaned chunk, shape (n_streams, n_samples)
+    :param lengths: (np.ndarray) number of valid samples of each row
+    :return: (np.ndarray) filtered chunk (zeros after the end of the shorter rows)
+    ================================================================================ """
+    def __cascade(self, values, lengths):
+        filtered = np.zeros_like(values)
+        groups = np.unique(lengths)
+        if len(groups) == 1:
+            if groups[0] > 0:
+                filtered[:, :groups[0]], self._zi = sig.sosfilt(self._sos, values[:, :groups[0]], axis=-1,
+                                                                zi=self._zi)
+            return filtered
+        for length in groups[groups > 0].tolist():
+            rows = np.flatnonzero(lengths == length)
+            filtered[rows, :length], self._zi[:, rows] = sig.sosfilt(self._sos, values[rows, :length], axis=-1,
+                                                                     zi=self._zi[:, rows])
+        return filtered
+
+    """ ================================================================================
+    Finds the new peaks of every stream in one find_peaks call and keeps, for each
+    stream, the samples from its last change of value onwards for the next chunk (only
+    the last one once they are a plateau longer than MAX_PLATEAU, as StreamingFilter
+    does, so a stream at rest does not carry its whole history)
+    :param filtered: (np.ndarray) filtered chunk with NaN where there is no sample
+    :param times: (np.ndarray) timestamps of the filtered samples
+    :return: (tuple) row, value and timestamp of the new peaks
+    ================================================================================ """
+    def __find_peaks(self, filtered, times):
+        ext = np.concatenate((self._tail, filtered, np.full((self.n_streams, 1), np.nan)), axis=1)
+        ext_times = np.concatenate((self._tail_times, times, np.zeros((self.n_streams, 1), dtype=np.int64)), axis=1)
+        width = ext.shape[1]
+        rows, cols = np.divmod(sig.find_peaks(ext.ravel())[0], width)
+        peaks = ext[rows, cols], ext_times[rows, cols]
+
+        # last sample of each row, and the last one before it with a different value
+        valid = ~np.isnan(ext)
+        has = valid.any(axis=1)
+        last = width - 1 - np.argmax(valid[:, ::-1], axis=1)
+        changed = valid & (ext != ext[np.arange(self.n_streams), last][:, None])
+        changed[~has] = False
+        start = np.where(changed.any(axis=1), width - 1 - np.argmax(changed[:, ::-1], axis=1),
+                         np.argmax(valid, axis=1))
+        start = np.where(last - start > MAX_PLATEAU, last, start)
+        size = int(np.max(np.where(has, last - start + 1, 0), initial=0))
+
+        # right-aligned copy of the tails
+        src = last[:, None] - (size - 1) + np.arange(size)
+        keep = has[:, None] & (src >= start[:, None])
+        src = np.clip(src, 0, width - 1)
+        self._tail = np.where(keep, np.take_along_axis(ext, src, axis=1), np.nan)
+        self._tail_times = np.where(keep, np.take_along_axis(ext_times, src, axis=1), 0)
+        return rows, peaks[0], peaks[1]
+
+    """ ================================================================================
+    Applies the amplitude bounds and the min interval of the detector to the new peaks,
+    with the last step of each stream carried over from the previous chunks
+    :param rows: (np.ndarray) stream of each peak, in order
+    :param values: (np.ndarray) amplitude of each peak
+    :param times: (np.ndarray) timestamp of each peak
+    :return: (tuple) stream and timestamp of the new steps
+    ================================================================================ """
+    def __accept(self, rows, values, times):
+        keep = (values >= self.detector.lower_bound) & (values <= self.detector.upper_bound)
+        rows, times = rows[keep], times[keep]
+        if self.detector.min_interval is not None and len(rows):
+            # there are a handful of peaks per tick, not one per sample
+            min_gap = self.detector.min_interval * 1e6
+            keep = np.zeros(len(rows), dtype=bool)
+            for i, (row, t) in enumerate(zip(rows.tolist(), times.tolist())):
+                if t - self._last_step[row] >= min_gap:
+                    keep[i] = True
+                    self._last_step[row] = t
+            rows, times = rows[keep], times[keep]
+        self.steps += np.bincount(rows, minlength=self.n_streams)
+        return rows, times
+
+    """ ================================================================================
+    Pushes one tick of new samples of every stream through the filters
+    :param values: (array-like) new samples, shape (n_streams, n_samples), left-aligned
+    :param lengths: (array-like) number of new samples of each stream (None if all
+                    rows are full); a stream with no new samples has length 0
+    :param times: (array-like) timestamps of the new samples (in microseconds), same
+                  shape as 'values' (None to count in samples since the start)
+    :return: (tuple) stream and timestamp of the new steps as np.ndarrays
+    ================================================================================ """
+    def update(self, values, lengths=None, times=None):
+        values = np.asarray(values, dtype=float).reshape(self.n_streams, -1)
+        n_samples = values.shape[1]
+        if n_samples == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int64)
+        if lengths is None:
+            lengths = np.full(self.n_streams, n_samples, dtype=np.intp)
+        lengths = np.asarray(lengths, dtype=np.intp)
+        if times is None:
+            times = self._count[:, None] + np.arange(n_samples)
+        times = np.asarray(times, dtype=np.int64).reshape(self.n_streams, -1)
+        valid = np.arange(n_samples) < lengths[:, None]
+
+        # running mean of each stream
+        values = np.where(valid, values, 0.0)
+        sums = self._sum[:, None] + np.cumsum(values, axis=-1)
+        counts = self._count[:, None] + np.cumsum(valid, axis=-1)
+        demeaned = values - sums / np.maximum(counts, 1)
+        self._sum = sums[:, -1]
+        self._count = counts[:, -1]
+
+        filtered = self.__cascade(demeaned, lengths)
+
+        # the cascade lags by one sample: output n belongs to the timestamp of sample
+        # n-1, and the very first output of a stream has no sample to go with
+        out_times = np.concatenate((self._pending[:, None], times), axis=1)[:, :n_samples]
+        filtered[~valid] = np.nan
+        filtered[~self._started & (lengths > 0), 0] = np.nan
+        rows = np.flatnonzero(lengths > 0)
+        self._pending[rows] = times[rows, lengths[rows] - 1]
+        self._started |= lengths > 0
+
+        return self.__accept(*self.__find_peaks(filtered, out_times))
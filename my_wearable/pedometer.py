@@ -1,30 +1,62 @@
 # Imports
-import serial
-from time import sleep
-from time import time
-from scipy import signal as sig
+import itertools
+from time import perf_counter
 import numpy as np
-from matplotlib import pyplot as plt
+from my_wearable.buffer import RingBuffer
+from my_wearable.filters import FILTER_BANK
+from my_wearable.lazy import LazyModule
+from my_wearable.metrics import REGISTRY
+from my_wearable.profiling import PROFILER
+from my_wearable.recording import load_recording, save_recording
+from my_wearable.render import render_signal, render_steps
+from my_wearable.resample import Resampler, estimate_rate, processing_rate, step_cutoff
+from my_wearable.steps import StepDetector
+from my_wearable.streaming import StreamingFilter
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+# Numbers the pedometers created without a name, so their metrics stay apart
+_UNNAMED = itertools.count(1)
 
 class Pedometer:
 
     # Attributes of the class Pedometer
     _maxlen = 0
     _file_flag = False
-    __time_buffer = []
-    __data_buffer = []
     __steps = 0
-    __peaks = []
+    __stream = None
 
     """ ================================================================================
     Constructor that sets up the Pedomter class. It will only run once.
     :param max len: (int) max length of the buffer
     :param file_flag: (bool) set whether we will be working with a file or not
+    :param streaming: (bool) count steps as the samples arrive instead of in process()
+    :param detector: (StepDetector) rules deciding which peaks are steps
+    :param name: (str) name of the pedometer in the metrics (e.g. the device), None for
+                 a unique "pedometer-<n>"
+    :param analyzer: (WindowedAnalyzer) count the steps window by window, reusing the
+                     windows that did not change since the last count
     :return: None
     ================================================================================ """
-    def __init__(self, maxlen, file_flag):
+    def __init__(self, maxlen, file_flag, streaming=False, detector=None, name=None, analyzer=None):
         self._maxlen = maxlen       # Set the max length of the buffer
         self._file_flag = file_flag # Set whether we are writing to a file or not
+        self.__detector = detector if detector is not None else StepDetector()
+        self.__analyzer = analyzer
+        if analyzer is not None and detector is not None:
+            analyzer.detector = detector
+        if name is None:
+            name = "pedometer-{}".format(next(_UNNAMED))
+        self.name = name
+        self.__samples = REGISTRY.counter("samples_total", device=name)
+        self.__parse_errors = REGISTRY.counter("parse_errors_total", device=name)
+        self.__step_latency = REGISTRY.histogram("sample_to_step_seconds", device=name)
+        self.__stage_time = {stage: REGISTRY.histogram("filter_stage_seconds", device=name, stage=stage)
+                             for stage in ("resample", "demean", "cascade", "find_peaks", "stream", "windows")}
+        self.__allocate(maxlen)
+        if streaming:
+            self.__stream = StreamingFilter()
         return
 
     """ ================================================================================
@@ -32,70 +64,182 @@ class Pedometer:
     :return: None
     ================================================================================ """
     def reset(self):
-        self.__time_buffer = []
-        self.__data_buffer = []
-        __steps = 0
+        self.__time_buffer.clear()
+        self.__data_buffer.clear()
+        self.__filtered_buffer = None
+        self.__filtered_times = None
+        self.__windowed = False
+        self.__peaks = np.zeros(0, dtype=int)
+        self.__step_indices = np.zeros(0, dtype=int)
+        self.__step_times = np.zeros(0, dtype=np.int64)
+        self.__steps = 0
+        self.__detector.reset()
+        if self.__stream is not None:
+            self.__stream.reset()
         return
 
+    """ ================================================================================
+    Allocates the time and data buffers of this instance. They are circular, so the
+    memory used by a pedometer stays the same no matter how long it runs.
+    :param maxlen: (int) max length of the buffers
+    :return: None
+    ================================================================================ """
+    def __allocate(self, maxlen):
+        self._maxlen = maxlen
+        self.__time_buffer = RingBuffer(maxlen, np.int64)
+        self.__data_buffer = RingBuffer(maxlen, np.float32)
+        self.__filtered_buffer = None
+        self.__filtered_times = None
+        self.__windowed = False     # the filtered signal is in the analyzer's windows
+        self.__peaks = np.zeros(0, dtype=int)
+        self.__step_indices = np.zeros(0, dtype=int)
+        self.__step_times = np.zeros(0, dtype=np.int64)
+        return
+
+    """ ================================================================================
+    Assembles the filtered signal of the last windowed count, which is only done when
+    something reads it (a plot), not on every count
+    :return: None
+    ================================================================================ """
+    def __assemble(self):
+        if self.__windowed:
+            self.__filtered_times, self.__filtered_buffer = self.__analyzer.filtered()
+            self.__windowed = False
+        return
+
+    """ ================================================================================
+    Returns the signal the filters work on: the output of the last filter that ran, or
+    a (zero-copy) view of the data buffer if nothing was filtered yet.
+    :return: (np.ndarray) the current signal
+    ================================================================================ """
+    def __signal(self):
+        self.__assemble()
+        if self.__filtered_buffer is None:
+            return self.__data_buffer.view()
+        return self.__filtered_buffer
+
+    """ ================================================================================
+    Returns the timestamps of the current signal: the resampling grid once the pedometer
+    filters ran, the time buffer otherwise.
+    :return: (np.ndarray) timestamps of the current signal
+    ================================================================================ """
+    def __signal_times(self):
+        self.__assemble()
+        if self.__filtered_times is None:
+            return self.__time_buffer.view()
+        return self.__filtered_times
+
     """ ================================================================================
     Appends new elements to the data and time buffers by parsing 'msg_str' and splitting
-    it, assuming comma separation. It also keeps track of buffer occupancy and notifies
-    the user when the buffers are full.
+    it, assuming comma separation. Once the buffers are full the oldest samples are
+    overwritten.
     :param msg_str: (str) the string containing data that will be appended to the buffer
     :return: None
     ================================================================================ """
     def append(self, msg_str):
 
-        if (len(self.__time_buffer) == self._maxlen or len(self.__data_buffer) == self._maxlen):
-            print("The buffer is full")
-            return
-        
         try:
-            received = msg_str.split(',')
-            self.__time_buffer.append(int(received[0]))
-            self.__data_buffer.append(int(received[1]))
-        except:
-            print("Received invalid data")
-            print(msg_str)
-        
+            with PROFILER.span("pedometer.append", "parse"):
+                received = msg_str.split(',')
+                timestamp = int(received[0])
+                value = int(received[1])
+        except (ValueError, IndexError):
+            self.__parse_errors.inc()
+            return
+
+        self.append_batch([timestamp], [value])
         return
 
+    """ ================================================================================
+    Appends a batch of already parsed samples to the data and time buffers. In streaming
+    mode the batch is also pushed through the filter chain and the steps it completes
+    are counted right away.
+    :param times: (list) timestamps of the new samples
+    :param values: (list) data of the new samples
+    :return: (np.ndarray) timestamps of the steps detected in this batch
+    ================================================================================ """
+    def append_batch(self, times, values):
+
+        self.__time_buffer.extend(times)
+        self.__data_buffer.extend(values)
+        self.__filtered_buffer = None
+        self.__filtered_times = None
+        self.__windowed = False
+        self.__samples.inc(len(times))
+
+        if self.__stream is None:
+            return np.zeros(0, dtype=np.int64)
+
+        start = perf_counter()
+        with PROFILER.span("stream.update", "filter"):
+            peaks, peak_times = self.__stream.update(times, values)
+        with PROFILER.span("steps.accept", "peaks"):
+            step_times = self.__detector.accept(peaks, peak_times)
+        self.__stage_time["stream"].observe(perf_counter() - start)
+        self.__steps += len(step_times)
+        # device time between a step and the sample that revealed it
+        for step_time in step_times:
+            self.__step_latency.observe((times[-1] - step_time) * 1e-6)
+        return step_times
+
+    """ ================================================================================
+    Ends the stream in streaming mode: counts the steps of the samples the streaming
+    filter still holds back (see StreamingFilter.flush). Call it once no sample will
+    follow.
+    :return: (np.ndarray) timestamps of the steps found in them
+    ================================================================================ """
+    def flush(self):
+        if self.__stream is None:
+            return np.zeros(0, dtype=np.int64)
+        with PROFILER.span("stream.update", "filter"):
+            peaks, peak_times = self.__stream.flush()
+        step_times = self.__detector.accept(peaks, peak_times)
+        self.__steps += len(step_times)
+        return step_times
 
     """ ================================================================================
-    Saves the contents of the buffer into the specified file one line at a time.
+    Returns the number of steps counted so far
+    :return: (int) current step count
+    ================================================================================ """
+    def get_steps(self):
+        return self.__steps
+
+
+    """ ================================================================================
+    Estimates the sample rate from the timestamps in the time buffer (in microseconds,
+    as sent by the wearable), using the median interval to ignore BLE jitter.
+    :return: (float) sample rate in Hz, or 0 if there are less than 2 samples
+    ================================================================================ """
+    def sample_rate(self):
+        return estimate_rate(self.__time_buffer.view())
+
+    """ ================================================================================
+    Saves the contents of the buffer into the specified file, one line per sample.
     :param filename: (str) the name of the file that will store the buffer data
     :return: None
     ================================================================================ """
     def save_file(self, filename):
 
-        with open(filename, 'w') as file:
-            for i in range(len(self.__time_buffer)):
-                file.write("{},{}\n".format(self.__time_buffer[i], self.__data_buffer[i]))
+        save_recording(filename, self.__time_buffer.view(), self.__data_buffer.view())
         return
 
 
     """ ================================================================================
-    Loads the contents of the file 'filename' into the time and data buffers
+    Loads the contents of the file 'filename' into the time and data buffers. The file
+    is parsed in bulk and cached in binary next to it, so loading it again only maps
+    the cache (see my_wearable.recording). The cache saves the parsing, not the copy:
+    the buffers own their samples (they are appended to and wrap around), so the
+    columns are copied into them once, straight from the mapped file.
     :param filename: (str) the name (full path) of the file that we read from
+    :param cache: (bool) whether to use the binary cache
     :return: None
     ================================================================================ """
-    def load_file(self, filename):
-        self.__time_buffer = []
-        self.__data_buffer = []
-        count = 0
-
-        with open(filename, 'r') as file:
-            while True:
-                line = file.readline()
-                if not line:
-                    break
-                
-                vals = line.rstrip().split(',')
-                self.__time_buffer.append(int(vals[0]))
-                self.__data_buffer.append(int(vals[1]))
-                count += 1
-                
-        self._maxlen = count
+    def load_file(self, filename, cache=True):
+        recording = load_recording(filename, cache)
+
+        self.__allocate(len(recording))
+        self.__time_buffer.extend(recording[:, 0])
+        self.__data_buffer.extend(recording[:, 1])
         return
 
 
@@ -106,40 +250,36 @@ class Pedometer:
     ================================================================================ """
     def plot(self, filename):
 
-        plt.figure()
-        plt.subplot(111)
-        plt.plot(self.__time_buffer, self.__data_buffer)
-        plt.savefig(filename)
-        #plt.show()
+        render_signal(filename, self.__signal_times(), self.__signal())
         return
 
     """ ================================================================================
-    This function runs the contents of the __data_buffer through a low-pass filter. It
-    first generates filter coefficients and  runs the data through the low-pass filter.
-    Note: In the future, we will only generate the coefficients once and reuse them.
+    This function runs the contents of the __data_buffer through a low-pass filter. The
+    filter coefficients come from the shared filter bank, so they are only generated
+    once.
     :param cutoff: (int) the cutoff frequency of the filter
     :return: None
     ================================================================================ """
     def __lowpass_filter(self, cutoff): # __ makes this a private method
 
-        b,a = sig.butter(3, cutoff, btype='low', analog=False, output='ba', fs=None)
-        filtered_data = sig.lfilter(b, a, self.__data_buffer)
-        self.__data_buffer = filtered_data
+        sos = FILTER_BANK.lowpass(3, cutoff)
+        filtered_data = sig.sosfilt(sos, self.__signal())
+        self.__filtered_buffer = filtered_data
         return
 
 
     """ ================================================================================
-    This function runs the contents of the __data_buffer through a high-pass filter. It
-    first generates filter coefficients and runs the data through the high-pass filter.
-    Note: In the future, we will only generate the coefficients once and reuse them.
+    This function runs the contents of the __data_buffer through a high-pass filter. The
+    filter coefficients come from the shared filter bank, so they are only generated
+    once.
     :param cutoff: (int) the cutoff frequency of the filter
     :return: None
     ================================================================================ """
     def __highpass_filter(self, cutoff): # __ makes this a private method
         
-        b,a = sig.butter(3, cutoff, btype='high', analog=False, output='ba', fs=None)
-        filtered_data = sig.lfilter(b, a, self.__data_buffer)
-        self.__data_buffer = filtered_data
+        sos = FILTER_BANK.highpass(3, cutoff)
+        filtered_data = sig.sosfilt(sos, self.__signal())
+        self.__filtered_buffer = filtered_data
         return
 
 
@@ -150,40 +290,57 @@ class Pedometer:
     ================================================================================ """
     def __smoothing_filter(self, N):
         
-        boxcar = sig.boxcar(N+1)  / (N+1)
-        filtered_data = sig.lfilter(boxcar, 1, self.__data_buffer)
-        self.__data_buffer = filtered_data
+        boxcar = FILTER_BANK.boxcar(N)
+        filtered_data = sig.lfilter(boxcar, 1, self.__signal())
+        self.__filtered_buffer = filtered_data
         return
 
 
     """ ================================================================================
-    Runs the contents of the __data_buffer through a de-meaning filter.
+    Runs the contents of the __data_buffer through a de-meaning filter. Each sample has
+    the running mean of the samples up to it removed, which is what the streaming mode
+    can do online, so both modes see exactly the same signal.
     :param: None
     :return: None
     ================================================================================ """
     def __demean_filter(self):
-        # Compute the mean using a sliding window
-        filtered = sig.detrend(self.__data_buffer)
-        self.__data_buffer = filtered
+        data = np.asarray(self.__signal(), dtype=float)
+        filtered = data - np.cumsum(data) / np.arange(1, len(data) + 1)
+        self.__filtered_buffer = filtered
         return
     
 
     """ ================================================================================
-    Run raw data through multiple filters
+    Run raw data through multiple filters. The samples are first put on a uniform grid
+    at a rate picked from the measured sample rate (fast streams are decimated, slow
+    ones interpolated, see my_wearable.resample). After de-meaning, the smoothing filter
+    (0.1s window), the gradient and the low-pass filter (5Hz cutoff) run as a single
+    cascade designed for that rate, in one pass over the data.
     :param None:
-    :return: None:
+    :return: (int) the rate the filters ran at, in Hz
     ================================================================================ """
     def __filter_pedometer(self):
 
-        self.__demean_filter()
-        # run the smoothing_filter with a window of 5
-        self.__smoothing_filter(4)
-        # Take the gradient of the data using np.gradient
-        self.__data_buffer = np.gradient(self.__data_buffer)
-        # 4. Use a lowpass fiter with a cutoff frequency of around 5Hz
-        cutoff = 5 / (0.5 * 50)
-        self.__lowpass_filter(cutoff)
-        return
+        start = perf_counter()
+        with PROFILER.span("resample", "filter"):
+            fs = self.sample_rate()
+            rate, factor = processing_rate(fs)
+            self.__filtered_times, self.__filtered_buffer = Resampler(rate, factor, fs=fs).update(
+                self.__time_buffer.view(), self.__data_buffer.view())
+        resampled = perf_counter()
+        with PROFILER.span("demean", "filter"):
+            self.__demean_filter()
+        demeaned = perf_counter()
+        with PROFILER.span("cascade", "filter"):
+            sos = FILTER_BANK.pedometer(rate, cutoff=step_cutoff(fs))
+            filtered = sig.sosfilt(sos, self.__signal())
+            # the cascade lags by one sample; repeat the last value to keep the length
+            # (a plateau at the end is never a peak)
+            self.__filtered_buffer = np.append(filtered[1:], filtered[-1:])
+        self.__stage_time["resample"].observe(resampled - start)
+        self.__stage_time["demean"].observe(demeaned - resampled)
+        self.__stage_time["cascade"].observe(perf_counter() - demeaned)
+        return rate
         
     """ ================================================================================
     Mark all peaks in filtered data - indicating the indices of steps
@@ -192,52 +349,85 @@ class Pedometer:
     ================================================================================ """
     def __find_peaks(self):
 
-        self.__peaks = [None] * 500
         self.__filter_pedometer()
-        self.__peaks = sig.find_peaks(self.__data_buffer)[0]
+        with PROFILER.span("find_peaks", "peaks"):
+            self.__peaks = sig.find_peaks(self.__signal())[0]
         return
 
     """ ================================================================================
-    Saves the contents of the buffer into the file line by line
-    :param filename: (str) the name of the file that will store the buffer data
-    :return: None
+    Counts the steps in the filtered data. The step detector checks the amplitude,
+    prominence, cadence and width of every peak in one vectorized pass.
+    :return: (tuple) indices (in the resampled signal) and timestamps of the steps
     ================================================================================ """
     def __count_steps(self):
-        
-        self.__find_peaks()
-        upper_bound = 4000
-        lower_bound = -200
-        
-        inds = []
-        for peak in self.__peaks:
-          if peak < upper_bound and peak > lower_bound:
-              self.__steps += 1
-              inds.append(peak)
-        
-        # Plot the data with peaks marked
-        plt.subplot(111)
-        plt.title("Peaks")
-        for x in inds:
-            plt.plot(self.__time_buffer[x], self.__data_buffer[x], 'rs')
-            print(self.__data_buffer[x])
-        plt.show()
 
-        return
+        if self.__analyzer is not None:
+            return self.__count_steps_windowed()
+        rate = self.__filter_pedometer()
+        times = self.__signal_times()
+        filtered = self.__signal()
+        start = perf_counter()
+        with PROFILER.span("find_peaks", "peaks"):
+            inds, step_times = self.__detector.detect(filtered, times, rate)
+        self.__stage_time["find_peaks"].observe(perf_counter() - start)
+        self.__step_indices = inds
+        self.__step_times = step_times
+        self.__steps = len(inds)
+        return inds, step_times
+
+    """ ================================================================================
+    Counts the steps with the windowed analyzer. Only the windows after the last count
+    are filtered again, and the filtered signal is assembled only if it is read.
+    :return: (tuple) indices (in the resampled signal) and timestamps of the steps
+    ================================================================================ """
+    def __count_steps_windowed(self):
+
+        start = perf_counter()
+        with PROFILER.span("windows", "filter"):
+            step_times = self.__analyzer.analyze(self.__time_buffer.view(), self.__data_buffer.view())
+            inds = self.__analyzer.indices(step_times)
+        self.__stage_time["windows"].observe(perf_counter() - start)
+        self.__filtered_times = self.__filtered_buffer = None
+        self.__windowed = True
+        self.__step_indices = inds
+        self.__step_times = step_times
+        self.__steps = len(inds)
+        return inds, step_times
+
+    """ ================================================================================
+    Counts the steps of the samples currently in the buffers, e.g. for a dashboard
+    refreshing a live pedometer (with an analyzer, only the new samples cost anything)
+    :return: (int) the step count
+    ================================================================================ """
+    def count_steps(self):
+        self.__count_steps()
+        return self.__steps
+
+    """ ================================================================================
+    Returns the timestamps of the steps found by the last call to process()
+    :return: (np.ndarray) timestamps of the steps
+    ================================================================================ """
+    def get_step_times(self):
+        return self.__step_times
     
     """ ================================================================================
     The main process block of the pedometer. When completed, this will run through the
     filtering operations and heuristic methods to compute and return the step count.
     For now, we will use it as our "playground" to filter and visualize the data.
-    :param None:
+    :param file: (str) the recording to process
+    :param show: (bool) whether to print the results
+    :param plot_file: (str) image file to plot the filtered data with the steps marked
     :return: Current step count
     ================================================================================ """
-    def process(self):
+    def process(self, file="objective1/walking_50hz.txt", show=True, plot_file=None):
         
-        file = "objective1/walking_50hz.txt"
         #       OBJECTIVE 4
         self.load_file(file)
-        self.__count_steps()
-        print(self.__steps)
+        inds, step_times = self.__count_steps()
+        if plot_file is not None:
+            render_steps(plot_file, self.__signal_times(), self.__signal(), inds)
+        if show:
+            print(self.__steps)
         return self.__steps
         
         
@@ -304,7 +494,7 @@ class Pedometer:
         # plot data
         plt.subplot(212)
         plt.title("Filtered")
-        plt.plot(self.__time_buffer, self.__data_buffer)
+        plt.plot(self.__time_buffer.view(), self.__signal())
         plt.savefig("Images/peak_detection.png")
         plt.show()
         
@@ -0,0 +1,309 @@
+# Imports
+import json
+import os
+import threading
+import tracemalloc
+from collections import deque
+from time import perf_counter_ns
+
+# Spans kept in memory; the oldest ones are dropped beyond (about 100 MB)
+MAX_SPANS = 1000000
+# One span in this many, per stage, also measures the memory it allocates
+MALLOC_EVERY = 100
+# Stack frames stored per traced allocation (1 keeps the tracing cheap)
+MALLOC_FRAMES = 1
+# Rows of the hot spot summary
+TOP = 15
+
+class _Span:
+
+    # One is created per span while the profiler is enabled
+    __slots__ = ("_profiler", "_name", "_category", "_malloc", "_start", "_memory")
+
+    """ ================================================================================
+    Constructor of the timer of one run of a stage, used as a context manager
+    :param profiler: (Profiler) profiler the span is recorded in
+    :param name: (str) name of the stage
+    :param category: (str) category of the stage (io, parse, filter, ...)
+    :param malloc: (bool) also measure the memory allocated during the span
+    :return: None
+    ================================================================================ """
+    def __init__(self, profiler, name, category, malloc):
+        self._profiler = profiler
+        self._name = name
+        self._category = category
+        self._malloc = malloc
+        return
+
+    def __enter__(self):
+        # tracing is set up first so that it is not timed
+        self._memory = self._profiler._start_malloc() if self._malloc else None
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        allocated = self._profiler._stop_malloc() - self._memory if self._malloc else None
+        self._profiler._record(self._name, self._category, self._start, end, allocated)
+        return False
+
+
+class _NullSpan:
+
+    # Span handed out while the profiler is disabled: it does nothing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+
+    """ ================================================================================
+    Constructor of a profiler of the pipeline stages. The stages are wrapped in
+    PROFILER.span(name, category) blocks (serial reads, frame decoding, resampling,
+    filtering, peak finding, storage...); while the profiler is disabled a span is a
+    shared no-op, so the wrapping costs a method call. Enabled, every span records its
+    start and duration with perf_counter_ns(), and one span in 'malloc_every' per stage
+    the memory allocated meanwhile (tracemalloc). Tracing every allocation slows the
+    whole process down about threefold, so tracemalloc only runs while a sampled span
+    is open, unless it was started beforehand (e.g. PYTHONTRACEMALLOC=1). The spans
+    give a Chrome trace timeline (chrome://tracing, Perfetto) and a summary of the hot
+    spots.
+    :return: None
+    ================================================================================ """
+    def __init__(self):
+        self.enabled = False
+        self._malloc_every = 0
+        self._malloc_spans = 0              # sampled spans open, tracemalloc runs while > 0
+        self._lock = threading.Lock()
+        self.clear()
+        return
+
+    """ ================================================================================
+    Forgets the spans recorded so far
+    :param max_spans: (int) spans kept in memory, the oldest are dropped beyond
+    :return: None
+    ================================================================================ """
+    def clear(self, max_spans=MAX_SPANS):
+        with self._lock:
+            self._spans = deque(maxlen=max_spans)
+            self._calls = {}            # spans started per stage, for the malloc sampling
+            self._threads = {}          # thread ident -> name
+            self._origin = perf_counter_ns()
+            self._snapshot = None
+            self.dropped = 0
+        return
+
+    """ ================================================================================
+    Starts recording spans (the ones recorded before are kept, see clear())
+    :param malloc_every: (int) measure the allocations of one span in this many per
+                         stage (0 to not trace the allocations at all)
+    :return: None
+    ================================================================================ """
+    def enable(self, malloc_every=MALLOC_EVERY):
+        self._malloc_every = malloc_every
+        self.enabled = True
+        return
+
+    """ ================================================================================
+    Stops recording spans. If tracemalloc was started outside of the profiler, the
+    allocations still held by the program are snapshotted for the summary.
+    :return: None
+    ================================================================================ """
+    def disable(self):
+        self.enabled = False
+        with self._lock:
+            if tracemalloc.is_tracing() and self._malloc_spans == 0:
+                self._snapshot = tracemalloc.take_snapshot()
+        return
+
+    """ ================================================================================
+    Timer of one run of a stage
+    :param name: (str) name of the stage
+    :param category: (str) category of the stage
+    :return: context manager timing the block it wraps
+    ================================================================================ """
+    def span(self, name, category="pipeline"):
+        if not self.enabled:
+            return NULL_SPAN
+        # the count is not locked: a race only shifts which span is sampled
+        calls = self._calls.get(name, 0)
+        self._calls[name] = calls + 1
+        malloc = self._malloc_every > 0 and calls % self._malloc_every == 0
+        return _Span(self, name, category, malloc)
+
+    """ ================================================================================
+    Opens the allocation tracing of a sampled span: tracemalloc is started by the first
+    one open (if it is not running already) and stopped by the last one closed
+    :return: (int) memory traced so far, in bytes
+    ================================================================================ """
+    def _start_malloc(self):
+        with self._lock:
+            if self._malloc_spans == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(MALLOC_FRAMES)
+                self._malloc_spans = 1
+            elif self._malloc_spans > 0:
+                self._malloc_spans += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    """ ================================================================================
+    Closes the allocation tracing of a sampled span
+    :return: (int) memory traced so far, in bytes
+    ================================================================================ """
+    def _stop_malloc(self):
+        with self._lock:
+            memory = tracemalloc.get_traced_memory()[0]
+            if self._malloc_spans > 0:
+                self._malloc_spans -= 1
+                if self._malloc_spans == 0:
+                    tracemalloc.stop()
+            return memory
+
+    """ ================================================================================
+    Stores a finished span
+    :param name: (str) name of the stage
+    :param category: (str) category of the stage
+    :param start: (int) perf_counter_ns() at the start
+    :param end: (int) perf_counter_ns() at the end
+    :param allocated: (int) bytes allocated during the span (None if not measured)
+    :return: None
+    ================================================================================ """
+    def _record(self, name, category, start, end, allocated):
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+            if len(self._spans) == self._spans.maxlen:
+                self.dropped += 1
+            self._spans.append((name, category, thread.ident, start, end, allocated))
+        return
+
+    """ ================================================================================
+    Spans recorded so far
+    :return: (list) (name, category, thread, start ns, end ns, allocated bytes) tuples
+    ================================================================================ """
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    """ ================================================================================
+    Timeline of the spans in the Chrome trace event format: one complete ("X") event
+    per span, times in microseconds from clear(), one row per thread
+    :return: (dict) the trace, ready for json.dump
+    ================================================================================ """
+    def trace(self):
+        spans = self.spans()
+        with self._lock:
+            names = dict(self._threads)
+        pid = os.getpid()
+        threads = {ident: number for number, ident in enumerate(names)}
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": threads[ident], "args": {"name": name}}
+                  for ident, name in names.items()]
+        for name, category, ident, start, end, allocated in spans:
+            event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": threads[ident],
+                     "ts": (start - self._origin) / 1e3, "dur": (end - start) / 1e3}
+            if allocated is not None:
+                event["args"] = {"allocated_bytes": allocated}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"dropped_spans": self.dropped, "malloc_every": self._malloc_every}}
+
+    """ ================================================================================
+    Writes the Chrome trace of the spans
+    :param filename: (str) JSON file to write
+    :return: None
+    ================================================================================ """
+    def write_trace(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.trace(), file)
+        return
+
+    """ ================================================================================
+    Time spent in each stage, without the stages nested in it (the self time), found
+    per thread by walking the spans in start order with a stack of the open ones
+    :param spans: (list) output of spans()
+    :return: (list) self time of each span in ns, in the order of 'spans'
+    ================================================================================ """
+    @staticmethod
+    def __self_times(spans):
+        self_times = [end - start for _, _, _, start, end, _ in spans]
+        order = sorted(range(len(spans)), key=lambda i: (spans[i][2], spans[i][3], -spans[i][4]))
+        stack = []
+        for i in order:
+            ident, start, end = spans[i][2], spans[i][3], spans[i][4]
+            while stack and (spans[stack[-1]][2] != ident or spans[stack[-1]][4] <= start):
+                stack.pop()
+            if stack:
+                self_times[stack[-1]] -= end - start
+            stack.append(i)
+        return self_times
+
+    """ ================================================================================
+    Summary of the hot spots: the stages sorted by self time, with their number of
+    calls, total and self time, mean and max duration and mean sampled allocation,
+    and the source lines holding the most memory when the profiler was disabled (if
+    tracemalloc was started beforehand)
+    :param top: (int) rows of each table
+    :return: (dict) the stages and allocations tables
+    ================================================================================ """
+    def summary(self, top=TOP):
+        spans = self.spans()
+        self_times = self.__self_times(spans)
+        stages = {}
+        for (name, category, _, start, end, allocated), self_time in zip(spans, self_times):
+            row = stages.setdefault(name, {"stage": name, "category": category, "calls": 0, "total_ms": 0.0,
+                                           "self_ms": 0.0, "max_us": 0.0, "sampled": 0, "allocated": 0})
+            row["calls"] += 1
+            row["total_ms"] += (end - start) / 1e6
+            row["self_ms"] += self_time / 1e6
+            row["max_us"] = max(row["max_us"], (end - start) / 1e3)
+            if allocated is not None:
+                row["sampled"] += 1
+                row["allocated"] += allocated
+        profiled = sum(row["self_ms"] for row in stages.values())
+        for row in stages.values():
+            row["mean_us"] = row["total_ms"] * 1e3 / row["calls"]
+            row["self_percent"] = 100.0 * row["self_ms"] / profiled if profiled > 0 else 0.0
+            row["mean_allocated_kb"] = row.pop("allocated") / row.pop("sampled") / 1024 if row["sampled"] else None
+        rows = sorted(stages.values(), key=lambda row: row["self_ms"], reverse=True)[:top]
+
+        allocations = []
+        if self._snapshot is not None:
+            for statistic in self._snapshot.statistics("lineno")[:top]:
+                frame = statistic.traceback[0]
+                allocations.append({"line": "{}:{}".format(frame.filename, frame.lineno),
+                                    "kb": statistic.size / 1024, "blocks": statistic.count})
+        return {"spans": len(spans), "dropped_spans": self.dropped, "profiled_ms": profiled,
+                "stages": rows, "allocations": allocations}
+
+
+""" ================================================================================
+Formats a summary of the profiler as text tables
+:param summary: (dict) output of Profiler.summary()
+:return: (str) the tables
+================================================================================ """
+def format_summary(summary):
+    lines = ["{} spans ({} dropped), {:.1f} ms profiled".format(summary["spans"], summary["dropped_spans"],
+                                                                summary["profiled_ms"]),
+             "{:24s} {:8s} {:>8s} {:>10s} {:>10s} {:>6s} {:>10s} {:>10s} {:>10s}".format(
+                 "stage", "category", "calls", "total ms", "self ms", "self%", "mean us", "max us", "alloc kB")]
+    for row in summary["stages"]:
+        allocated = "" if row["mean_allocated_kb"] is None else "{:.1f}".format(row["mean_allocated_kb"])
+        lines.append("{:24s} {:8s} {:8d} {:10.1f} {:10.1f} {:6.1f} {:10.1f} {:10.1f} {:>10s}".format(
+            row["stage"][:24], row["category"][:8], row["calls"], row["total_ms"], row["self_ms"],
+            row["self_percent"], row["mean_us"], row["max_us"], allocated))
+    if summary["allocations"]:
+        lines.append("{:60s} {:>10s} {:>8s}".format("largest allocations held", "kB", "blocks"))
+        for row in summary["allocations"]:
+            lines.append("{:60s} {:10.1f} {:8d}".format(row["line"][-60:], row["kb"], row["blocks"]))
+    return "\n".join(lines)
+
+
+# Profiler of the whole process, disabled until enable() is called
+PROFILER = Profiler()
@@ -0,0 +1,63 @@
+# Imports
+import os
+import numpy as np
+
+# Extension of the binary cache written next to each text recording
+CACHE_SUFFIX = ".npy"
+
+""" ================================================================================
+Path of the binary cache of a text recording
+:param filename: (str) path of the text recording
+:return: (str) path of its cache
+================================================================================ """
+def cache_path(filename):
+    return filename + CACHE_SUFFIX
+
+
+""" ================================================================================
+Loads a "timestamp,value" recording as an (n, 2) int64 array. The text is parsed in
+bulk by np.loadtxt and the result is written to a binary cache next to the file; as
+long as the cache is newer than the text, later loads memory-map the cache instead
+of parsing anything. The map is read-only and holds the file open: a caller keeping
+the samples copies them (a copy from the map skips the intermediate array np.load
+would read the whole file into).
+:param filename: (str) path of the text recording
+:param cache: (bool) whether to use (and write) the binary cache
+:return: (np.ndarray) the recording, column 0 holds the timestamps, column 1 the data
+================================================================================ """
+def load_recording(filename, cache=True):
+    cached = cache_path(filename)
+    if cache and os.path.exists(cached) and \
+            os.stat(cached).st_mtime_ns >= os.stat(filename).st_mtime_ns:
+        return np.load(cached, mmap_mode='r')
+
+    recording = np.loadtxt(filename, delimiter=',', dtype=np.int64, ndmin=2).reshape(-1, 2)
+
+    if cache:
+        # write to a temporary file first so a reader never sees a partial cache
+        temporary = cached + ".tmp"
+        try:
+            with open(temporary, 'wb') as file:
+                np.save(file, recording)
+            os.replace(temporary, cached)
+        except OSError:
+            pass    # read-only location, just skip the cache
+    return recording
+
+
+""" ================================================================================
+Saves the timestamps and values as a "timestamp,value" text recording in one call,
+and removes the stale binary cache of a previous recording with the same name
+:param filename: (str) path of the text recording
+:param times: (np.ndarray) timestamps
+:param values: (np.ndarray) data
+:return: None
+================================================================================ """
+def save_recording(filename, times, values):
+    recording = np.column_stack((np.asarray(times, dtype=np.int64),
+                                 np.asarray(values).astype(np.int64)))
+    np.savetxt(filename, recording, fmt='%d', delimiter=',')
+
+    if os.path.exists(cache_path(filename)):
+        os.remove(cache_path(filename))
+    return
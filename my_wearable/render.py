@@ -0,0 +1,99 @@
+# Imports
+import os
+import numpy as np
+
+# matplotlib is only imported by the functions below, the first time something is
+# rendered. They draw on an Agg canvas (no display needed) and never touch pyplot, so
+# rendering does not depend on a GUI backend or on pyplot's global state.
+
+""" ================================================================================
+Creates a new figure on an Agg canvas
+:param title: (str) title of the figure
+:return: (tuple) the figure and its axes
+================================================================================ """
+def _figure(title=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    if title is not None:
+        axes.set_title(title)
+    return figure, axes
+
+
+""" ================================================================================
+Plots a signal against its timestamps and saves the figure
+:param filename: (str) the image file to write
+:param times: (np.ndarray) timestamps
+:param data: (np.ndarray) signal
+:param title: (str) title of the figure
+:return: None
+================================================================================ """
+def render_signal(filename, times, data, title=None):
+    figure, axes = _figure(title)
+    axes.plot(times, data)
+    figure.savefig(filename)
+    return
+
+
+""" ================================================================================
+Plots a signal with its steps marked and saves the figure. All the steps are drawn
+by a single call.
+:param filename: (str) the image file to write
+:param times: (np.ndarray) timestamps
+:param data: (np.ndarray) signal
+:param step_indices: (np.ndarray) indices of the steps in 'data'
+:param title: (str) title of the figure
+:return: None
+================================================================================ """
+def render_steps(filename, times, data, step_indices, title="Peaks"):
+    times = np.asarray(times)
+    data = np.asarray(data)
+    figure, axes = _figure(title)
+    axes.plot(times, data)
+    axes.plot(times[step_indices], data[step_indices], 'rs', linestyle='none')
+    figure.savefig(filename)
+    return
+
+
+""" ================================================================================
+Plots a recording with the given steps marked and saves the figure. It only needs the
+file name and the step timestamps, so it is cheap to send to another process.
+:param filename: (str) the image file to write
+:param recording: (str) path of the recording
+:param step_times: (np.ndarray) timestamps of the steps
+:return: None
+================================================================================ """
+def render_recording(filename, recording, step_times):
+    from my_wearable.recording import load_recording
+
+    data = load_recording(recording)
+    indices = np.searchsorted(data[:, 0], step_times)
+    render_steps(filename, data[:, 0], data[:, 1], indices, title=os.path.basename(recording))
+    return
+
+
+""" ================================================================================
+Worker entry point of render_many()
+:param job: (tuple) arguments of render_recording()
+:return: (str) the image file written
+================================================================================ """
+def _render_job(job):
+    render_recording(*job)
+    return job[0]
+
+
+""" ================================================================================
+Renders many recordings across a pool of worker processes
+:param jobs: (list) (image file, recording, step timestamps) tuples
+:param workers: (int) number of worker processes (1 renders in this process)
+:return: (list) the image files written
+================================================================================ """
+def render_many(jobs, workers=None):
+    if workers == 1 or len(jobs) <= 1:
+        return [_render_job(job) for job in jobs]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_job, jobs))
@@ -0,0 +1,174 @@
+# Imports
+import numpy as np
+from my_wearable.filters import FILTER_BANK
+from my_wearable.lazy import LazyModule
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+# Range of rates the pedometer filters run at. Slower streams are interpolated up to
+# MIN_RATE so that the smoothing window and the 5Hz low-pass still fit, faster ones are
+# decimated down to MAX_RATE before any other filter runs.
+MIN_RATE = 20
+MAX_RATE = 50
+# Cutoff of the step low-pass filter in Hz
+STEP_CUTOFF = 5.0
+# Longest gap interpolated across by the Resampler, in sample intervals of the stream
+MAX_GAP_INTERVALS = 10
+
+""" ================================================================================
+Estimates the sample rate of a stream from its timestamps (in microseconds, as sent by
+the wearable), using the median interval to ignore BLE jitter.
+:param times: (np.ndarray) timestamps
+:param max_intervals: (int) only look at about this many evenly spread intervals, to
+                      keep the cost constant on long streams (None for all of them)
+:return: (float) sample rate in Hz, or 0 if there are less than 2 samples
+================================================================================ """
+def estimate_rate(times, max_intervals=None):
+    if len(times) < 2:
+        return 0.0
+    stride = 1 if max_intervals is None else max(1, (len(times) - 1) // max_intervals)
+    interval = float(np.median(times[1::stride] - times[:-1:stride]))
+    return 1e6 / interval if interval > 0 else 0.0
+
+
+""" ================================================================================
+Picks the rate the filters run at for a stream sampled at 'fs'. The rate is rounded to
+a whole number of Hz so that a handful of filter designs cover every stream, and
+streams faster than MAX_RATE are decimated by an integer factor.
+:param fs: (float) sample rate of the stream in Hz
+:return: (tuple) processing rate in Hz and decimation factor
+================================================================================ """
+def processing_rate(fs):
+    if fs <= 0:
+        return MAX_RATE, 1
+    factor = max(1, int(round(fs / MAX_RATE)))
+    rate = int(round(fs / factor))
+    return int(np.clip(rate, MIN_RATE, MAX_RATE)), factor
+
+
+""" ================================================================================
+Cutoff of the step low-pass filter for a stream sampled at 'fs'. Steps are found
+below 5Hz, but a slow stream holds nothing above its own Nyquist frequency: the cutoff
+is lowered under it so that the interpolation corners are not taken for steps.
+:param fs: (float) sample rate of the stream in Hz
+:return: (float) cutoff in Hz
+================================================================================ """
+def step_cutoff(fs):
+    return min(STEP_CUTOFF, max(0.01, round(0.4 * fs, 2)))
+
+
+class Resampler:
+
+    """ ================================================================================
+    Constructor of a resampler putting an irregular stream onto a uniform time grid. The
+    samples are linearly interpolated onto a grid at 'rate' * 'factor' Hz; when
+    'factor' > 1 the grid is then low-passed by an FIR and only one point in 'factor'
+    is kept (the polyphase decimation of sig.resample_poly, made causal so that it can
+    run one chunk at a time). The batch and streaming pedometers run the same code.
+    Timestamps that go backwards or jump ahead by more than 'max_gap' (a lost link, a
+    corrupted frame) start a new grid instead of being interpolated across. By default
+    'max_gap' is MAX_GAP_INTERVALS sample intervals of the stream, so that it fits a
+    0.1Hz stream as well as a 100Hz one. A sample repeating the timestamp of the one
+    before it is dropped.
+    :param rate: (int) rate of the output grid in Hz
+    :param factor: (int) decimation factor
+    :param max_gap: (float) longest gap in seconds interpolated across (None to derive
+                    it from 'fs')
+    :param fs: (float) sample rate of the stream in Hz (None to estimate it from the
+               first samples)
+    :return: None
+    ================================================================================ """
+    def __init__(self, rate, factor=1, max_gap=None, fs=None):
+        self.rate = rate
+        self.factor = factor
+        self._step = 1e6 / (rate * factor)
+        if max_gap is None and fs:
+            max_gap = MAX_GAP_INTERVALS / fs
+        self._max_gap = None if max_gap is None else max_gap * 1e6
+        self._taps = FILTER_BANK.decimator(factor) if factor > 1 else None
+        # the FIR delays the signal by half its length, the output times account for it
+        self._delay = 0 if self._taps is None else (len(self._taps) - 1) / 2 * self._step
+        self.reset()
+        return
+
+    """ ================================================================================
+    Forgets the stream seen so far
+    :return: None
+    ================================================================================ """
+    def reset(self):
+        self._start = None          # time of the first grid point
+        self._index = 0             # index of the next grid point
+        self._last_time = None      # last input sample, the next chunk starts from it
+        self._last_value = None
+        self._zi = None if self._taps is None else np.zeros(len(self._taps) - 1)
+        return
+
+    """ ================================================================================
+    Resamples a chunk of samples. Grid points are produced up to the last sample of the
+    chunk; the ones after it come with the next chunk.
+    :param times: (array-like) timestamps of the new samples (in microseconds)
+    :param values: (array-like) values of the new samples
+    :return: (tuple) timestamps (int64) and values of the new grid points
+    ================================================================================ """
+    def update(self, times, values):
+        times = np.asarray(times, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        if self._last_time is not None:
+            times = np.concatenate(([self._last_time], times))
+            values = np.concatenate(([self._last_value], values))
+        # a repeated timestamp adds nothing to interpolate: the first sample is kept
+        repeated = np.flatnonzero(np.diff(times) == 0) + 1
+        if len(repeated):
+            times = np.delete(times, repeated)
+            values = np.delete(values, repeated)
+        if len(times) <= (self._last_time is not None):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # a new grid starts at every discontinuity
+        gaps = np.diff(times)
+        if self._max_gap is None and np.any(gaps > 0):
+            self._max_gap = MAX_GAP_INTERVALS * float(np.median(gaps[gaps > 0]))
+        breaks = gaps < 0
+        if self._max_gap is not None:
+            breaks |= gaps > self._max_gap
+        breaks = np.flatnonzero(breaks) + 1
+        if self._start is None:
+            breaks = np.concatenate(([0], breaks))
+        if len(breaks) == 0:
+            return self.__segment(times, values)
+
+        out_times, out_values = [], []
+        bounds = np.concatenate(([0], breaks, [len(times)]))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if lo in breaks:
+                self._start = float(times[lo])
+                self._index = 0
+            if hi > lo:
+                segment = self.__segment(times[lo:hi], values[lo:hi])
+                out_times.append(segment[0])
+                out_values.append(segment[1])
+        return np.concatenate(out_times), np.concatenate(out_values)
+
+    """ ================================================================================
+    Resamples a run of samples without discontinuities onto the current grid
+    :param times: (np.ndarray) timestamps, starting at or after the grid start
+    :param values: (np.ndarray) values
+    :return: (tuple) timestamps (int64) and values of the new grid points
+    ================================================================================ """
+    def __segment(self, times, values):
+        self._last_time = times[-1]
+        self._last_value = values[-1]
+
+        # grid points are computed from their index, so rounding never accumulates
+        end = int(np.floor((times[-1] - self._start) / self._step)) + 1
+        grid = self._start + np.arange(self._index, max(end, self._index)) * self._step
+        resampled = np.interp(grid, times, values)
+
+        if self._taps is not None:
+            resampled, self._zi = sig.lfilter(self._taps, 1.0, resampled, zi=self._zi)
+            keep = (-self._index) % self.factor
+            grid = grid[keep::self.factor] - self._delay
+            resampled = resampled[keep::self.factor]
+        self._index = max(end, self._index)
+        return np.round(grid).astype(np.int64), resampled
@@ -0,0 +1,414 @@
+# Imports
+import argparse
+import json
+import threading
+from collections import OrderedDict
+from time import monotonic
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from my_wearable.store import SessionStore
+
+# Width of the named step buckets, in microseconds
+BUCKETS = {"minute": 60 * 10**6, "hour": 3600 * 10**6}
+# Most buckets a single query may return
+MAX_BUCKETS = 100000
+# Buckets returned when a query gives no range (the last hour, by the minute)
+DEFAULT_BUCKETS = 60
+# Seconds of steps the cadence is computed over
+CADENCE_WINDOW = 60.0
+# Seconds a query result is served from the cache, and max number of cached results
+CACHE_TTL = 1.0
+CACHE_SIZE = 1024
+
+class StepIndex:
+
+    """ ================================================================================
+    Constructor of the step history of one device: the timestamps of its steps in one
+    sorted, growable array. The number of steps before any time is its searchsorted
+    position, so the array is also the prefix sum of the step counts: the steps in a
+    range, or in every bucket of a range, take two (or one per bucket edge) binary
+    searches, however long the history is. New steps are appended in place, the
+    capacity doubling when it runs out.
+    :param capacity: (int) steps allocated up front
+    :return: None
+    ================================================================================ """
+    def __init__(self, capacity=1024):
+        self._times = np.zeros(max(1, capacity), dtype=np.int64)
+        self._size = 0
+        self.until = None       # time of the last sample seen, steps or not
+        self._lock = threading.Lock()
+        return
+
+    """ ================================================================================
+    Number of steps in the index
+    :return: (int) the number of steps
+    ================================================================================ """
+    def __len__(self):
+        return self._size
+
+    """ ================================================================================
+    Appends new steps. Steps in time order after the last one (the usual case) are
+    written in place; steps out of order (a device whose time base was reset) are
+    merged into a new sorted array, so the index stays sorted and the views already
+    returned by times() stay valid.
+    :param times: (array-like) timestamps of the new steps (in microseconds)
+    :param until: (int) time of the last sample the steps were found in (None for the
+                  last step)
+    :return: None
+    ================================================================================ """
+    def append(self, times, until=None):
+        times = np.asarray(times, dtype=np.int64)
+        with self._lock:
+            if len(times) and np.any(times[1:] < times[:-1]):
+                times = np.sort(times)
+            if len(times) and self._size and times[0] < self._times[self._size - 1]:
+                merged = np.zeros(max(len(self._times), self._size + len(times)), dtype=np.int64)
+                merged[:self._size + len(times)] = np.sort(np.concatenate((self._times[:self._size], times)))
+                self._times = merged
+                self._size += len(times)
+            elif len(times):
+                if self._size + len(times) > len(self._times):
+                    grown = np.zeros(max(2 * len(self._times), self._size + len(times)), dtype=np.int64)
+                    grown[:self._size] = self._times[:self._size]
+                    self._times = grown
+                self._times[self._size:self._size + len(times)] = times
+                self._size += len(times)
+            last = self._times[self._size - 1] if self._size else None
+            candidates = [t for t in (self.until, until, last) if t is not None]
+            self.until = int(max(candidates)) if candidates else None
+        return
+
+    """ ================================================================================
+    Timestamps of the steps. The view is a snapshot: appends only write after its end
+    or into a new array.
+    :return: (np.ndarray) the timestamps
+    ================================================================================ """
+    def times(self):
+        with self._lock:
+            return self._times[:self._size]
+
+    """ ================================================================================
+    Number of steps with a time in [start, end)
+    :param start: (int) first timestamp
+    :param end: (int) timestamp after the last one
+    :return: (int) number of steps
+    ================================================================================ """
+    def count(self, start, end):
+        times = self.times()
+        return int(np.searchsorted(times, end, 'left') - np.searchsorted(times, start, 'left'))
+
+    """ ================================================================================
+    Number of steps in consecutive buckets of 'width' microseconds. The buckets are on
+    an absolute grid (bucket k covers [k * width, (k + 1) * width)), so the same
+    minute is the same bucket in every query.
+    :param start: (int) first timestamp, the bucket holding it is the first one
+    :param end: (int) timestamp after the last one, the bucket holding 'end' - 1 is
+                the last one
+    :param width: (int) width of a bucket in microseconds
+    :return: (tuple) start time of each bucket and its number of steps as np.ndarrays
+    ================================================================================ """
+    def buckets(self, start, end, width):
+        first, last = start // width, -(-end // width)
+        if last - first > MAX_BUCKETS:
+            raise ValueError("A query can return at most {} buckets".format(MAX_BUCKETS))
+        edges = np.arange(first, max(first, last) + 1, dtype=np.int64) * width
+        return edges[:-1], np.diff(np.searchsorted(self.times(), edges, 'left'))
+
+
+class TTLCache:
+
+    """ ================================================================================
+    Constructor of a cache of query results. A result is served for 'ttl' seconds after
+    it was computed, then computed again; the least recently used results are evicted
+    beyond 'maxsize'. Dashboards polling the same queries then cost one computation
+    per 'ttl' whatever their number.
+    :param ttl: (float) seconds a result stays valid
+    :param maxsize: (int) max number of results kept
+    :param clock: function returning the current time in seconds (default: monotonic)
+    :return: None
+    ================================================================================ """
+    def __init__(self, ttl=CACHE_TTL, maxsize=CACHE_SIZE, clock=monotonic):
+        self.ttl = ttl
+        self._maxsize = maxsize
+        self._clock = clock
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        return
+
+    """ ================================================================================
+    Returns the cached result of a query, computing it if it is missing or too old
+    :param key: (tuple) the query, hashable
+    :param compute: function computing the result (called with no arguments)
+    :return: the result
+    ================================================================================ """
+    def get(self, key, compute):
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and self._clock() - entry[0] < self.ttl:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+        # computed outside the lock: a slow query does not hold up the cached ones
+        now = self._clock()
+        result = compute()
+        with self._lock:
+            self._results[key] = (now, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self._maxsize:
+                self._results.popitem(last=False)
+        return result
+
+    """ ================================================================================
+    Forgets every cached result
+    :return: None
+    ================================================================================ """
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+        return
+
+    """ ================================================================================
+    Hit/miss statistics of the cache
+    :return: (dict) hits, misses and number of cached results
+    ================================================================================ """
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "results": len(self._results)}
+
+
+class StepService:
+
+    """ ================================================================================
+    Constructor of the step counts served to clients: totals, cadence and steps per
+    minute or hour of every device. The steps are recorded as the pedometers find them
+    (see SessionManager) into one StepIndex per device, and the queries only search
+    these indexes, never the raw samples. Their results are cached for 'ttl' seconds,
+    so they are at most that old. Times are in microseconds; a SessionManager records
+    its steps at their gateway time (wall-clock, since the epoch, see GatewayClock), so
+    the buckets are real minutes and hours, across restarts of the wearables.
+    :param store: (SessionStore) archive whose steps are loaded first (None for none)
+    :param ttl: (float) seconds a query result is cached
+    :return: None
+    ================================================================================ """
+    def __init__(self, store=None, ttl=CACHE_TTL):
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.cache = TTLCache(ttl)
+        if store is not None:
+            for device in store.devices():
+                info = store.info(device)
+                self.__index(device).append(store.query(device)[2], info["samples"]["last"])
+        return
+
+    """ ================================================================================
+    Step index of a device, created if needed
+    :param device: (str) name of the device
+    :return: (StepIndex) its index
+    ================================================================================ """
+    def __index(self, device):
+        with self._lock:
+            index = self._indexes.get(device)
+            if index is None:
+                index = self._indexes[device] = StepIndex()
+            return index
+
+    """ ================================================================================
+    Step index of a device that must exist
+    :param device: (str) name of the device
+    :return: (StepIndex) its index
+    ================================================================================ """
+    def __existing(self, device):
+        index = self._indexes.get(device)
+        if index is None:
+            raise KeyError("Unknown device: {}".format(device))
+        return index
+
+    """ ================================================================================
+    Records the steps found in a batch of samples
+    :param device: (str) name of the device
+    :param steps: (array-like) timestamps of the new steps
+    :param until: (int) timestamp of the last sample of the batch (None for the last step)
+    :return: None
+    ================================================================================ """
+    def record(self, device, steps, until=None):
+        self.__index(device).append(steps, until)
+        return
+
+    """ ================================================================================
+    Names of the devices with steps recorded
+    :return: (list) device names
+    ================================================================================ """
+    def devices(self):
+        with self._lock:
+            return sorted(self._indexes)
+
+    """ ================================================================================
+    Total steps, last step and last sample time of every device
+    :return: (dict) one entry per device
+    ================================================================================ """
+    def totals(self):
+        def compute():
+            totals = {}
+            for device in self.devices():
+                index = self.__existing(device)
+                times = index.times()
+                totals[device] = {"steps": len(times), "last_step": int(times[-1]) if len(times) else None,
+                                  "until": index.until}
+            return totals
+        return self.cache.get(("totals",), compute)
+
+    """ ================================================================================
+    Number of steps of a device in the time range [start, end)
+    :param device: (str) name of the device
+    :param start: (int) first timestamp (None for the beginning)
+    :param end: (int) timestamp after the last one (None for the end)
+    :return: (int) number of steps
+    ================================================================================ """
+    def steps(self, device, start=None, end=None):
+        index = self.__existing(device)
+        info = np.iinfo(np.int64)
+        start = info.min if start is None else int(start)
+        end = info.max if end is None else int(end)
+        return self.cache.get(("steps", device, start, end), lambda: index.count(start, end))
+
+    """ ================================================================================
+    Current cadence of a device: its steps per minute over the last 'window' seconds
+    before its last sample
+    :param device: (str) name of the device
+    :param window: (float) seconds of steps to average over
+    :return: (float) steps per minute (0 if the device has no samples yet)
+    ================================================================================ """
+    def cadence(self, device, window=CADENCE_WINDOW):
+        index = self.__existing(device)
+        if window <= 0:
+            raise ValueError("The cadence window must be positive")
+
+        def compute():
+            if index.until is None:
+                return 0.0
+            return index.count(index.until - int(window * 1e6), index.until + 1) * 60.0 / window
+        return self.cache.get(("cadence", device, float(window)), compute)
+
+    """ ================================================================================
+    Steps of a device per bucket of time
+    :param device: (str) name of the device
+    :param width: (str or int) "minute", "hour", or a width in microseconds
+    :param start: (int) first timestamp (None for DEFAULT_BUCKETS buckets before 'end')
+    :param end: (int) time after the last bucket (None for after the last sample)
+    :return: (dict) bucket width, start time of each bucket and its number of steps
+    ================================================================================ """
+    def buckets(self, device, width="minute", start=None, end=None):
+        index = self.__existing(device)
+        try:
+            width = int(BUCKETS.get(width, width))
+        except ValueError:
+            raise ValueError("Unknown bucket width: {}".format(width)) from None
+        if width <= 0:
+            raise ValueError("The bucket width must be positive")
+        if end is None:
+            end = (index.until if index.until is not None else 0) + 1
+        end = int(end)
+        start = end - DEFAULT_BUCKETS * width if start is None else int(start)
+
+        def compute():
+            starts, counts = index.buckets(start, end, width)
+            return {"width": width, "start": starts.tolist(), "steps": counts.tolist()}
+        return self.cache.get(("buckets", device, width, start, end), compute)
+
+
+class StepServer:
+
+    """ ================================================================================
+    Constructor of a local HTTP endpoint serving a StepService as JSON to dashboards:
+        GET /devices                                  device names
+        GET /totals                                   totals of every device
+        GET /steps?device=&start=&end=                steps in a time range
+        GET /cadence?device=&window=                  steps per minute
+        GET /buckets?device=&width=&start=&end=       steps per minute / hour
+    Times are in microseconds, those of the service (wall-clock, since the epoch, for
+    the steps of a SessionManager or of its archive). An unknown device
+    or path answers 404, a malformed query 400.
+    :param service: (StepService) the step counts to serve
+    :param port: (int) TCP port of the endpoint (0 picks a free one)
+    :param host: (str) address to listen on
+    :return: None
+    ================================================================================ """
+    def __init__(self, service, port=8080, host="127.0.0.1"):
+        # http.server is only needed by this endpoint, most runs never load it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.answer(self.path)
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                return
+
+        self.service = service
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="step-server", daemon=True)
+        self._thread.start()
+        return
+
+    """ ================================================================================
+    Answers one request
+    :param path: (str) path and query string of the request
+    :return: (tuple) HTTP status and JSON-serializable body
+    ================================================================================ """
+    def answer(self, path):
+        url = urlsplit(path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        routes = {"/devices": lambda: self.service.devices(),
+                  "/totals": lambda: self.service.totals(),
+                  "/steps": lambda: self.service.steps(query["device"], query.get("start"), query.get("end")),
+                  "/cadence": lambda: self.service.cadence(query["device"],
+                                                           float(query.get("window", CADENCE_WINDOW))),
+                  "/buckets": lambda: self.service.buckets(query["device"], query.get("width", "minute"),
+                                                           query.get("start"), query.get("end"))}
+        route = routes.get(url.path.rstrip("/") or "/")
+        if route is None:
+            return 404, {"error": "Unknown path: {}".format(url.path)}
+        if url.path.rstrip("/") not in ("/devices", "/totals") and "device" not in query:
+            return 400, {"error": "Missing parameter: device"}
+        try:
+            return 200, route()
+        except KeyError as error:
+            return 404, {"error": str(error.args[0])}
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+    """ ================================================================================
+    Stops the HTTP endpoint
+    :return: None
+    ================================================================================ """
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the step counts of a session store over HTTP.")
+    parser.add_argument("root", help="directory of the store")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="TCP port of the endpoint")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL, help="seconds a query result is cached")
+    args = parser.parse_args()
+
+    server = StepServer(StepService(SessionStore(args.root), args.ttl), args.port, args.host)
+    print("Serving the steps of {} on http://{}:{}/totals".format(args.root, args.host, server.port))
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        print("\nExiting due to user input (<ctrl>+c).")
+    server.close()
@@ -0,0 +1,474 @@
+# Imports
+import argparse
+import csv
+import sys
+import threading
+import traceback
+from time import monotonic, sleep
+import numpy as np
+from my_wearable.acquisition import HandoffQueue, DROP_OLDEST
+from my_wearable.ble import BLE
+from my_wearable.clock import GatewayClock
+from my_wearable.frames import TextDecoder
+from my_wearable.lazy import LazyModule
+from my_wearable.metrics import REGISTRY
+from my_wearable.pedometer import Pedometer
+from my_wearable.profiling import PROFILER, format_summary
+from my_wearable.service import StepServer, StepService
+from my_wearable.store import SessionStore
+
+# States of a device link
+CONNECTING = "connecting"
+STREAMING = "streaming"
+RECONNECTING = "reconnecting"
+STOPPED = "stopped"
+
+""" ================================================================================
+Reads a roster of devices from a CSV file with one "port,mac" row per device. Empty
+lines and lines starting with '#' are skipped.
+:param filename: (str) path of the roster
+:return: (list) (port, MAC) tuples
+================================================================================ """
+def load_roster(filename):
+    roster = []
+    with open(filename, newline='') as file:
+        for row in csv.reader(file):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            port = row[0].strip()
+            mac = row[1].strip() if len(row) > 1 and row[1].strip() else None
+            roster.append((port, mac))
+    return roster
+
+
+class DeviceSession:
+
+    """ ================================================================================
+    Constructor of the link to one wearable. Its reader thread owns the BLE object: it
+    connects, reads and decodes the frames and queues them for the shard worker that
+    owns the pedometer. When the link fails it closes the port and reconnects with an
+    exponential backoff, without affecting the other devices.
+    :param port: (str) Serial port of the PC HM-10, or a serial-like object
+    :param mac: (str) MAC address of the remote HM-10 (None if the link is already up)
+    :param baudrate: (int) baud rate of the PC HM-10
+    :param maxlen: (int) max number of batches queued for the shard worker
+    :param policy: (str) backpressure policy of the queue
+    :param eol: (str) character terminating each frame
+    :param pedometer_maxlen: (int) samples kept by the pedometer
+    :param max_backoff: (float) max seconds between two reconnection attempts
+    :param time_scale: (float) time scale of the BLE waits and of the gateway clock (see
+                       BLE and GatewayClock)
+    :param binary: (bool) have the wearable send binary frames instead of text frames
+                   (set again on every connection, see BLE.frame_mode)
+    :return: None
+    ================================================================================ """
+    def __init__(self, port, mac=None, baudrate=9600, maxlen=64, policy=DROP_OLDEST, eol=';',
+                 pedometer_maxlen=3000, max_backoff=30.0, time_scale=1.0, binary=False):
+        self.port = port
+        self.mac = mac
+        self.name = port if isinstance(port, str) else "{}-{}".format(type(port).__name__, id(port))
+        self.pedometer = Pedometer(pedometer_maxlen, file_flag=False, streaming=True, name=self.name)
+        self.queue = HandoffQueue(maxlen, policy)
+        self.state = STOPPED
+        self.invalid_frames = 0
+        self.failed_batches = 0     # batches the pedometer raised on
+        self.failed_stores = 0      # batches the store raised on
+        self.failed_records = 0     # batches the step service raised on
+        self.reconnects = 0         # after an "OK+LOST" or a failure of the link
+        self.last_error = None
+        self.last_sample = None     # monotonic time of the last batch received
+        self.clock = GatewayClock(time_scale=time_scale)   # wall-clock time of the samples
+
+        self._baudrate = baudrate
+        self._binary = binary
+        self._text = TextDecoder(eol, name=self.name)
+        self._decoder = self._text      # a BinaryDecoder continuing it in binary mode
+        self._max_backoff = max_backoff
+        self._time_scale = time_scale
+        self._ble = None
+        self._ble_reconnects = 0    # reconnects of self._ble already counted
+        self._running = threading.Event()
+        self._thread = None
+        self._wake = None
+        self._reconnect_counter = REGISTRY.counter("session_reconnects_total", device=self.name)
+        return
+
+    """ ================================================================================
+    Starts the reader thread
+    :param wake: (threading.Event) set whenever a batch is queued, to wake the worker
+    :return: None
+    ================================================================================ """
+    def start(self, wake):
+        self._wake = wake
+        self._running.set()
+        self._thread = threading.Thread(target=self.__reader, name="reader-" + self.name, daemon=True)
+        self._thread.start()
+        return
+
+    """ ================================================================================
+    Asks the reader thread to stop, without waiting for it
+    :return: None
+    ================================================================================ """
+    def request_stop(self):
+        self._running.clear()
+        return
+
+    """ ================================================================================
+    Waits for the reader thread to stop
+    :param timeout: (float) max seconds to wait
+    :return: None
+    ================================================================================ """
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return
+
+    """ ================================================================================
+    Opens the port and connects to the remote HM-10
+    :return: None
+    ================================================================================ """
+    def __connect(self):
+        if self._ble is None:
+            self._ble = BLE(self.port, self._baudrate, time_scale=self._time_scale)
+            self._ble_reconnects = 0
+        if self.mac is not None:
+            self._ble.connect(self.mac)
+        # the decoder is kept: it re-bases the timestamps itself if the wearable
+        # restarted, and keeps counting the wraps of micros() otherwise
+        return
+
+    """ ================================================================================
+    Closes the port after a failure, ignoring the errors of a link that is already down
+    :return: None
+    ================================================================================ """
+    def __disconnect(self):
+        if self._ble is not None:
+            self._ble.close_port()
+        if isinstance(self.port, str):
+            self._ble = None    # reopen the port from scratch
+        return
+
+    """ ================================================================================
+    Reader thread: (re)connects and queues the decoded samples until stopped
+    :return: None
+    ================================================================================ """
+    def __reader(self):
+        backoff = 0.5
+        self.state = CONNECTING
+        while self._running.is_set():
+            try:
+                if self.state != STREAMING:
+                    self.__connect()
+                    self.state = STREAMING
+                    backoff = 0.5
+                    # the format is set on every connection: a wearable that restarted
+                    # sends text frames again
+                    self._decoder, times, values = self._ble.frame_mode(self._decoder, self._binary)
+                else:
+                    # read_samples() reconnects through check_connection() on "OK+LOST"
+                    times, values = self._ble.read_samples(self._decoder, block=True)
+                if self._ble.reconnects > self._ble_reconnects:
+                    self.reconnects += self._ble.reconnects - self._ble_reconnects
+                    self._reconnect_counter.inc(self._ble.reconnects - self._ble_reconnects)
+                    self._ble_reconnects = self._ble.reconnects
+                    # read_samples() reconnected: the format is set again as well
+                    self._decoder, more_times, more_values = self._ble.frame_mode(self._decoder, self._binary)
+                    times = np.concatenate((times, more_times))
+                    values = np.concatenate((values, more_values))
+                self.invalid_frames = self._decoder.invalid_frames
+                if len(times):
+                    self.last_sample = monotonic()
+                    self.clock.arrived(times)
+                    while not self.queue.put(times, values, timeout=0.1):
+                        if not self._running.is_set():
+                            break
+                    self._wake.set()
+
+            except (IOError, OSError) as error:
+                self.last_error = "{}: {}".format(type(error).__name__, error)
+                self.state = RECONNECTING
+                self.reconnects += 1
+                self._reconnect_counter.inc()
+                self.__disconnect()
+                # sleep in small steps so that stop() is not held up by the backoff
+                deadline = monotonic() + backoff
+                while self._running.is_set() and monotonic() < deadline:
+                    sleep(min(0.1, backoff))
+                backoff = min(2 * backoff, self._max_backoff)
+
+            except Exception as error:
+                self.last_error = "{}: {}".format(type(error).__name__, error)
+                traceback.print_exc()
+                break
+
+        if self._ble is not None and self.state == STREAMING and isinstance(self.port, str):
+            try:
+                self._ble.close()
+            except Exception:
+                pass
+        self.state = STOPPED
+        self._wake.set()
+        return
+
+    """ ================================================================================
+    Counters of the device
+    :return: (dict) state, steps, samples, dropped samples, invalid frames, restarts of
+             the wearable clock, failed batches, stores and records, reconnects and the
+             last error
+    ================================================================================ """
+    def stats(self):
+        return {"device": self.name, "mac": self.mac, "state": self.state,
+                "steps": self.pedometer.get_steps(),
+                "samples": self.queue.consumed_samples,
+                "dropped_samples": self.queue.dropped_samples,
+                "pending_samples": self.queue.pending_samples(),
+                "invalid_frames": self.invalid_frames,
+                "clock_restarts": self._text.restarts,
+                "failed_batches": self.failed_batches,
+                "failed_stores": self.failed_stores,
+                "failed_records": self.failed_records,
+                "reconnects": self.reconnects,
+                "last_error": self.last_error}
+
+
+class SessionManager:
+
+    """ ================================================================================
+    Constructor of a session over many wearables. Each device has its own reader thread
+    (the serial reads block, so a slow or dead link only stalls its own thread) and its
+    own handoff queue. The pedometers are sharded over a small pool of worker threads:
+    each worker owns the devices i % workers == shard and takes one batch per device in
+    turn, so a device flooding its queue cannot starve the others.
+    :param roster: (list) (port, MAC) tuples, one per device
+    :param workers: (int) number of pedometer worker threads
+    :param store: (SessionStore) store every batch and its steps are archived in, at
+                  their gateway time (see GatewayClock), None to keep nothing
+    :param service: (StepService) step counts the steps of every batch are recorded in,
+                    at their gateway time, for the clients (None for none)
+    :param kwargs: arguments of DeviceSession (baudrate, maxlen, policy, eol, ...)
+    :return: None
+    ================================================================================ """
+    def __init__(self, roster, workers=4, store=None, service=None, **kwargs):
+        self.devices = [DeviceSession(port, mac, **kwargs) for port, mac in roster]
+        self.store = store
+        self.service = service
+        self._workers = max(1, min(workers, len(self.devices)))
+        self._shards = [self.devices[shard::self._workers] for shard in range(self._workers)]
+        self._wakes = [threading.Event() for _ in self._shards]
+        self._running = threading.Event()
+        self._threads = []
+        self._started = None
+        self._stopped = None
+        self._connected = REGISTRY.gauge("session_devices_streaming")
+        return
+
+    """ ================================================================================
+    Metrics collector: number of devices currently streaming
+    :return: None
+    ================================================================================ """
+    def _collect(self):
+        self._connected.set(sum(device.state == STREAMING for device in self.devices))
+        return
+
+    """ ================================================================================
+    Starts the reader of every device and the shard workers
+    :return: None
+    ================================================================================ """
+    def start(self):
+        # the filters import scipy.signal on first use; do it now rather than in the
+        # middle of the first batches, while the readers fill the queues
+        LazyModule("scipy.signal").load()
+        REGISTRY.add_collector(self._collect)
+        self._running.set()
+        self._started = monotonic()
+        self._stopped = None
+        self._threads = [threading.Thread(target=self.__worker, args=(shard,), name="pedometer-shard-{}".format(shard),
+                                          daemon=True) for shard in range(self._workers)]
+        for thread in self._threads:
+            thread.start()
+        for shard, devices in enumerate(self._shards):
+            for device in devices:
+                device.start(self._wakes[shard])
+        return
+
+    """ ================================================================================
+    Stops every reader, then the workers once they have fed the queued samples
+    :param timeout: (float) max seconds to wait for each reader
+    :return: None
+    ================================================================================ """
+    def stop(self, timeout=5.0):
+        for device in self.devices:
+            device.request_stop()
+        for device in self.devices:
+            device.join(timeout)
+        self._running.clear()
+        for wake in self._wakes:
+            wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped = monotonic()
+        if self.store is not None:
+            self.store.close()
+        self._collect()
+        REGISTRY.remove_collector(self._collect)
+        return
+
+    """ ================================================================================
+    Worker thread: feeds the batches of the devices of one shard to their pedometers
+    :param shard: (int) index of the shard
+    :return: None
+    ================================================================================ """
+    def __worker(self, shard):
+        devices = self._shards[shard]
+        wake = self._wakes[shard]
+        while True:
+            running = self._running.is_set()
+            wake.clear()
+            fed = False
+            for device in devices:
+                batch = device.queue.get(timeout=0)
+                if batch is not None:
+                    fed = True
+                    with PROFILER.span("session.batch", "session"):
+                        self.__feed(device, *batch)
+            if not fed:
+                if not running:
+                    for device in devices:
+                        self.__flush(device)
+                    return
+                wake.wait(0.1)
+
+    """ ================================================================================
+    Counts the steps of the samples the pedometer of a device still holds back, once
+    every batch was fed, and records them
+    :param device: (DeviceSession) the device
+    :return: None
+    ================================================================================ """
+    def __flush(self, device):
+        try:
+            steps = device.pedometer.flush()
+        except Exception as error:
+            device.last_error = "{}: {}".format(type(error).__name__, error)
+            device.failed_batches += 1
+            return
+        if self.service is not None and len(steps):
+            try:
+                self.service.record(device.name, device.clock.convert(steps))
+            except Exception as error:
+                device.last_error = "{}: {}".format(type(error).__name__, error)
+                device.failed_records += 1
+        return
+
+    """ ================================================================================
+    Feeds a batch to the pedometer of its device, archives it and records its steps.
+    Each stage catches its own errors, so that one bad batch does not stop the other
+    devices of the shard, and a failing store does not stop the step counting.
+    :param device: (DeviceSession) the device
+    :param times: (np.ndarray) device timestamps of the batch
+    :param values: (np.ndarray) values of the batch
+    :return: None
+    ================================================================================ """
+    def __feed(self, device, times, values):
+        steps = None
+        try:
+            steps = device.pedometer.append_batch(times, values)
+        except Exception as error:
+            device.last_error = "{}: {}".format(type(error).__name__, error)
+            device.failed_batches += 1
+        if self.store is None and self.service is None:
+            return
+
+        # the archive and the step counts are keyed on the gateway clock, which never
+        # goes back (the wearable clock starts over when it restarts)
+        gateway = device.clock.convert(times)
+        steps = None if steps is None else device.clock.convert(steps)
+        if self.store is not None:
+            try:
+                with PROFILER.span("store.append", "store"):
+                    self.store.append(device.name, gateway, values, steps)
+            except Exception as error:
+                device.last_error = "{}: {}".format(type(error).__name__, error)
+                device.failed_stores += 1
+
+        if self.service is not None and steps is not None:
+            try:
+                with PROFILER.span("service.record", "service"):
+                    self.service.record(device.name, steps, gateway[-1])
+            except Exception as error:
+                device.last_error = "{}: {}".format(type(error).__name__, error)
+                device.failed_records += 1
+        return
+
+    """ ================================================================================
+    Per-device totals and aggregate throughput of the session
+    :return: (dict) one entry per device, and the totals
+    ================================================================================ """
+    def report(self):
+        devices = [device.stats() for device in self.devices]
+        end = self._stopped if self._stopped is not None else monotonic()
+        elapsed = end - self._started if self._started is not None else 0.0
+        samples = sum(row["samples"] for row in devices)
+        return {"devices": devices,
+                "total": {"devices": len(devices),
+                          "streaming": sum(row["state"] == STREAMING for row in devices),
+                          "steps": sum(row["steps"] for row in devices),
+                          "samples": samples,
+                          "dropped_samples": sum(row["dropped_samples"] for row in devices),
+                          "reconnects": sum(row["reconnects"] for row in devices),
+                          "elapsed_s": elapsed,
+                          "samples_per_second": samples / elapsed if elapsed > 0 else 0.0}}
+
+
+""" ================================================================================
+Prints a report of the session as a table
+:param report: (dict) output of SessionManager.report()
+:return: None
+================================================================================ """
+def print_report(report):
+    print("{:28s} {:>12s} {:>7s} {:>9s} {:>8s} {:>10s}".format(
+        "device", "state", "steps", "samples", "dropped", "reconnects"))
+    for row in report["devices"]:
+        print("{:28s} {:>12s} {:7d} {:9d} {:8d} {:10d}".format(
+            row["device"][-28:], row["state"], row["steps"], row["samples"],
+            row["dropped_samples"], row["reconnects"]))
+    total = report["total"]
+    print("{} of {} devices streaming, {} steps, {:.1f} samples/s".format(
+        total["streaming"], total["devices"], total["steps"], total["samples_per_second"]))
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the steps of many wearables at once.")
+    parser.add_argument("roster", help="CSV file with one 'port,mac' row per device")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="number of pedometer worker threads")
+    parser.add_argument("-b", "--baudrate", type=int, default=9600, help="baud rate of the PC HM-10s")
+    parser.add_argument("--binary", action="store_true", help="have the wearables send binary frames")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between two reports")
+    parser.add_argument("--store", default=None, help="directory of a session store to archive the samples in")
+    parser.add_argument("--serve", type=int, default=None, help="serve the step counts over HTTP on this port")
+    parser.add_argument("--profile", default=None, metavar="TRACE", help="write a Chrome trace of the stages to this file")
+    args = parser.parse_args()
+
+    store = SessionStore(args.store) if args.store is not None else None
+    service = StepService(store) if args.serve is not None else None
+    session = SessionManager(load_roster(args.roster), args.workers, store, service, baudrate=args.baudrate,
+                             binary=args.binary)
+    server = StepServer(service, args.serve) if service is not None else None
+    if args.profile is not None:
+        PROFILER.enable()
+    session.start()
+    try:
+        while True:
+            sleep(args.interval)
+            print_report(session.report())
+    except KeyboardInterrupt:
+        print("\nExiting due to user input (<ctrl>+c).")
+    session.stop()
+    if server is not None:
+        server.close()
+    print_report(session.report())
+    if args.profile is not None:
+        PROFILER.disable()
+        PROFILER.write_trace(args.profile)
+        print(format_summary(PROFILER.summary()), file=sys.stderr)
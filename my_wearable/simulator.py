@@ -0,0 +1,419 @@
+# Imports
+import os
+import re
+import select
+import threading
+import tty
+from time import monotonic, sleep
+import numpy as np
+from my_wearable.frames import ASCII_MODE, BINARY_MODE, FRAME_SYNC
+from my_wearable.recording import load_recording
+
+# Sampling periods of the "CF0;" to "CF4;" commands (microseconds), as in MyWearable.ino
+SAMPLING_PERIODS = [10000, 20000, 200000, 500000, 10000000]
+# micros() on the Arduino wraps around after 2^32 microseconds (about 71.6 minutes)
+MICROS_WRAP = 1 << 32
+# Size of the message buffer of readBLE() (in_text in MyWearable.ino)
+IN_TEXT_SIZE = 64
+
+class HM10Simulator:
+
+    """ ================================================================================
+    Constructor of a simulated pair of HM-10s with the wearable behind them. It answers
+    the AT commands of the PC HM-10 (OK, OK+CONNA/OK+CONN, OK+LOST, ...), runs the
+    handshake and the "CF" commands of MyWearable.ino, and plays a recording back as
+    "%8lu,%5lu;" or binary frames at 'speed' times real time.
+    Faults are drawn frame by frame from a seeded generator, so the same seed always
+    corrupts, truncates and disconnects the same frames.
+    :param recording: (str or tuple) recording file, or (times, values) arrays
+    :param speed: (float) playback speed (1 is real time, 100 is 100 times faster)
+    :param mac: (str) MAC address of the wearable (None accepts any)
+    :param loop: (bool) start the recording over when it ends
+    :param wrap: (bool) wrap the timestamps around at 2^32 like micros() does
+    :param corrupt: (float) probability that a frame has one byte replaced
+    :param partial: (float) probability that the end of a frame is lost
+    :param disconnect: (float) probability that the link is lost after a frame
+    :param connect_failures: (int) connection attempts that fail after each lost link
+    :param seed: (int) seed of the fault generator
+    :param clock: function returning the current time in seconds (default: monotonic)
+    :return: None
+    ================================================================================ """
+    def __init__(self, recording, speed=1.0, mac=None, loop=True, wrap=True, corrupt=0.0,
+                 partial=0.0, disconnect=0.0, connect_failures=0, seed=0, clock=monotonic):
+        if isinstance(recording, str):
+            recording = load_recording(recording, cache=False)
+            times, values = recording[:, 0], recording[:, 1]
+        else:
+            times, values = recording
+        self._times = np.asarray(times, dtype=np.int64)
+        self._values = np.asarray(values, dtype=np.int64)
+        # one recording lasts its span plus one interval, so a loop keeps the cadence
+        interval = int(np.median(np.diff(self._times))) if len(self._times) > 1 else 0
+        self._period = int(self._times[-1] - self._times[0]) + interval
+
+        self.speed = speed
+        self.mac = mac
+        self.loop = loop
+        self.wrap = wrap
+        self.corrupt = corrupt
+        self.partial = partial
+        self.disconnect = disconnect
+        self.connect_failures = connect_failures
+        self._rng = np.random.default_rng(seed)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # PC HM-10
+        self.connected = False          # BLE link up
+        self._failures_left = 0
+        # wearable (MyWearable.ino)
+        self.streaming = False          # handshake done, frames are sent
+        self.binary = False
+        self.sampling_period = None     # set by "CF0;" to "CF4;", None sends every sample
+        self._last_char = b''
+        self._in_text = bytearray()     # message received since the last ';'
+        self._last_timestamp = 0
+        # playback
+        self._start = clock()
+        self._next = 0                  # index of the next sample of the (looped) recording
+        self._last_sent = None          # recording time of the last sample sent
+        self._out = bytearray()         # bytes waiting to be read by the PC
+
+        self.frames_sent = 0
+        self.frames_corrupted = 0
+        self.frames_partial = 0
+        self.disconnects = 0
+        self.connects = 0
+        return
+
+    """ ================================================================================
+    Recording time (in microseconds, not wrapped) of the sample 'index' of the looped
+    recording
+    :param index: (int or np.ndarray) sample index
+    :return: (int or np.ndarray) its timestamp
+    ================================================================================ """
+    def _sample_time(self, index):
+        n = len(self._times)
+        return self._times[index % n] + (index // n) * self._period
+
+    """ ================================================================================
+    Seconds until the next sample is due (0 if one is already due)
+    :return: (float) seconds, or None if the recording is over
+    ================================================================================ """
+    def next_due(self):
+        if not self.loop and self._next >= len(self._times):
+            return None
+        due = (self._sample_time(self._next) - self._times[0]) / 1e6 / self.speed
+        return max(0.0, due - (self._clock() - self._start))
+
+    """ ================================================================================
+    Takes the bytes to send to the PC: the answers to its commands and every frame due
+    by now. Samples that fall due while the link is down are lost, like on the device.
+    :return: (bytes) the bytes
+    ================================================================================ """
+    def read_output(self):
+        with self._lock:
+            self.__play()
+            out = bytes(self._out)
+            self._out.clear()
+        return out
+
+    """ ================================================================================
+    Number of bytes the PC can read now
+    :return: (int) number of bytes
+    ================================================================================ """
+    def pending(self):
+        with self._lock:
+            self.__play()
+            return len(self._out)
+
+    """ ================================================================================
+    Drops the bytes the PC did not read yet (flushInput on the PC side)
+    :return: None
+    ================================================================================ """
+    def discard_output(self):
+        with self._lock:
+            self.__play()
+            self._out.clear()
+        return
+
+    """ ================================================================================
+    Bytes written by the PC to its HM-10. While the link is down they are AT commands;
+    once connected they go over the air to the wearable, except "AT" on its own, which
+    drops the link.
+    :param data: (bytes) the bytes
+    :return: None
+    ================================================================================ """
+    def write(self, data):
+        with self._lock:
+            self.__play()
+            if self.connected and data == b"AT":
+                self.__lose_link()
+            elif self.connected:
+                self.__wearable(data)
+            else:
+                for command in re.split(b"(?=AT)", data):
+                    if command:
+                        self.__command(command)
+        return
+
+    """ ================================================================================
+    Answers one AT command of the PC HM-10
+    :param command: (bytes) the command
+    :return: None
+    ================================================================================ """
+    def __command(self, command):
+        if command.startswith(b"AT+CON"):
+            mac = command[6:].decode('utf-8', errors='replace').strip()
+            if self._failures_left > 0 or (self.mac is not None and mac != self.mac):
+                self._failures_left = max(0, self._failures_left - 1)
+                self._out += b"OK+CONNAOK+CONNF"
+                return
+            self._out += b"OK+CONNAOK+CONN"
+            self.connected = True
+            self.connects += 1
+        elif command.startswith(b"AT+NAME?"):
+            self._out += b"OK+NAME:HMSoft"
+        elif command.startswith(b"AT+RESET"):
+            self._out += b"OK+RESET"
+        elif command.startswith(b"AT+"):
+            self._out += b"OK+Set:" + command[-1:]
+        elif command.startswith(b"AT"):
+            self._out += b"OK"
+        return
+
+    """ ================================================================================
+    Runs the bytes received over the air through readBLE() of MyWearable.ino: "AT"
+    completes the handshake, a digit sets the sampling period, and a message ending
+    with "CFB" or "CFA" at its ';' the format
+    :param data: (bytes) the bytes
+    :return: None
+    ================================================================================ """
+    def __wearable(self, data):
+        for i in range(len(data)):
+            c = data[i:i + 1]
+            if len(self._in_text) >= IN_TEXT_SIZE - 1:
+                self._in_text.clear()
+            if self._last_char == b'A' and c == b'T':
+                self._out += b"#;"
+                self.streaming = True
+                self._in_text.clear()
+            elif c == b';':
+                if self._in_text[-3:] in (BINARY_MODE[:-1].encode(), ASCII_MODE[:-1].encode()):
+                    self.binary = self._in_text[-1:] == b'B'
+                self._in_text.clear()
+            else:
+                self._in_text += c
+                if b'0' <= c <= b'4':
+                    self.sampling_period = SAMPLING_PERIODS[int(c)]
+            self._last_char = c
+        return
+
+    """ ================================================================================
+    Drops the link: "OK+LOST" is sent and the wearable stops streaming until the next
+    handshake
+    :return: None
+    ================================================================================ """
+    def __lose_link(self):
+        self._out += b"OK+LOST"
+        self.connected = False
+        self.streaming = False
+        self.disconnects += 1
+        self._failures_left = self.connect_failures
+        return
+
+    """ ================================================================================
+    Appends every frame that is due to the output, applying the faults
+    :return: None
+    ================================================================================ """
+    def __play(self):
+        elapsed = (self._clock() - self._start) * self.speed * 1e6 + self._times[0]
+        while self.loop or self._next < len(self._times):
+            timestamp = self._sample_time(self._next)
+            if timestamp > elapsed:
+                break
+            value = self._values[self._next % len(self._times)]
+            self._next += 1
+            if not self.streaming:
+                continue
+            if self.sampling_period is not None and self._last_sent is not None \
+                    and timestamp - self._last_sent < self.sampling_period:
+                continue
+            self._last_sent = timestamp
+            self.__send(int(timestamp), int(value))
+            if self.disconnect and self._rng.random() < self.disconnect:
+                self.__lose_link()
+                return
+        return
+
+    """ ================================================================================
+    Encodes one sample like sendAccelL1Norm() and appends it to the output
+    :param timestamp: (int) timestamp in microseconds
+    :param value: (int) L1-norm
+    :return: None
+    ================================================================================ """
+    def __send(self, timestamp, value):
+        if self.wrap:
+            timestamp %= MICROS_WRAP
+        if self.binary:
+            delta = min((timestamp - self._last_timestamp) % MICROS_WRAP, 0xFFFFFF)
+            value = min(value, 0xFFFF)
+            body = [delta & 0xFF, (delta >> 8) & 0xFF, (delta >> 16) & 0xFF, value & 0xFF, (value >> 8) & 0xFF]
+            frame = bytearray([FRAME_SYNC] + body + [body[0] ^ body[1] ^ body[2] ^ body[3] ^ body[4]])
+        else:
+            frame = bytearray("{:8d},{:5d};".format(timestamp, value).encode('utf-8'))
+        self._last_timestamp = timestamp
+
+        if self.corrupt and self._rng.random() < self.corrupt:
+            frame[self._rng.integers(len(frame))] = self._rng.integers(256)
+            self.frames_corrupted += 1
+        if self.partial and self._rng.random() < self.partial:
+            frame = frame[:self._rng.integers(1, len(frame))]
+            self.frames_partial += 1
+        self._out += frame
+        self.frames_sent += 1
+        return
+
+    """ ================================================================================
+    Drops the link now, as if the wearable went out of range
+    :return: None
+    ================================================================================ """
+    def lose_link(self):
+        with self._lock:
+            self.__play()
+            if self.connected:
+                self.__lose_link()
+        return
+
+    """ ================================================================================
+    Restarts the wearable (e.g. a new battery): the link drops, and after the next
+    handshake the wearable sends text frames at every sample, as after power-up
+    :return: None
+    ================================================================================ """
+    def restart(self):
+        with self._lock:
+            self.__play()
+            if self.connected:
+                self.__lose_link()
+            self.binary = False
+            self.sampling_period = None
+            self._in_text.clear()
+            self._last_char = b''
+        return
+
+
+class FakeHM10:
+
+    """ ================================================================================
+    Constructor of an in-process HM-10 with the parts of the serial.Serial interface
+    used by BLE, so it can be passed to BLE() in place of a port name. Reads block up
+    to 'timeout' seconds like a serial port. Give BLE a time_scale of 1 / speed as
+    well, so that its handshake keeps up with the playback.
+    :param simulator: (HM10Simulator) the simulated devices
+    :param timeout: (float) read timeout in seconds (default: 1s at the playback speed)
+    :return: None
+    ================================================================================ """
+    def __init__(self, simulator, timeout=None):
+        self.simulator = simulator
+        self.timeout = 1.0 / simulator.speed if timeout is None else timeout
+        self.closed = False
+        self._rx = bytearray()
+        return
+
+    # The parts of the serial.Serial interface used by BLE
+
+    @property
+    def in_waiting(self):
+        self._rx += self.simulator.read_output()
+        return len(self._rx)
+
+    def read(self, size=1):
+        deadline = monotonic() + (self.timeout or 0)
+        while len(self._rx) < size:
+            self._rx += self.simulator.read_output()
+            remaining = deadline - monotonic()
+            if len(self._rx) >= size or remaining <= 0:
+                break
+            due = self.simulator.next_due()
+            sleep(min(remaining, 0.01 if due is None else max(due, 0.0005)))
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def write(self, data):
+        self.simulator.write(bytes(data))
+        return len(data)
+
+    def flushInput(self):
+        self._rx.clear()
+        self.simulator.discard_output()
+        return
+
+    def flushOutput(self):
+        return
+
+    reset_input_buffer = flushInput
+    reset_output_buffer = flushOutput
+
+    def close(self):
+        self.closed = True
+        return
+
+
+class PtyHM10:
+
+    """ ================================================================================
+    Constructor of a simulated HM-10 behind a pseudo-terminal. A thread moves the bytes
+    between the simulator and the master side; 'port' is the path of the slave side,
+    which BLE or AsyncBLE open like a real serial port.
+    :param simulator: (HM10Simulator) the simulated devices
+    :return: None
+    ================================================================================ """
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = threading.Event()
+        self._thread = None
+        return
+
+    """ ================================================================================
+    Starts serving the pty
+    :return: (PtyHM10) self
+    ================================================================================ """
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self.__serve, name="pty-hm10", daemon=True)
+        self._thread.start()
+        return self
+
+    """ ================================================================================
+    Thread moving the bytes between the simulator and the pty
+    :return: None
+    ================================================================================ """
+    def __serve(self):
+        while self._running.is_set():
+            due = self.simulator.next_due()
+            ready = select.select([self._master], [], [], 0.01 if due is None else min(max(due, 0.0005), 0.01))[0]
+            try:
+                if ready:
+                    self.simulator.write(os.read(self._master, 4096))
+                out = self.simulator.read_output()
+                if out:
+                    os.write(self._master, out)
+            except OSError:
+                break
+        return
+
+    """ ================================================================================
+    Stops the thread and closes the pty
+    :return: None
+    ================================================================================ """
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+        return
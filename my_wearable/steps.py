@@ -0,0 +1,111 @@
+# Imports
+import numpy as np
+from my_wearable.lazy import LazyModule
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+class StepDetector:
+
+    """ ================================================================================
+    Constructor that sets up the step validation rules. Every rule is applied in one
+    vectorized pass by sig.find_peaks, so no Python loop runs over the peaks.
+    :param lower_bound: (float) min amplitude of a step in the filtered data
+    :param upper_bound: (float) max amplitude of a step in the filtered data
+    :param prominence: (float) min prominence of a step (None to disable)
+    :param min_interval: (float) min time between two steps in seconds, i.e. the max
+                         cadence (None to disable)
+    :param width: (float) min width of a step in samples (None to disable)
+    :return: None
+    ================================================================================ """
+    def __init__(self, lower_bound=-200, upper_bound=4000, prominence=None,
+                 min_interval=None, width=None):
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.prominence = prominence
+        self.min_interval = min_interval
+        self.width = width
+        self.reset()
+        return
+
+    """ ================================================================================
+    Forgets the last step seen by accept()
+    :return: None
+    ================================================================================ """
+    def reset(self):
+        self._last_step = None
+        return
+
+    """ ================================================================================
+    Finds the steps in a filtered signal
+    :param filtered: (np.ndarray) output of the pedometer filters
+    :param times: (np.ndarray) timestamps of the filtered samples (in microseconds)
+    :param fs: (float) sample rate in Hz, needed to turn 'min_interval' into samples
+    :return: (tuple) indices and timestamps of the steps as np.ndarrays
+    ================================================================================ """
+    def detect(self, filtered, times, fs=None):
+        distance = None
+        if self.min_interval is not None and fs:
+            distance = max(1, int(np.ceil(self.min_interval * fs)))
+
+        indices = sig.find_peaks(filtered, height=(self.lower_bound, self.upper_bound),
+                                 prominence=self.prominence, distance=distance,
+                                 width=self.width)[0]
+        return indices, np.asarray(times)[indices]
+
+    """ ================================================================================
+    Finds the steps of many filtered signals at once. The rows are laid end to end with
+    NaN between them (and after the end of the shorter ones), which sig.find_peaks
+    treats like the edge of the signal, so a single call finds the same steps as
+    detect() would on each row.
+    :param filtered: (np.ndarray) filtered signals, shape (n_streams, n_samples)
+    :param lengths: (np.ndarray) number of valid samples of each row (None if all are)
+    :param fs: (float) sample rate in Hz, needed to turn 'min_interval' into samples
+    :return: (tuple) row and column of every step as np.ndarrays, ordered by row
+    ================================================================================ """
+    def detect_many(self, filtered, lengths=None, fs=None):
+        filtered = np.asarray(filtered, dtype=float)
+        n_streams, n_samples = filtered.shape
+        distance = None
+        if self.min_interval is not None and fs:
+            distance = max(1, int(np.ceil(self.min_interval * fs)))
+
+        # the gap keeps 'distance' from comparing the peaks of two rows
+        width = n_samples + (distance or 1)
+        packed = np.full((n_streams, width), np.nan)
+        packed[:, :n_samples] = filtered
+        if lengths is not None:
+            packed[np.arange(width) >= np.asarray(lengths)[:, None]] = np.nan
+
+        indices = sig.find_peaks(packed.ravel(), height=(self.lower_bound, self.upper_bound),
+                                 prominence=self.prominence, distance=distance,
+                                 width=self.width)[0]
+        return np.divmod(indices, width)
+
+    """ ================================================================================
+    Validates peaks found one chunk at a time by the streaming filter. The amplitude
+    bounds and the min interval are applied with masks; prominence and width need
+    samples that have not arrived yet, so they are only used by detect().
+    :param values: (np.ndarray) amplitude of the new peaks
+    :param times: (np.ndarray) timestamps of the new peaks (in microseconds)
+    :return: (np.ndarray) timestamps of the peaks that are steps
+    ================================================================================ """
+    def accept(self, values, times):
+        times = np.asarray(times)
+        keep = (values >= self.lower_bound) & (values <= self.upper_bound)
+        times = times[keep]
+
+        if self.min_interval is not None and len(times):
+            # keep a peak only if it comes late enough after the last kept one
+            min_gap = self.min_interval * 1e6
+            kept = []
+            last = self._last_step
+            for t in times:
+                if last is None or t - last >= min_gap:
+                    kept.append(t)
+                    last = t
+            times = np.array(kept, dtype=times.dtype)
+
+        if len(times):
+            self._last_step = times[-1]
+        return times
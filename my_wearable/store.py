@@ -0,0 +1,369 @@
+# Imports
+import argparse
+import os
+import threading
+from urllib.parse import quote, unquote
+import numpy as np
+
+# Records of the two series kept per device
+SAMPLE_DTYPE = np.dtype([("time", "<i8"), ("value", "<i8")])
+STEP_DTYPE = np.dtype([("time", "<i8")])
+# Records per segment: about 5.8 hours of samples, or 65536 steps, at 50Hz
+SAMPLE_SEGMENT = 1 << 20
+STEP_SEGMENT = 1 << 16
+# Columns of the index files: first time, last time and number of records of a segment
+INDEX_COLUMNS = 3
+
+class _Series:
+
+    """ ================================================================================
+    Constructor of one append-only series of time-ordered records, cut into segments
+    of 'capacity' records ("<name>-000000.bin", "<name>-000001.bin", ...). When a
+    segment is full its time range and size are appended to "<name>.idx", so a range
+    query finds its segments with two searchsorted calls on the index and only maps
+    those. A segment that was filled but not indexed (the process died in between)
+    is indexed again when the series is opened, and a torn record at the end of the
+    last segment is cut off.
+    :param directory: (str) directory of the device
+    :param name: (str) name of the series
+    :param dtype: (np.dtype) record type, its first field is the time
+    :param capacity: (int) records per segment
+    :return: None
+    ================================================================================ """
+    def __init__(self, directory, name, dtype, capacity):
+        self._directory = directory
+        self._name = name
+        self._dtype = dtype
+        self._capacity = capacity
+        self._file = None
+        self._lock = threading.Lock()
+
+        index_file = self.__index_path()
+        index = np.fromfile(index_file, dtype=np.int64) if os.path.exists(index_file) else np.zeros(0, np.int64)
+        # a torn index row is dropped, the segment is indexed again below
+        self._index = index[:len(index) // INDEX_COLUMNS * INDEX_COLUMNS].reshape(-1, INDEX_COLUMNS)
+
+        # the first segment that is not indexed is the one being written
+        self._segment = len(self._index)
+        self._size = 0
+        self._first = self._last = None
+        while os.path.exists(self.__segment_path(self._segment)):
+            path = self.__segment_path(self._segment)
+            whole = os.path.getsize(path) // dtype.itemsize * dtype.itemsize
+            if whole != os.path.getsize(path):
+                os.truncate(path, whole)
+            records = self.__map(self._segment)
+            self._size = len(records)
+            if self._size:
+                self._first, self._last = int(records["time"][0]), int(records["time"][-1])
+            del records
+            if self._size < self._capacity:
+                break
+            self.__seal()
+        return
+
+    """ ================================================================================
+    Path of a segment file
+    :param segment: (int) number of the segment
+    :return: (str) the path
+    ================================================================================ """
+    def __segment_path(self, segment):
+        return os.path.join(self._directory, "{}-{:06d}.bin".format(self._name, segment))
+
+    """ ================================================================================
+    Path of the index file
+    :return: (str) the path
+    ================================================================================ """
+    def __index_path(self):
+        return os.path.join(self._directory, self._name + ".idx")
+
+    """ ================================================================================
+    Maps the whole records of a segment, read-only
+    :param segment: (int) number of the segment
+    :return: (np.ndarray) the records (empty if there are none)
+    ================================================================================ """
+    def __map(self, segment):
+        path = self.__segment_path(segment)
+        count = os.path.getsize(path) // self._dtype.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.zeros(0, dtype=self._dtype)
+        return np.memmap(path, dtype=self._dtype, mode='r', shape=(min(count, self._capacity),))
+
+    """ ================================================================================
+    Closes the full segment and appends its row to the index
+    :return: None
+    ================================================================================ """
+    def __seal(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        row = np.array([[self._first, self._last, self._size]], dtype=np.int64)
+        with open(self.__index_path(), 'ab') as file:
+            file.write(row.tobytes())
+        self._index = np.vstack((self._index, row))
+        self._segment += 1
+        self._size = 0
+        self._first = self._last = None
+        return
+
+    """ ================================================================================
+    Time of the last record of the series
+    :return: (int) timestamp, or None if the series is empty
+    ================================================================================ """
+    def last_time(self):
+        if self._last is not None:
+            return self._last
+        return int(self._index[-1, 1]) if len(self._index) else None
+
+    """ ================================================================================
+    Appends records to the series, opening new segments as the old ones fill up
+    :param records: (np.ndarray) records of the series dtype, in time order and not
+                    before the last record of the series
+    :return: None
+    ================================================================================ """
+    def append(self, records):
+        with self._lock:
+            last = self.last_time()
+            times = records["time"]
+            if len(times) and ((last is not None and times[0] < last) or np.any(times[1:] < times[:-1])):
+                raise ValueError("Records of '{}' must be appended in time order".format(self._name))
+            while len(records):
+                if self._file is None:
+                    self._file = open(self.__segment_path(self._segment), 'ab')
+                chunk = records[:self._capacity - self._size]
+                records = records[len(chunk):]
+                self._file.write(chunk.tobytes())
+                if self._first is None:
+                    self._first = int(chunk["time"][0])
+                self._last = int(chunk["time"][-1])
+                self._size += len(chunk)
+                if self._size == self._capacity:
+                    self.__seal()
+            if self._file is not None:
+                self._file.flush()
+        return
+
+    """ ================================================================================
+    Segments that may hold records in [start, end)
+    :param start: (int) first timestamp
+    :param end: (int) timestamp after the last one
+    :return: (tuple) range of indexed segments, and whether the open one overlaps
+    ================================================================================ """
+    def __segments(self, start, end):
+        lo = int(np.searchsorted(self._index[:, 1], start, 'left'))
+        hi = int(np.searchsorted(self._index[:, 0], end, 'left'))
+        tail = self._size > 0 and self._last >= start and self._first < end
+        return lo, max(lo, hi), tail
+
+    """ ================================================================================
+    Records with a time in [start, end). Only the segments the index points at are
+    mapped, and only the first and last of them are searched.
+    :param start: (int) first timestamp
+    :param end: (int) timestamp after the last one
+    :return: (np.ndarray) copy of the records
+    ================================================================================ """
+    def query(self, start, end):
+        with self._lock:
+            lo, hi, tail = self.__segments(start, end)
+            segments = list(range(lo, hi)) + ([self._segment] if tail else [])
+            parts = []
+            for segment in segments:
+                records = self.__map(segment)
+                if segment == self._segment:
+                    records = records[:self._size]
+                times = records["time"]
+                i = np.searchsorted(times, start, 'left') if times[0] < start else 0
+                j = np.searchsorted(times, end, 'left') if times[-1] >= end else len(times)
+                parts.append(np.array(records[i:j]))
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=self._dtype)
+
+    """ ================================================================================
+    Number of records with a time in [start, end). Segments entirely inside the range
+    are counted from the index, without being mapped.
+    :param start: (int) first timestamp
+    :param end: (int) timestamp after the last one
+    :return: (int) number of records
+    ================================================================================ """
+    def count(self, start, end):
+        with self._lock:
+            lo, hi, tail = self.__segments(start, end)
+            total = 0
+            for segment in range(lo, hi):
+                first, last, size = self._index[segment].tolist()
+                if first >= start and last < end:
+                    total += size
+                else:
+                    times = self.__map(segment)["time"]
+                    total += int(np.searchsorted(times, end, 'left') - np.searchsorted(times, start, 'left'))
+            if tail:
+                times = self.__map(self._segment)["time"][:self._size]
+                total += int(np.searchsorted(times, end, 'left') - np.searchsorted(times, start, 'left'))
+            return total
+
+    """ ================================================================================
+    Size and time range of the series
+    :return: (dict) number of segments and records, first and last timestamps
+    ================================================================================ """
+    def info(self):
+        with self._lock:
+            first = int(self._index[0, 0]) if len(self._index) else self._first
+            return {"segments": len(self._index) + (self._size > 0), "records":
+                    int(self._index[:, 2].sum()) + self._size, "first": first, "last": self.last_time()}
+
+    """ ================================================================================
+    Flushes the open segment to disk and closes it
+    :param sync: (bool) also wait for the data to reach the disk (os.fsync)
+    :return: None
+    ================================================================================ """
+    def close(self, sync=False):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+        return
+
+
+class SessionStore:
+
+    """ ================================================================================
+    Constructor of a persistent store of the samples and steps of many wearables. Each
+    device has its own directory under 'root' with two append-only series: the samples
+    (time, value) and the step timestamps, each cut into fixed-size binary segments
+    with a time-range index (see _Series). Nothing is ever rewritten, so a multi-week
+    archive answers a range query by mapping the one or two segments it touches.
+    Timestamps are in microseconds and must not go back in time within a device: a
+    SessionManager archives its batches at their gateway time (wall-clock microseconds
+    since the epoch, see GatewayClock), as the micros() of a wearable starts over when
+    it restarts.
+    :param root: (str) directory of the store (created if needed)
+    :param sample_segment: (int) samples per segment
+    :param step_segment: (int) steps per segment
+    :return: None
+    ================================================================================ """
+    def __init__(self, root, sample_segment=SAMPLE_SEGMENT, step_segment=STEP_SEGMENT):
+        self.root = root
+        self._sample_segment = sample_segment
+        self._step_segment = step_segment
+        self._devices = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        return
+
+    """ ================================================================================
+    Names of the devices in the store
+    :return: (list) device names
+    ================================================================================ """
+    def devices(self):
+        return sorted(unquote(entry) for entry in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, entry)))
+
+    """ ================================================================================
+    Opens (or creates) the series of a device. Device names are escaped into directory
+    names, so serial port paths can be used as they are.
+    :param device: (str) name of the device
+    :return: (tuple) samples and steps series
+    ================================================================================ """
+    def __series(self, device):
+        with self._lock:
+            series = self._devices.get(device)
+            if series is None:
+                directory = os.path.join(self.root, quote(device, safe=''))
+                os.makedirs(directory, exist_ok=True)
+                series = (_Series(directory, "samples", SAMPLE_DTYPE, self._sample_segment),
+                          _Series(directory, "steps", STEP_DTYPE, self._step_segment))
+                self._devices[device] = series
+            return series
+
+    """ ================================================================================
+    Appends a batch of samples, and the steps found in it, to the store
+    :param device: (str) name of the device
+    :param times: (array-like) timestamps of the samples (in microseconds)
+    :param values: (array-like) values of the samples
+    :param steps: (array-like) timestamps of the new steps (None if there are none)
+    :return: None
+    ================================================================================ """
+    def append(self, device, times, values, steps=None):
+        samples, step_series = self.__series(device)
+        records = np.empty(len(times), dtype=SAMPLE_DTYPE)
+        records["time"] = times
+        records["value"] = values
+        samples.append(records)
+        if steps is not None and len(steps):
+            records = np.empty(len(steps), dtype=STEP_DTYPE)
+            records["time"] = steps
+            step_series.append(records)
+        return
+
+    """ ================================================================================
+    Samples and steps of a device in the time range [start, end)
+    :param device: (str) name of the device
+    :param start: (int) first timestamp (None for the beginning)
+    :param end: (int) timestamp after the last one (None for the end)
+    :return: (tuple) timestamps and values of the samples, timestamps of the steps
+    ================================================================================ """
+    def query(self, device, start=None, end=None):
+        start, end = self.__range(start, end)
+        samples, steps = self.__series(device)
+        records = samples.query(start, end)
+        return records["time"], records["value"], steps.query(start, end)["time"]
+
+    """ ================================================================================
+    Number of steps of a device in the time range [start, end)
+    :param device: (str) name of the device
+    :param start: (int) first timestamp (None for the beginning)
+    :param end: (int) timestamp after the last one (None for the end)
+    :return: (int) number of steps
+    ================================================================================ """
+    def count_steps(self, device, start=None, end=None):
+        start, end = self.__range(start, end)
+        return self.__series(device)[1].count(start, end)
+
+    """ ================================================================================
+    Size and time range of the samples and steps of a device
+    :param device: (str) name of the device
+    :return: (dict) info of the samples and of the steps
+    ================================================================================ """
+    def info(self, device):
+        samples, steps = self.__series(device)
+        return {"device": device, "samples": samples.info(), "steps": steps.info()}
+
+    """ ================================================================================
+    Flushes and closes the open segments
+    :param sync: (bool) also wait for the data to reach the disk (os.fsync)
+    :return: None
+    ================================================================================ """
+    def close(self, sync=False):
+        with self._lock:
+            for samples, steps in self._devices.values():
+                samples.close(sync)
+                steps.close(sync)
+        return
+
+    """ ================================================================================
+    Turns an open-ended time range into int64 bounds
+    :param start: (int) first timestamp, or None
+    :param end: (int) timestamp after the last one, or None
+    :return: (tuple) the bounds
+    ================================================================================ """
+    @staticmethod
+    def __range(start, end):
+        info = np.iinfo(np.int64)
+        return (info.min if start is None else int(start)), (info.max if end is None else int(end))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize or query a session store.")
+    parser.add_argument("root", help="directory of the store")
+    parser.add_argument("device", nargs="?", default=None, help="device to query (all of them if omitted)")
+    parser.add_argument("--start", type=int, default=None, help="first timestamp (microseconds, since the epoch for a session archive)")
+    parser.add_argument("--end", type=int, default=None, help="timestamp after the last one (microseconds)")
+    args = parser.parse_args()
+
+    store = SessionStore(args.root)
+    for device in [args.device] if args.device is not None else store.devices():
+        times, values, steps = store.query(device, args.start, args.end)
+        print("{}: {} samples, {} steps".format(device, len(times), len(steps)), end="")
+        print(" from {} to {}".format(times[0], times[-1]) if len(times) else "")
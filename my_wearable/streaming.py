@@ -0,0 +1,161 @@
+# Imports
+import numpy as np
+from my_wearable.filters import FILTER_BANK
+from my_wearable.lazy import LazyModule
+from my_wearable.profiling import PROFILER
+from my_wearable.resample import Resampler, estimate_rate, processing_rate, step_cutoff
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+# Number of samples used to estimate the sample rate when it is not given
+RATE_SAMPLES = 16
+# Longest plateau (in filtered samples) still taken for a peak. A flat signal (device at
+# rest, saturated reading) would otherwise be carried over from chunk to chunk forever.
+MAX_PLATEAU = 256
+
+class StreamingFilter:
+
+    """ ================================================================================
+    Constructor that sets up the streaming version of the pedometer filter chain:
+        resampling -> de-mean -> boxcar smoothing -> gradient -> low-pass -> peaks
+    The samples are first put on a uniform grid at the processing rate (see
+    my_wearable.resample), then the smoothing, gradient and low-pass stages run as one
+    cascade of second-order sections designed for that rate. Every stage keeps its own
+    state between calls so that the data can be pushed in chunks of any size and the
+    work per sample stays constant.
+    :param fs: (float) sample rate of the stream in Hz, or None to estimate it from the
+               first RATE_SAMPLES samples
+    :return: None
+    ================================================================================ """
+    def __init__(self, fs=None):
+        self._fs = fs
+        self.reset()
+        return
+
+    """ ================================================================================
+    Sets up the resampler and the filter cascade for a stream sampled at 'fs'
+    :param fs: (float) sample rate of the stream in Hz
+    :return: None
+    ================================================================================ """
+    def __configure(self, fs):
+        self.rate, factor = processing_rate(fs)
+        self._resampler = Resampler(self.rate, factor, fs=fs)
+        self._sos = FILTER_BANK.pedometer(self.rate, cutoff=step_cutoff(fs))
+        # sosfilt initial conditions (zero, the same as the batch filter)
+        self._zi = np.zeros((len(self._sos), 2))
+        return
+
+    """ ================================================================================
+    Resets every stage of the filter chain to its initial (empty) state
+    :return: None
+    ================================================================================ """
+    def reset(self):
+        # resampler and filter cascade, set up once the sample rate is known
+        self.rate = None
+        self._resampler = None
+        self._sos = None
+        self._zi = None
+        self._warmup_times = np.zeros(0, dtype=np.int64)
+        self._warmup_values = np.zeros(0)
+        if self._fs is not None:
+            self.__configure(self._fs)
+        # running mean of the resampled data
+        self._sum = 0.0
+        self._count = 0
+        # timestamp of the last sample, its filtered value comes with the next chunk
+        self._pending_times = np.zeros(0, dtype=np.int64)
+        # filtered samples that can still turn out to be (or sit next to) a peak
+        self._peak_tail = np.zeros(0)
+        self._peak_tail_times = np.zeros(0, dtype=np.int64)
+        return
+
+    """ ================================================================================
+    Removes the running mean of everything seen so far from the 'values' chunk. This is
+    the online replacement for sig.detrend, which needs the whole signal at once.
+    :param values: (np.ndarray) chunk of raw data
+    :return: (np.ndarray) de-meaned chunk
+    ================================================================================ """
+    def __demean(self, values):
+        sums = self._sum + np.cumsum(values)
+        counts = self._count + np.arange(1, len(values) + 1)
+        self._sum = sums[-1]
+        self._count = counts[-1]
+        return values - sums / counts
+
+    """ ================================================================================
+    Finds the peaks of the filtered signal incrementally. The samples at the end of the
+    previous chunk (from the last change of value onwards) are kept so that peaks and
+    plateaus spanning two chunks are found exactly once. A plateau longer than
+    MAX_PLATEAU samples is too wide to be a step: only its last sample is kept, so the
+    work per chunk does not grow while the signal stays flat.
+    :param values: (np.ndarray) chunk of filtered data
+    :param times: (np.ndarray) timestamps of the filtered data
+    :return: (tuple) values and timestamps of the new peaks
+    ================================================================================ """
+    def __find_peaks(self, values, times):
+        ext = np.concatenate((self._peak_tail, values))
+        ext_times = np.concatenate((self._peak_tail_times, times))
+        peaks = sig.find_peaks(ext)[0]
+
+        # keep everything from the last change of value, a trailing plateau is undecided
+        changes = np.flatnonzero(ext != ext[-1]) if len(ext) else []
+        start = changes[-1] if len(changes) else 0
+        if len(ext) - start > MAX_PLATEAU + 1:
+            start = len(ext) - 1
+        self._peak_tail = ext[start:]
+        self._peak_tail_times = ext_times[start:]
+        return ext[peaks], ext_times[peaks]
+
+    """ ================================================================================
+    Pushes a chunk of samples through the whole filter chain
+    :param times: (array-like) timestamps of the new samples (in microseconds)
+    :param values: (array-like) raw data of the new samples
+    :return: (tuple) values and timestamps of the peaks found in this chunk
+    ================================================================================ """
+    def update(self, times, values):
+        times = np.asarray(times, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        if self._resampler is None:
+            # hold the first samples back until there are enough to estimate the rate
+            self._warmup_times = np.concatenate((self._warmup_times, times))
+            self._warmup_values = np.concatenate((self._warmup_values, values))
+            if len(self._warmup_times) < RATE_SAMPLES:
+                return np.zeros(0), np.zeros(0, dtype=np.int64)
+            self.__configure(estimate_rate(self._warmup_times))
+            times, values = self._warmup_times, self._warmup_values
+            self._warmup_times = self._warmup_times[:0]
+            self._warmup_values = self._warmup_values[:0]
+
+        with PROFILER.span("stream.resample", "filter"):
+            times, values = self._resampler.update(times, values)
+        if len(values) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        with PROFILER.span("stream.cascade", "filter"):
+            filtered = self.__demean(values)
+            filtered, self._zi = sig.sosfilt(self._sos, filtered, zi=self._zi)
+
+        # the cascade lags by one sample: output n belongs to the timestamp of sample n-1
+        pending = np.concatenate((self._pending_times, times))
+        filtered = filtered[len(filtered) - (len(pending) - 1):]
+        filtered_times = pending[:-1]
+        self._pending_times = pending[-1:]
+
+        with PROFILER.span("stream.find_peaks", "peaks"):
+            return self.__find_peaks(filtered, filtered_times)
+
+    """ ================================================================================
+    Ends the stream: the samples still held back to estimate the sample rate (a stream
+    shorter than RATE_SAMPLES) go through the filter chain with the rate of the ones
+    there are, so a short stream counts the steps the batch pedometer finds in it
+    :return: (tuple) values and timestamps of the peaks found in the held samples
+    ================================================================================ """
+    def flush(self):
+        if self._resampler is not None or len(self._warmup_times) < 2:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        times, values = self._warmup_times, self._warmup_values
+        self._warmup_times = self._warmup_times[:0]
+        self._warmup_values = self._warmup_values[:0]
+        self.__configure(estimate_rate(times))
+        return self.update(times, values)
@@ -0,0 +1,280 @@
+# Imports
+import numpy as np
+from my_wearable.filters import FILTER_BANK
+from my_wearable.lazy import LazyModule
+from my_wearable.resample import estimate_rate, processing_rate, step_cutoff
+from my_wearable.steps import StepDetector
+
+# scipy.signal is imported on first use (see my_wearable.lazy)
+sig = LazyModule("scipy.signal")
+
+# Number of intervals the sample rate is estimated from, so that it does not cost more
+# on long histories
+RATE_INTERVALS = 4096
+
+class _Window:
+
+    """ ================================================================================
+    Constructor of one analyzed window of a stream
+    :param k: (int) number of the window on the time grid
+    :param first: (int) first grid point of the window
+    :param last: (int) last grid point + 1 of the window
+    :param start: (int) first grid point it was filtered from (with the warm-up)
+    :param stop: (int) last grid point + 1 it was filtered to (with the margin)
+    :param filtered: (np.ndarray) filtered values of the grid points [first, last)
+    :param steps: (np.ndarray) timestamps of the steps whose peak falls in the window
+    :param complete: (bool) whether the window and its margin were inside the stream,
+                     in which case new samples do not change it
+    :return: None
+    ================================================================================ """
+    def __init__(self, k, first, last, start, stop, filtered, steps, complete):
+        self.k = k
+        self.first = first
+        self.last = last
+        self.start = start
+        self.stop = stop
+        self.filtered = filtered
+        self.steps = steps
+        self.complete = complete
+        self.merged = None      # steps left once the min interval is enforced
+        self.after = None       # last step before the window, 'merged' was checked against it
+        self.carry = None       # last step up to the end of the window
+        return
+
+
+class WindowedAnalyzer:
+
+    """ ================================================================================
+    Constructor of an incremental step counter. The stream is cut into fixed windows on
+    an absolute time grid (window k always covers the same microseconds), and each
+    window is filtered together with 'warmup' seconds before it (so the filters have
+    settled when the window starts) and 'margin' seconds after it (so the peaks at its
+    end can be confirmed). The samples are expected to be appended at the end of the
+    stream and dropped from its front, as a RingBuffer does: the last sample analyzed
+    is remembered, and a new analysis only filters the windows after it (the tail that
+    was cut short, and the new ones). The filtered output and the steps of the earlier
+    windows are kept as they are. A stream that does not continue the last one (or new
+    filter or detector parameters) is analyzed from scratch.
+    :param window: (float) length of a window in seconds
+    :param warmup: (float) seconds of data filtered before each window
+    :param margin: (float) seconds of data filtered after each window
+    :param detector: (StepDetector) rules deciding which peaks are steps
+    :return: None
+    ================================================================================ """
+    def __init__(self, window=30.0, warmup=2.0, margin=0.5, detector=None):
+        self.window = window
+        self.warmup = warmup
+        self.margin = margin
+        self.detector = detector if detector is not None else StepDetector()
+        self.hits = 0       # windows reused from the last analysis
+        self.misses = 0     # windows filtered
+        self.clear()
+        return
+
+    """ ================================================================================
+    Forgets the last analysis
+    :return: None
+    ================================================================================ """
+    def clear(self):
+        self._windows = []
+        self._params = None
+        self._until = None      # time and value of the last sample analyzed
+        self.rate = None
+        return
+
+    """ ================================================================================
+    Statistics of the windows reused between analyses
+    :return: (dict) hits, misses and number of windows kept
+    ================================================================================ """
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "windows": len(self._windows)}
+
+    """ ================================================================================
+    Resamples, filters and finds the steps of the grid points [start, stop) of a
+    stream. The result only depends on the raw samples around these points.
+    :param times: (np.ndarray) timestamps of the raw samples around the points
+    :param values: (np.ndarray) values of the raw samples around the points
+    :param start: (int) first grid point (with the warm-up)
+    :param stop: (int) last grid point + 1 (with the margin)
+    :param first: (int) first grid point of the window itself
+    :param last: (int) last grid point + 1 of the window itself
+    :param step: (float) grid interval in microseconds
+    :param factor: (int) decimation factor
+    :param sos: (np.ndarray) pedometer cascade
+    :return: (tuple) filtered values of the window, timestamps of its steps
+    ================================================================================ """
+    def __filter_window(self, times, values, start, stop, first, last, step, factor, sos):
+        if factor > 1:
+            # interpolate on the fine grid and decimate with a centered FIR, which has
+            # no delay since the samples on both sides are there
+            taps = FILTER_BANK.decimator(factor)
+            half = (len(taps) - 1) // 2
+            fine = (np.arange(start * factor - half, (stop - 1) * factor + half + 1)) * (step / factor)
+            grid = np.convolve(np.interp(fine, times, values), taps, 'valid')[::factor]
+        else:
+            grid = np.interp(np.arange(start, stop) * step, times, values)
+
+        # start from the steady state of the first value: the cascade has no DC gain, so
+        # the mean does not have to be removed and the filters do not ring at the start
+        zi = sig.sosfilt_zi(sos) * grid[0]
+        filtered = sig.sosfilt(sos, grid, zi=zi)[0]
+        # the cascade lags by one sample
+        filtered = np.append(filtered[1:], filtered[-1:])
+
+        grid_times = np.round(np.arange(start, stop) * step).astype(np.int64)
+        inds, step_times = self.detector.detect(filtered, grid_times, 1e6 / step)
+        own = (inds >= first - start) & (inds < last - start)
+        return filtered[first - start:last - start], step_times[own]
+
+    """ ================================================================================
+    Whether 'times' continues the stream of the last analysis: its last sample is still
+    there, unchanged
+    :param times: (np.ndarray) timestamps of the stream
+    :param values: (np.ndarray) values of the stream
+    :return: (bool) True if the windows of the last analysis can be kept
+    ================================================================================ """
+    def __continues(self, times, values):
+        if self._until is None:
+            return False
+        time, value = self._until
+        i = int(np.searchsorted(times, time, 'right')) - 1
+        return i >= 0 and times[i] == time and values[i] == value
+
+    """ ================================================================================
+    Counts the steps of a whole stream. Only the windows that were not complete at the
+    last analysis, or that the front of the stream moved into, are filtered again.
+    :param times: (np.ndarray) timestamps of the stream (in microseconds, increasing)
+    :param values: (np.ndarray) values of the stream
+    :return: (np.ndarray) timestamps of the steps
+    ================================================================================ """
+    def analyze(self, times, values):
+        times = np.ascontiguousarray(times, dtype=np.int64)
+        values = np.ascontiguousarray(values)
+        if len(times) < 2:
+            self.clear()
+            return np.zeros(0, dtype=np.int64)
+
+        fs = estimate_rate(times, RATE_INTERVALS)
+        rate, factor = processing_rate(fs)
+        cutoff = step_cutoff(fs)
+        step = 1e6 / rate
+        length = max(1, int(round(self.window * rate)))
+        warmup = int(round(self.warmup * rate))
+        margin = int(round(self.margin * rate))
+        params = (rate, factor, cutoff, length, warmup, margin, values.dtype.str, self.detector.lower_bound,
+                  self.detector.upper_bound, self.detector.prominence, self.detector.width,
+                  self.detector.min_interval)
+        if params != self._params or not self.__continues(times, values):
+            self._windows = []
+        self._params = params
+        self._until = (times[-1], values[-1])
+        self.rate = rate
+
+        # grid points inside the stream (no extrapolation, even for the decimation FIR)
+        edge = (FILTER_BANK.decimator(factor).size // 2 + 1) / factor if factor > 1 else 0
+        lowest = int(np.ceil(times[0] / step + edge))
+        highest = int(np.floor(times[-1] / step - edge)) + 1
+        windows = self._windows
+        if highest <= lowest:
+            windows.clear()
+            return np.zeros(0, dtype=np.int64)
+
+        # windows that left the front of the stream, and the tail that was cut short
+        drop = 0
+        while drop < len(windows) and windows[drop].k < lowest // length:
+            drop += 1
+        del windows[:drop]
+        while windows and not windows[-1].complete:
+            windows.pop()
+        self.hits += len(windows)
+
+        sos = FILTER_BANK.pedometer(rate, cutoff=cutoff)
+        geometry = (length, warmup, margin, lowest, highest, edge, step, factor, sos)
+        # the front of the stream moved into the warm-up of the first windows
+        for i, window in enumerate(windows):
+            if window.k * length - warmup >= lowest:
+                break
+            first = max(window.k * length, lowest)
+            if (window.first, window.start) != (first, max(first - warmup, lowest)):
+                self.hits -= 1
+                windows[i] = self.__analyze_window(times, values, window.k, geometry)
+        fresh = len(windows)
+        for k in range(windows[-1].k + 1 if windows else lowest // length, (highest - 1) // length + 1):
+            windows.append(self.__analyze_window(times, values, k, geometry))
+
+        self.__merge(0)
+        self.__merge(fresh)
+        return np.concatenate([window.merged for window in windows])
+
+    """ ================================================================================
+    Filters one window of a stream
+    :param times: (np.ndarray) timestamps of the stream
+    :param values: (np.ndarray) values of the stream
+    :param k: (int) number of the window
+    :param geometry: (tuple) window length, warm-up and margin, first and last + 1 grid
+                     points of the stream, FIR edge, grid interval, decimation factor
+                     and pedometer cascade
+    :return: (_Window) the window
+    ================================================================================ """
+    def __analyze_window(self, times, values, k, geometry):
+        length, warmup, margin, lowest, highest, edge, step, factor, sos = geometry
+        first = max(k * length, lowest)
+        last = min((k + 1) * length, highest)
+        start = max(first - warmup, lowest)
+        stop = min(last + margin, highest)
+        # raw samples the grid points [start, stop) are interpolated from (with integer
+        # keys, so the timestamps are not converted)
+        i = max(int(np.searchsorted(times, np.int64(np.floor((start - edge) * step)), 'right')) - 1, 0)
+        j = int(np.searchsorted(times, np.int64(np.ceil((stop - 1 + edge) * step)), 'left')) + 1
+        self.misses += 1
+        filtered, steps = self.__filter_window(times[i:j], values[i:j], start, stop, first, last, step, factor, sos)
+        complete = last == (k + 1) * length and stop == last + margin
+        return _Window(k, first, last, start, stop, filtered, steps, complete)
+
+    """ ================================================================================
+    Enforces the min interval between steps across the seams, from window 'begin' on.
+    Each peak belongs to the one window its grid point falls in, so the same step is
+    never counted twice and the steps stay in order. The windows are visited until one
+    that was already merged against the same previous step.
+    :param begin: (int) first window to merge
+    :return: None
+    ================================================================================ """
+    def __merge(self, begin):
+        windows = self._windows
+        previous = windows[begin - 1].carry if begin else None
+        min_gap = None if self.detector.min_interval is None else self.detector.min_interval * 1e6
+        for i in range(begin, len(windows)):
+            window = windows[i]
+            if window.merged is not None and window.after == previous:
+                break
+            steps = window.steps
+            if min_gap is not None and previous is not None and len(steps):
+                steps = steps[steps - previous >= min_gap]
+            window.merged = steps
+            window.after = previous
+            window.carry = steps[-1] if len(steps) else previous
+            previous = window.carry
+        return
+
+    """ ================================================================================
+    Filtered signal of the last analysis, assembled from the windows
+    :return: (tuple) timestamps and filtered values on the resampling grid
+    ================================================================================ """
+    def filtered(self):
+        if not self._windows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        grid = np.arange(self._windows[0].first, self._windows[-1].last)
+        return np.round(grid * (1e6 / self.rate)).astype(np.int64), \
+            np.concatenate([window.filtered for window in self._windows])
+
+    """ ================================================================================
+    Positions of steps of the last analysis in the output of filtered(), found without
+    assembling it
+    :param step_times: (np.ndarray) timestamps of the steps
+    :return: (np.ndarray) indices of the steps
+    ================================================================================ """
+    def indices(self, step_times):
+        if not self._windows:
+            return np.zeros(0, dtype=int)
+        step = 1e6 / self.rate
+        return np.round(np.asarray(step_times) / step).astype(int) - self._windows[0].first
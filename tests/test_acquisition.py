@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+import pytest
+from my_wearable.acquisition import BLOCK, COALESCE, DROP_OLDEST, HandoffQueue
+
+
+def batch(start, n=3):
+    times = np.arange(start, start + n, dtype=np.int64)
+    return times, times * 10
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        HandoffQueue(2, "drop_newest")
+
+
+def test_block_waits_for_room():
+    queue = HandoffQueue(2, BLOCK)
+    assert queue.put(*batch(0))
+    assert queue.put(*batch(3))
+    assert not queue.put(*batch(6), timeout=0.05)
+    assert queue.pending_samples() == 6
+
+    # a put blocked on a full queue goes through once the consumer takes a batch
+    done = []
+    producer = threading.Thread(target=lambda: done.append(queue.put(*batch(6), timeout=5)))
+    producer.start()
+    assert queue.get(timeout=1)[0].tolist() == [0, 1, 2]
+    producer.join()
+    assert done == [True]
+    assert queue.dropped_samples == 0
+    assert [queue.get(timeout=1)[0][0] for _ in range(2)] == [3, 6]
+
+
+def test_drop_oldest_keeps_the_newest():
+    queue = HandoffQueue(2, DROP_OLDEST)
+    for start in (0, 3, 6):
+        assert queue.put(*batch(start))
+    assert len(queue) == 2
+    assert queue.dropped_samples == 3
+    assert queue.get(timeout=1)[0].tolist() == [3, 4, 5]
+    assert queue.get(timeout=1)[0].tolist() == [6, 7, 8]
+    assert queue.get(timeout=0.01) is None
+    assert queue.pending_samples() == 0
+
+
+def test_coalesce_merges_into_the_last_batch():
+    queue = HandoffQueue(2, COALESCE)
+    for start in (0, 3, 6, 9):
+        assert queue.put(*batch(start))
+    assert len(queue) == 2
+    assert queue.dropped_samples == 0
+    assert queue.get(timeout=1)[0].tolist() == [0, 1, 2]
+    times, values = queue.get(timeout=1)
+    assert times.tolist() == list(range(3, 12))
+    assert np.array_equal(values, times * 10)
+    assert queue.consumed_samples == queue.queued_samples == 12
@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import io
+import numpy as np
+import pytest
+from benchmarks.synthetic import gait
+from my_wearable.async_ble import AsyncBLE, stream_pedometer
+from my_wearable.frames import TextDecoder
+from my_wearable.metrics import REGISTRY
+from my_wearable.pedometer import Pedometer
+from my_wearable.simulator import HM10Simulator, PtyHM10
+
+MAC = "000000000000"
+
+
+@pytest.fixture
+def pty():
+    servers = []
+
+    def serve(**faults):
+        server = PtyHM10(HM10Simulator(gait(50, 3000), speed=10.0, mac=MAC, **faults)).start()
+        servers.append(server)
+        return server
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+async def connect(server):
+    ble = AsyncBLE(server.port)
+    with contextlib.redirect_stdout(io.StringIO()):
+        await ble.connect(MAC)
+    return ble
+
+
+def test_connects_and_decodes(pty):
+    server = pty()
+
+    async def run():
+        ble = await connect(server)
+        decoder = TextDecoder()
+        times = []
+        while len(times) < 200:
+            times.extend((await ble.read_samples(decoder))[0].tolist())
+        with contextlib.redirect_stdout(io.StringIO()):
+            await ble.close()
+        return times
+    times = asyncio.run(run())
+    assert server.simulator.connects == 1
+    assert np.all(np.diff(times[1:]) > 0)
+
+
+def test_reconnects_on_ok_lost(pty):
+    server = pty()
+
+    async def run():
+        ble = await connect(server)
+        decoder = TextDecoder()
+        await ble.read_samples(decoder)
+        server.simulator.lose_link()
+        times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            while len(times) < 100:
+                times.extend((await ble.read_samples(decoder))[0].tolist())
+        return ble, times
+    reconnects = REGISTRY.counter("ble_reconnects_total", device=server.port).value
+    ble, times = asyncio.run(run())
+    assert ble.reconnects == 1
+    assert REGISTRY.counter("ble_reconnects_total", device=ble.name).value == reconnects + 1
+    assert server.simulator.connects == 2
+    assert np.all(np.diff(times) > 0)
+
+
+def test_one_loop_serves_many_devices(pty):
+    servers = [pty() for _ in range(3)]
+
+    async def run():
+        bles = await asyncio.gather(*(connect(server) for server in servers))
+        pedometers = [Pedometer(3000, file_flag=False, streaming=True) for _ in servers]
+        return await asyncio.gather(*(stream_pedometer(ble, pedometer, 150)
+                                      for ble, pedometer in zip(bles, pedometers)))
+    counts = asyncio.run(run())
+    assert all(count >= 150 for count in counts)
+
+
+def test_read_error_is_raised_and_counted(pty):
+    server = pty()
+
+    async def run():
+        ble = await connect(server)
+        decoder = TextDecoder()
+        await ble.read_samples(decoder)
+
+        def read(size):
+            raise OSError("device went away")
+        ble._ser.read = read
+        errors = REGISTRY.counter("ble_read_errors_total", device=ble.name).value
+        with pytest.raises(OSError, match="went away"):
+            while True:
+                await ble.read_samples(decoder)
+        with pytest.raises(OSError):
+            await ble.read_line()
+        return REGISTRY.counter("ble_read_errors_total", device=ble.name).value - errors
+    assert asyncio.run(run()) == 1
+
+
+class Collector:
+
+    # stands in for a Pedometer, keeps what it is fed
+    name = "collector"
+
+    def __init__(self):
+        self.times = []
+
+    def append_batch(self, times, values):
+        self.times.extend(times.tolist())
+
+    def flush(self):
+        return
+
+
+def test_stream_feeds_the_samples_held_back(pty):
+    server = pty()
+
+    async def run():
+        ble = await connect(server)
+        decoders = []
+        read_samples = ble.read_samples
+
+        async def spy(decoder, *args):
+            decoders.append(decoder)
+            return await read_samples(decoder, *args)
+        ble.read_samples = spy
+        collector = Collector()
+        count = await stream_pedometer(ble, collector, 100)
+        return collector, count, decoders[-1]
+    collector, count, decoder = asyncio.run(run())
+    assert count == len(collector.times) >= 100
+    assert collector.times[-1] == decoder.timestamp
+    assert decoder.flush()[0].size == 0
@@ -0,0 +1,92 @@
+import contextlib
+import io
+import numpy as np
+from benchmarks.synthetic import FakeSerial, gait
+from my_wearable.ble import BLE
+from my_wearable.frames import BinaryDecoder, TextDecoder
+from my_wearable.simulator import FakeHM10, HM10Simulator
+
+MAC = "000000000000"
+SPEED = 50.0
+
+
+def lost_link(data):
+    ble = BLE(FakeSerial(data))
+    lost = []
+    ble.check_connection = lost.append
+    return ble, lost
+
+
+def test_read_frames_keeps_the_frames_before_ok_lost():
+    ble, lost = lost_link(b"100,1;200,2;300,3;40OK+LOST")
+    assert ble.read_frames() == ["100,1", "200,2", "300,3"]
+    assert lost == ["40OK+LOST"]
+
+
+def test_read_samples_keeps_the_frames_before_ok_lost():
+    ble, lost = lost_link(b"100,1;200,2;300,3;400,4;500,5;60OK+LOST")
+    decoder = TextDecoder()
+    times, _ = ble.read_samples(decoder)
+    assert times.tolist() + decoder.flush()[0].tolist() == [100, 200, 300, 400, 500]
+    assert lost == ["60OK+LOST"]
+
+
+def connected(simulator):
+    with contextlib.redirect_stdout(io.StringIO()):
+        ble = BLE(FakeHM10(simulator), time_scale=1.0 / SPEED)
+        ble.connect(MAC)
+    return ble
+
+
+def read(ble, decoder, n):
+    times = []
+    for _ in range(n):
+        times.extend(ble.read_samples(decoder, block=True)[0].tolist())
+    return times
+
+
+def test_reconnects_on_ok_lost():
+    simulator = HM10Simulator(gait(50, 2000), speed=SPEED, mac=MAC)
+    ble = connected(simulator)
+    decoder = TextDecoder()
+    times = read(ble, decoder, 10)
+    simulator.lose_link()
+    with contextlib.redirect_stdout(io.StringIO()):
+        times += read(ble, decoder, 20)
+    assert ble.reconnects == 1
+    assert simulator.connects == 2
+    assert len(times) > 0 and np.all(np.diff(times) > 0)
+
+
+def test_frame_mode_switches_both_ways():
+    simulator = HM10Simulator(gait(50, 2000), speed=SPEED, mac=MAC)
+    ble = connected(simulator)
+    decoder = TextDecoder()
+    # the first frame is cut by the end of the handshake (see main.py)
+    times = read(ble, decoder, 10)[1:]
+    for binary in (True, False, True):
+        decoder, switched, _ = ble.frame_mode(decoder, binary)
+        assert simulator.binary == binary
+        assert isinstance(decoder, BinaryDecoder if binary else TextDecoder)
+        times += switched.tolist() + read(ble, decoder, 10)
+    # no sample lost or out of place at the switches
+    intervals = np.diff(times)
+    assert np.all(intervals > 0)
+    assert intervals.max() < 100000
+
+    # the handshake of a reconnection ("AT") keeps the format
+    with contextlib.redirect_stdout(io.StringIO()):
+        ble.connect(MAC)
+    assert simulator.binary
+
+
+def test_close_port_ignores_a_port_already_gone():
+    def gone():
+        raise OSError("device went away")
+    port = FakeSerial(b"100,1;")
+    port.close = gone
+    BLE(port).close_port()
+    simulator = HM10Simulator(gait(50, 100), speed=SPEED, mac=MAC)
+    ble = BLE(FakeHM10(simulator))
+    ble.close_port()
+    assert ble._ser.closed
@@ -0,0 +1,86 @@
+from collections import deque
+import numpy as np
+import pytest
+from my_wearable.buffer import RingBuffer
+
+
+def test_append_across_the_wrap():
+    buffer = RingBuffer(4, np.int64)
+    for value in range(7):
+        buffer.append(value)
+    assert len(buffer) == 4
+    assert buffer.view().tolist() == [3, 4, 5, 6]
+    assert buffer.view(2).tolist() == [5, 6]
+
+
+def test_extend_across_the_wrap():
+    buffer = RingBuffer(5, np.int64)
+    buffer.extend([0, 1, 2])
+    buffer.extend([3, 4, 5, 6])
+    assert buffer.view().tolist() == [2, 3, 4, 5, 6]
+    buffer.append(7)
+    buffer.extend([8])
+    assert buffer.view().tolist() == [4, 5, 6, 7, 8]
+
+
+def test_extend_longer_than_capacity_keeps_the_last_samples():
+    buffer = RingBuffer(4, np.int64)
+    buffer.append(-1)
+    buffer.extend(np.arange(10))
+    assert len(buffer) == 4
+    assert buffer.view().tolist() == [6, 7, 8, 9]
+
+
+def test_view_is_read_only_and_not_a_copy():
+    buffer = RingBuffer(4, float)
+    buffer.extend([1.0, 2.0, 3.0])
+    view = buffer.view()
+    assert np.shares_memory(view, buffer._storage)
+    with pytest.raises(ValueError):
+        view[0] = 0.0
+
+
+def test_view_stays_correct_until_its_samples_are_overwritten():
+    buffer = RingBuffer(6, np.int64)
+    buffer.extend(np.arange(9))
+    view = buffer.view(2)
+    expected = view.tolist()
+    # the 4 samples in front of the view are overwritten first
+    for value in range(100, 104):
+        buffer.append(value)
+        assert view.tolist() == expected
+    assert buffer.view().tolist() == [7, 8, 100, 101, 102, 103]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_a_bounded_deque(seed):
+    rng = np.random.default_rng(seed)
+    buffer = RingBuffer(7, np.int64)
+    model = deque(maxlen=7)
+    value = 0
+    for _ in range(300):
+        if rng.random() < 0.5:
+            buffer.append(value)
+            model.append(value)
+            value += 1
+        else:
+            values = np.arange(value, value + rng.integers(0, 20))
+            buffer.extend(values)
+            model.extend(values.tolist())
+            value += len(values)
+        n = int(rng.integers(0, 9))
+        assert buffer.view().tolist() == list(model)
+        assert buffer.view(n).tolist() == list(model)[len(model) - min(n, len(model)):]
+
+
+def test_zero_capacity_and_clear():
+    empty = RingBuffer(0, np.int64)
+    empty.append(1)
+    empty.extend([1, 2])
+    assert len(empty) == 0 and empty.view().tolist() == []
+    buffer = RingBuffer(3, np.int64)
+    buffer.extend([1, 2, 3])
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.append(4)
+    assert buffer.view().tolist() == [4]
@@ -0,0 +1,24 @@
+import numpy as np
+from my_wearable.clock import GatewayClock
+
+
+def test_gateway_clock_never_goes_back():
+    now = [100.0]
+    clock = GatewayClock(clock=lambda: now[0])
+    clock.arrived(np.array([0, 1000000]))
+    now[0] = 105.0      # the gateway time now maps the next batch 0.5s earlier
+    clock.arrived(np.array([9000000, 9500000]))
+    assert clock.rebases == 1
+    times = np.arange(0, 9600000, 100000)
+    assert np.all(np.diff(clock.convert(times)) >= 0)
+    assert clock.convert([9500000])[0] == 105000000
+
+
+def test_gateway_clock_keeps_the_offset_within_the_tolerance():
+    now = [100.0]
+    clock = GatewayClock(clock=lambda: now[0])
+    clock.arrived(np.array([0, 1000000]))
+    now[0] = 102.5
+    clock.arrived(np.array([2000000, 3000000]))
+    assert clock.rebases == 0
+    assert clock.convert([3000000])[0] == 102000000
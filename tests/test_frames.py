@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from benchmarks.synthetic import ascii_frames, corrupt, gait
+from my_wearable.frames import FIELD_LIMIT, FRAME_SIZE, FRAME_SYNC, BinaryDecoder, TextDecoder
+
+
+# Decodes a byte stream 'chunk' bytes at a time, like a live link delivers it
+def decode(decoder, data, chunk=None):
+    chunk = chunk or len(data)
+    buffer = bytearray()
+    times, values = [], []
+    for start in range(0, len(data), chunk):
+        buffer += data[start:start + chunk]
+        t, v, consumed = decoder.decode(buffer)
+        del buffer[:consumed]
+        times.append(t)
+        values.append(v)
+    t, v = decoder.flush()
+    return np.concatenate(times + [t]), np.concatenate(values + [v])
+
+
+# Encodes samples as the binary frames of MyWearable.ino
+def binary_frames(deltas, values):
+    out = bytearray()
+    for delta, value in zip(deltas, values):
+        body = [delta & 0xFF, (delta >> 8) & 0xFF, (delta >> 16) & 0xFF, value & 0xFF, (value >> 8) & 0xFF]
+        out += bytes([FRAME_SYNC] + body + [body[0] ^ body[1] ^ body[2] ^ body[3] ^ body[4]])
+    return bytes(out)
+
+
+def test_text_decodes_clean_frames():
+    times, values = gait(50, 500)
+    decoded = decode(TextDecoder(), ascii_frames(times, values))
+    assert np.array_equal(decoded[0], times)
+    assert np.array_equal(decoded[1], values)
+
+
+# A damaged stream crossing the micros() wrap, with a restart of the wearable
+def wrap_and_restart(seed):
+    times, values = gait(50, 2000, seed=seed)
+    times = times - times[0] + FIELD_LIMIT - 200 * 20000
+    times[1000:] -= times[1000] - 3000000
+    return corrupt(ascii_frames(times % FIELD_LIMIT, values), rate=0.01, seed=seed)
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 37, 64, 1000])
+@pytest.mark.parametrize("seed", [1, 77])
+def test_text_chunks_match_one_batch(chunk, seed):
+    for data in (corrupt(ascii_frames(*gait(50, 2000)), rate=0.005, seed=seed), wrap_and_restart(seed)):
+        decoder = TextDecoder()
+        whole = decode(decoder, data)
+        chunked_decoder = TextDecoder()
+        chunked = decode(chunked_decoder, data, chunk)
+        assert np.array_equal(whole[0], chunked[0])
+        assert np.array_equal(whole[1], chunked[1])
+        assert chunked_decoder.restarts == decoder.restarts
+        assert chunked_decoder.invalid_frames == decoder.invalid_frames
+
+
+def test_text_frame_too_long_is_dropped_across_chunks():
+    # two lost ';' and a lost comma leave one run too long to be a frame, whose last
+    # bytes would parse as "timestamp,value"
+    data = b"100,1;200,2;300,3;400,4;" + b"5000,5 600,6 700 7000,7;" + b"800,8;900,9;1000,10;1100,11;"
+    for chunk in (None, 1, 5):
+        times, _ = decode(TextDecoder(), data, chunk)
+        assert times.tolist() == [100, 200, 300, 400, 800, 900, 1000, 1100]
+
+
+def test_text_resynchronizes_after_garbage():
+    data = b"100,1;200,2;\xff\xfeOK+CONN300,3;4,00,4;500,5;600,6;700,7;800,8;"
+    decoder = TextDecoder()
+    times, values = decode(decoder, data)
+    assert times.tolist() == [100, 200, 300, 500, 600, 700, 800]
+    assert values.tolist() == [1, 2, 3, 5, 6, 7, 8]
+    assert decoder.invalid_frames == 1
+    assert decoder.dropped_bytes > 0
+
+
+def test_text_rejects_outliers():
+    data = b"100,1;200,2;300,3;99999999,4;400,5;500,6;600,7;700,8;"
+    times, _ = decode(TextDecoder(), data)
+    assert times.tolist() == [100, 200, 300, 400, 500, 600, 700]
+
+
+def test_text_unwraps_micros():
+    unwrapped = FIELD_LIMIT - 100 * 20000 + np.arange(300, dtype=np.int64) * 20000
+    data = ascii_frames(unwrapped % FIELD_LIMIT, np.arange(300))
+    for chunk in (None, 13):
+        times, values = decode(TextDecoder(), data, chunk)
+        assert np.array_equal(times, unwrapped)
+        assert np.array_equal(values, np.arange(300))
+
+
+def test_text_rebases_a_restart():
+    before = 1000000000 + np.arange(50, dtype=np.int64) * 20000
+    after = 5000000 + np.arange(3000, dtype=np.int64) * 20000
+    data = ascii_frames(np.concatenate((before, after)), np.arange(3050))
+    for chunk in (None, 1, 37):
+        decoder = TextDecoder()
+        times, values = decode(decoder, data, chunk)
+        assert len(times) == 3050
+        assert decoder.restarts == 1
+        assert decoder.rejected_samples == 0
+        assert np.all(np.diff(times) > 0)
+        assert np.array_equal(np.diff(times)[50:], np.diff(after))
+
+
+def test_binary_decodes_from_the_seed():
+    deltas = np.full(100, 20000)
+    values = np.arange(100)
+    decoder = BinaryDecoder(timestamp=1000)
+    times, decoded = decode(decoder, binary_frames(deltas, values))
+    assert np.array_equal(times, 1000 + np.cumsum(deltas))
+    assert np.array_equal(decoded, values)
+    assert decoder.timestamp == times[-1]
+
+
+def test_binary_resynchronizes_after_garbage():
+    data = bytearray(binary_frames([20000] * 10, range(10)))
+    data[3 * FRAME_SIZE + 4] ^= 0xFF                        # bad checksum
+    data[6 * FRAME_SIZE:6 * FRAME_SIZE] = b"\x00\xa5OK+"    # noise with a sync byte
+    decoder = BinaryDecoder()
+    times, values = decode(decoder, bytes(data), 5)
+    assert values.tolist() == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert decoder.invalid_frames >= 1
+
+
+def test_binary_timestamps_cross_the_wrap():
+    # deltas only: the timestamps keep increasing where micros() wraps around
+    decoder = BinaryDecoder(timestamp=FIELD_LIMIT - 30000)
+    times, _ = decode(decoder, binary_frames([20000] * 3, [1, 2, 3]))
+    assert times.tolist() == [FIELD_LIMIT - 10000, FIELD_LIMIT + 10000, FIELD_LIMIT + 30000]
+
+
+
+def test_text_resumes_after_binary():
+    decoder = TextDecoder()
+    decode(decoder, b"100,1;200,2;300,3;400,4;")
+    decoder.resume(FIELD_LIMIT + 500)
+    times, _ = decode(decoder, b"600,5;700,6;800,7;")
+    assert times.tolist() == [FIELD_LIMIT + 600, FIELD_LIMIT + 700, FIELD_LIMIT + 800]
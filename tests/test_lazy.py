@@ -0,0 +1,30 @@
+import pickle
+import sys
+import pytest
+from benchmarks.startup import MODULES, import_time
+from my_wearable.lazy import LazyModule
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_loads_no_heavy_module(module):
+    _, loaded = import_time(module, repeat=1)
+    assert loaded == []
+
+
+def test_module_is_imported_on_first_use():
+    module = LazyModule("json")
+    assert "imported" not in repr(module)
+    assert module.dumps([1]) == "[1]"
+    assert module.load() is sys.modules["json"]
+    assert "imported" in repr(module)
+
+
+def test_missing_module_fails_on_first_use():
+    module = LazyModule("no_such_module_here")
+    with pytest.raises(ImportError):
+        module.load()
+
+
+def test_unpickled_module_is_not_broken():
+    module = pickle.loads(pickle.dumps(LazyModule("json")))
+    assert module.dumps([1]) == "[1]"
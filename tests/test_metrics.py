@@ -0,0 +1,73 @@
+import threading
+import pytest
+from my_wearable.frames import TextDecoder
+from my_wearable.metrics import MemorySink, Registry, REGISTRY, prometheus_text
+from my_wearable.pedometer import Pedometer
+
+
+def test_counter_shared_by_threads_loses_nothing():
+    counter = Registry().counter("parse_errors_total", device="wearable")
+
+    def bump():
+        for _ in range(20000):
+            counter.inc()
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.value == 80000
+
+
+def test_histogram_shared_by_threads_loses_nothing():
+    histogram = Registry().histogram("batch_seconds", device="wearable")
+
+    def observe():
+        for _ in range(20000):
+            histogram.observe(0.001)
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts, total, count = histogram.state()
+    assert count == sum(counts) == 80000
+    assert total == pytest.approx(80.0)
+
+
+def test_unnamed_pedometers_keep_their_own_metrics():
+    first, second = Pedometer(10, file_flag=False), Pedometer(10, file_flag=False)
+    assert first.name != second.name
+    first.append("1000,5")
+    samples = {m["labels"]["device"]: m["value"] for m in REGISTRY.snapshot()["metrics"] if m["name"] == "samples_total"}
+    assert samples[first.name] == 1 and samples[second.name] == 0
+
+
+def test_a_metric_keeps_its_kind():
+    registry = Registry()
+    assert registry.counter("frames_total", device="a") is registry.counter("frames_total", device="a")
+    with pytest.raises(ValueError):
+        registry.gauge("frames_total", device="a")
+
+
+def test_prometheus_text_and_rates():
+    registry = Registry()
+    registry.counter("frames_total", device="a").inc(5)
+    registry.histogram("stage_seconds", buckets=(0.1, 1.0), device="a").observe(0.5)
+    text = prometheus_text(registry.snapshot())
+    assert '# TYPE heuristic_pedometer_frames_total counter' in text
+    assert 'heuristic_pedometer_frames_total{device="a"} 5' in text
+    assert 'heuristic_pedometer_stage_seconds_bucket{device="a",le="0.1"} 0' in text
+    assert 'heuristic_pedometer_stage_seconds_bucket{device="a",le="+Inf"} 1' in text
+
+    sink = MemorySink()
+    sink.write({"timestamp": 0.0, "metrics": [{"name": "frames_total", "labels": {}, "type": "counter", "value": 0}]})
+    sink.write({"timestamp": 2.0, "metrics": [{"name": "frames_total", "labels": {}, "type": "counter", "value": 10}]})
+    assert sink.rates() == {("frames_total", ()): 5.0}
+
+
+def test_counter_names_end_in_total():
+    Pedometer(10, file_flag=False, name="names")
+    TextDecoder(name="names")
+    counters = [m["name"] for m in REGISTRY.snapshot()["metrics"] if m["type"] == "counter"]
+    assert counters and all(name.endswith("_total") for name in counters)
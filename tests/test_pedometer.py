@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pytest
+from benchmarks.synthetic import DATA_DIR, gait
+from my_wearable.multistream import MultiStreamFilter
+from my_wearable.pedometer import Pedometer
+from my_wearable.recording import cache_path, load_recording, save_recording
+from my_wearable.streaming import MAX_PLATEAU, StreamingFilter
+
+
+def stream(times, values, batch):
+    pedometer = Pedometer(len(times), file_flag=False, streaming=True)
+    steps = [pedometer.append_batch(times[k:k + batch], values[k:k + batch]) for k in range(0, len(times), batch)]
+    return pedometer.get_steps(), np.concatenate(steps)
+
+
+@pytest.mark.parametrize("frequency", [50, 100])
+def test_streaming_steps_do_not_depend_on_the_batches(frequency):
+    times, values = gait(frequency, 6000, seed=frequency)
+    count, steps = stream(times, values, len(times))
+    assert count > 0
+    assert count == len(steps)
+    assert np.all(np.diff(steps) > 0)
+    for batch in (1, 7, 64, 500):
+        assert stream(times, values, batch)[1].tolist() == steps.tolist()
+
+
+@pytest.mark.parametrize("frequency", ["0.1", "2", "5", "50", "100"])
+def test_streaming_total_matches_process(frequency):
+    filename = os.path.join(DATA_DIR, "walking_{}hz.txt".format(frequency))
+    recording = load_recording(filename, cache=False)
+    for batch in (1, 10, len(recording)):
+        pedometer = Pedometer(len(recording), file_flag=False, streaming=True)
+        for k in range(0, len(recording), batch):
+            pedometer.append_batch(recording[k:k + batch, 0], recording[k:k + batch, 1])
+        pedometer.flush()
+        assert pedometer.get_steps() == Pedometer(0, file_flag=True).process(filename, show=False)
+
+
+def test_streaming_tail_stays_bounded_at_rest():
+    stream = StreamingFilter(fs=50)
+    times = np.arange(50000, dtype=np.int64) * 20000
+    for k in range(0, len(times), 100):
+        stream.update(times[k:k + 100], np.full(100, 1000))
+        assert len(stream._peak_tail) <= MAX_PLATEAU + 1
+
+
+def test_multistream_tail_stays_bounded_at_rest():
+    together = MultiStreamFilter(2, 50)
+    times = np.tile(np.arange(20000, dtype=np.int64) * 20000, (2, 1))
+    for k in range(0, times.shape[1], 100):
+        together.update(np.full((2, 100), 1000.0), times=times[:, k:k + 100])
+        assert together._tail.shape[1] <= MAX_PLATEAU + 1
+
+
+def test_multistream_matches_one_stream_at_a_time():
+    values = np.stack([gait(50, 3000, seed=seed)[1] for seed in range(3)]).astype(float)
+    times = np.tile(np.arange(3000, dtype=np.int64) * 20000, (3, 1))
+
+    together = MultiStreamFilter(3, 50)
+    steps = [together.update(values[:, k:k + 25], times=times[:, k:k + 25]) for k in range(0, 3000, 25)]
+    rows = np.concatenate([row for row, _ in steps])
+    step_times = np.concatenate([t for _, t in steps])
+    assert together.steps.min() > 0
+
+    for i in range(3):
+        alone = MultiStreamFilter(1, 50)
+        found = [alone.update(values[i:i + 1, k:k + 100], times=times[i:i + 1, k:k + 100])[1]
+                 for k in range(0, 3000, 100)]
+        assert np.concatenate(found).tolist() == step_times[rows == i].tolist()
+
+
+def test_loading_from_the_cache_matches_the_text(tmp_path):
+    times, values = gait(50, 3000)
+    filename = str(tmp_path / "walk.txt")
+    save_recording(filename, times, values)
+    steps = []
+    for _ in range(2):      # parses the text and writes the cache, then maps the cache
+        pedometer = Pedometer(len(times), file_flag=False)
+        pedometer.load_file(filename)
+        steps.append(pedometer.count_steps())
+    assert os.path.exists(cache_path(filename))
+    assert steps[0] == steps[1] > 0
+    # the buffers own their copy of the samples, the map stays read-only
+    pedometer.append_batch(times[-1:] + 20000, values[-1:])
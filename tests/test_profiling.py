@@ -0,0 +1,87 @@
+import json
+import threading
+import numpy as np
+import pytest
+from benchmarks.synthetic import ascii_frames, gait
+from my_wearable.frames import TextDecoder
+from my_wearable.pedometer import Pedometer
+from my_wearable.profiling import NULL_SPAN, PROFILER, Profiler, format_summary
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    assert profiler.span("stage") is NULL_SPAN
+    with profiler.span("stage"):
+        pass
+    assert profiler.spans() == []
+
+
+def test_self_time_leaves_out_nested_stages():
+    profiler = Profiler()
+    profiler.enable(malloc_every=0)
+    with profiler.span("outer"):
+        with profiler.span("inner"):
+            sum(range(200000))
+    profiler.disable()
+    stages = {row["stage"]: row for row in profiler.summary()["stages"]}
+    assert stages["outer"]["self_ms"] < stages["outer"]["total_ms"]
+    assert stages["inner"]["self_ms"] == pytest.approx(stages["inner"]["total_ms"])
+    assert stages["outer"]["self_ms"] + stages["inner"]["self_ms"] == pytest.approx(stages["outer"]["total_ms"])
+
+
+def test_sampled_spans_measure_allocations():
+    profiler = Profiler()
+    profiler.enable(malloc_every=2)
+    for _ in range(4):
+        with profiler.span("alloc"):
+            block = bytearray(1 << 20)
+            del block
+    profiler.disable()
+    allocated = [span[5] for span in profiler.spans()]
+    assert [a is not None for a in allocated] == [True, False, True, False]
+    assert profiler.summary()["stages"][0]["mean_allocated_kb"] is not None
+
+
+def test_trace_has_a_row_per_thread(tmp_path):
+    profiler = Profiler()
+    profiler.enable(malloc_every=0)
+
+    # the threads are all alive at once, so they do not share an ident
+    barrier = threading.Barrier(3)
+
+    def work():
+        with profiler.span("work", "test"):
+            barrier.wait()
+    threads = [threading.Thread(target=work, name="worker-{}".format(i)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.disable()
+    profiler.write_trace(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert len({event["tid"] for event in events if event["ph"] == "X"}) == 3
+    assert {event["args"]["name"] for event in events if event["ph"] == "M"} == {"worker-0", "worker-1", "worker-2"}
+
+
+def test_full_replay_profiles_the_pipeline_stages():
+    data = ascii_frames(*gait(50, 3000))
+    PROFILER.clear()
+    PROFILER.enable(malloc_every=10)
+    try:
+        decoder = TextDecoder()
+        pedometer = Pedometer(3000, file_flag=False, streaming=True)
+        for start in range(0, len(data), 256):
+            times, values, _ = decoder.decode(data[start:start + 256])
+            if len(times):
+                pedometer.append_batch(times, values)
+        pedometer.count_steps()
+    finally:
+        PROFILER.disable()
+    summary = PROFILER.summary()
+    PROFILER.clear()
+    stages = {row["stage"]: row for row in summary["stages"]}
+    assert {"stream.update", "stream.resample", "stream.cascade", "stream.find_peaks"} <= set(stages)
+    assert all(row["self_ms"] <= row["total_ms"] + 1e-9 for row in stages.values())
+    assert np.isclose(sum(row["self_percent"] for row in summary["stages"]), 100.0)
+    assert "stage" in format_summary(summary)
@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pytest
+from benchmarks.synthetic import DATA_DIR
+from my_wearable.pedometer import Pedometer
+from my_wearable.resample import Resampler
+
+
+def resample(resampler, times, values, chunk=None):
+    chunk = chunk or len(times)
+    parts = [resampler.update(times[k:k + chunk], values[k:k + chunk]) for k in range(0, len(times), chunk)]
+    return np.concatenate([t for t, _ in parts]), np.concatenate([v for _, v in parts])
+
+
+@pytest.mark.parametrize("chunk", [None, 1, 7])
+def test_a_lost_link_starts_a_new_grid(chunk):
+    times = np.concatenate((np.arange(100), 5000 + np.arange(100))).astype(np.int64) * 20000
+    grid, _ = resample(Resampler(50, fs=50), times, np.arange(200), chunk)
+    # nothing is interpolated across the gap, and the second grid starts on its first sample
+    assert not np.any((grid > times[99]) & (grid < times[100]))
+    assert times[100] in grid
+    assert np.all(np.diff(grid) > 0)
+
+
+def test_timestamps_going_back_start_a_new_grid():
+    times = np.concatenate((np.arange(50, 100), np.arange(50))).astype(np.int64) * 20000
+    grid, values = resample(Resampler(50, fs=50), times, np.arange(100))
+    assert grid.tolist() == times.tolist()
+    assert values.tolist() == list(range(100))
+
+
+def test_repeated_timestamps_are_dropped():
+    times = np.arange(100, dtype=np.int64) * 20000
+    values = np.arange(100) * 3
+    expected = resample(Resampler(50, fs=50), times, values)
+    repeated = np.insert(times, [10, 10, 60], times[[9, 9, 59]])
+    grid, resampled = resample(Resampler(50, fs=50), repeated, np.insert(values, [10, 10, 60], -1), 7)
+    assert grid.tolist() == expected[0].tolist()
+    assert np.array_equal(resampled, expected[1])
+
+
+@pytest.mark.parametrize("fs", [None, 0.1])
+def test_slow_streams_are_not_cut(fs):
+    times = np.arange(30, dtype=np.int64) * 10000000
+    grid, _ = resample(Resampler(20, fs=fs), times, np.arange(30))
+    assert grid[0] == times[0] and grid[-1] == times[-1]
+    assert len(grid) == 29 * 10 * 20 + 1
+
+
+def test_pedometer_counts_the_slow_recording():
+    assert Pedometer(10, file_flag=False).process(os.path.join(DATA_DIR, "walking_0.1hz.txt"), show=False) > 0
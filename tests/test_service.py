@@ -0,0 +1,24 @@
+import numpy as np
+from my_wearable.service import StepIndex, StepService
+
+
+def test_step_index_merges_late_steps():
+    index = StepIndex(capacity=2)
+    index.append([10, 20, 30], until=35)
+    snapshot = index.times()
+    index.append([5, 25], until=26)
+    index.append([40, 31])
+    assert index.times().tolist() == [5, 10, 20, 25, 30, 31, 40]
+    assert snapshot.tolist() == [10, 20, 30]
+    assert index.until == 40
+    assert index.count(0, 26) == 4
+
+
+def test_buckets_and_cadence():
+    service = StepService(ttl=0)
+    minute = 60 * 10**6
+    service.record("wearable", np.arange(0, 2 * minute, 10**6), until=2 * minute)
+    buckets = service.buckets("wearable", "minute", 0, 2 * minute)
+    assert buckets["start"] == [0, minute]
+    assert buckets["steps"] == [60, 60]
+    assert service.cadence("wearable") == 60.0
@@ -0,0 +1,76 @@
+import contextlib
+import importlib
+import io
+import time
+import numpy as np
+from benchmarks.synthetic import gait
+from my_wearable.service import StepService
+from my_wearable.session import SessionManager
+from my_wearable.simulator import FakeHM10, HM10Simulator
+from my_wearable.store import SessionStore
+
+SPEED = 50.0
+
+
+def test_session_survives_a_wearable_restart(tmp_path):
+    # loaded up front: the playback starts with the simulator, not with the session
+    importlib.import_module("scipy.signal")
+    # the wearable restarts after 1000 samples: micros() starts over near 0
+    times, values = gait(50, 2500)
+    times[1000:] -= times[1000] - 5000000
+    simulator = HM10Simulator((times, values), speed=SPEED, mac="000000000000", loop=False)
+    store = SessionStore(str(tmp_path))
+    service = StepService()
+    session = SessionManager([(FakeHM10(simulator), simulator.mac)], 1, store, service, time_scale=1.0 / SPEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        session.start()
+        time.sleep(2.0)
+        session.stop()
+
+    device = session.report()["devices"][0]
+    assert device["clock_restarts"] == 1
+    assert device["failed_batches"] == device["failed_stores"] == device["failed_records"] == 0
+    assert device["steps"] > 0
+    name = device["device"]
+    archived, _, steps = store.query(name)
+    assert len(archived) == device["samples"]
+    assert np.all(np.diff(archived) > 0)
+    assert len(steps) == service.totals()[name]["steps"] == device["steps"]
+    store.close()
+
+
+def test_binary_format_is_set_again_after_ok_lost():
+    importlib.import_module("scipy.signal")
+    simulator = HM10Simulator(gait(50, 3000), speed=SPEED, mac="000000000000")
+    session = SessionManager([(FakeHM10(simulator), simulator.mac)], 1, time_scale=1.0 / SPEED, binary=True)
+    device = session.devices[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        session.start()
+        time.sleep(0.5)
+        assert simulator.binary
+        # the wearable restarts: the link drops and it comes back sending text frames
+        simulator.restart()
+        time.sleep(0.5)
+        samples = device.queue.queued_samples
+        time.sleep(0.5)
+        session.stop()
+
+    assert device.reconnects == 1
+    assert simulator.binary
+    assert device.queue.queued_samples - samples > 100
+
+
+class FailingService:
+    def record(self, device, steps, until):
+        raise RuntimeError("service down")
+
+
+def test_service_failures_are_counted_apart():
+    simulator = HM10Simulator(gait(50, 100), mac="000000000000")
+    session = SessionManager([(FakeHM10(simulator), simulator.mac)], 1, service=FailingService())
+    device = session.devices[0]
+    times, values = gait(50, 100)
+    session._SessionManager__feed(device, times, values)
+    stats = device.stats()
+    assert stats["failed_records"] == 1
+    assert stats["failed_batches"] == 0
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+from my_wearable.store import SessionStore
+
+DEVICE = "/dev/ttyUSB0"
+
+
+def fill(store, n=1000, batch=70):
+    times = np.arange(n, dtype=np.int64) * 100
+    for k in range(0, n, batch):
+        store.append(DEVICE, times[k:k + batch], times[k:k + batch] // 10, times[k:k + batch:10])
+    return times
+
+
+def test_queries_span_the_segments(tmp_path):
+    store = SessionStore(str(tmp_path), sample_segment=128, step_segment=16)
+    times = fill(store)
+    assert store.devices() == [DEVICE]
+    info = store.info(DEVICE)
+    assert info["samples"] == {"segments": 8, "records": 1000, "first": 0, "last": 99900}
+    assert info["steps"]["records"] == 100
+
+    archived, values, steps = store.query(DEVICE, 12345, 80000)
+    expected = times[(times >= 12345) & (times < 80000)]
+    assert np.array_equal(archived, expected)
+    assert np.array_equal(values, expected // 10)
+    assert np.array_equal(steps, expected[expected % 1000 == 0])
+    assert store.count_steps(DEVICE, 12345, 80000) == len(steps)
+    assert store.count_steps(DEVICE) == 100
+    store.close()
+
+
+def test_rejects_records_out_of_order(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.append(DEVICE, [100, 200], [1, 2])
+    with pytest.raises(ValueError):
+        store.append(DEVICE, [150], [3])
+    with pytest.raises(ValueError):
+        store.append(DEVICE, [300, 250], [3, 4])
+    assert store.query(DEVICE)[0].tolist() == [100, 200]
+    store.close()
+
+
+def test_reopens_after_a_crash(tmp_path):
+    store = SessionStore(str(tmp_path), sample_segment=128)
+    times = fill(store, n=256, batch=256)
+    store.close()
+    directory = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    # the second segment was filled but not indexed, and a record was torn
+    index = os.path.join(directory, "samples.idx")
+    with open(index, 'r+b') as file:
+        file.truncate(os.path.getsize(index) // 2)
+    with open(os.path.join(directory, "samples-000002.bin"), 'wb') as file:
+        file.write(b"\x01" * 5)
+
+    store = SessionStore(str(tmp_path), sample_segment=128)
+    assert store.info(DEVICE)["samples"]["records"] == 256
+    store.append(DEVICE, [times[-1] + 100], [0])
+    assert np.array_equal(store.query(DEVICE)[0], np.append(times, times[-1] + 100))
+    store.close()
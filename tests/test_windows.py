@@ -0,0 +1,47 @@
+from benchmarks.synthetic import gait
+from my_wearable.pedometer import Pedometer
+from my_wearable.steps import StepDetector
+from my_wearable.windows import WindowedAnalyzer
+
+
+def one_shot(times, values, detector=None):
+    return WindowedAnalyzer(window=1e9, detector=detector).analyze(times, values)
+
+
+def test_windows_match_one_shot_and_reuse_the_earlier_ones():
+    times, values = gait(50, 20000)
+    analyzer = WindowedAnalyzer(window=30.0)
+    steps = analyzer.analyze(times[:15000], values[:15000])
+    assert len(steps) > 0
+    assert steps.tolist() == one_shot(times[:15000], values[:15000]).tolist()
+
+    filtered = analyzer.cache_info()["misses"]
+    steps = analyzer.analyze(times, values)
+    assert steps.tolist() == one_shot(times, values).tolist()
+    info = analyzer.cache_info()
+    # only the tail of the first stream and the windows after it were filtered again
+    assert info["hits"] == filtered - 1
+    assert info["misses"] - filtered == info["windows"] - info["hits"]
+    assert info["misses"] - filtered <= 5
+
+
+def test_ring_buffer_moving_forward():
+    times, values = gait(50, 8000, seed=3)
+    pedometer = Pedometer(3000, file_flag=False, analyzer=WindowedAnalyzer(window=10.0))
+    for k in range(0, len(times), 250):
+        pedometer.append_batch(times[k:k + 250], values[k:k + 250])
+        end = min(k + 250, len(times))
+        expected = WindowedAnalyzer(window=10.0).analyze(times[max(0, end - 3000):end], values[max(0, end - 3000):end])
+        assert pedometer.count_steps() == len(expected)
+        assert pedometer.get_step_times().tolist() == expected.tolist()
+
+
+def test_min_interval_is_part_of_the_key():
+    times, values = gait(50, 6000)
+    detector = StepDetector()
+    analyzer = WindowedAnalyzer(window=10.0, detector=detector)
+    loose = analyzer.analyze(times, values)
+    detector.min_interval = 0.8
+    strict = analyzer.analyze(times, values)
+    assert strict.tolist() == one_shot(times, values, StepDetector(min_interval=0.8)).tolist()
+    assert len(strict) < len(loose)